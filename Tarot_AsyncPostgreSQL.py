@@ -0,0 +1,329 @@
+import asyncio
+import json
+from datetime import datetime
+
+import asyncpg
+
+import password_hash
+import reading_search
+import tarot_cards
+from storage_backend import build_user_stats
+
+
+class TarotAsyncPostgreSQLManager:
+    """TarotPostgreSQLManager 的 asyncio 版本
+
+    基于 asyncpg 和它自带的连接池，所有方法都是协程，可以在同一个事件循环里
+    同时进行成百上千个日记操作。SQL 使用 asyncpg 的 $1, $2 占位符。
+    密码哈希是 CPU 密集操作，放到线程池中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, dbname, user, password, host="localhost", port="5432",
+                 min_size=1, max_size=10, password_params=None):
+        self.connection_params = {
+            "database": dbname,
+            "user": user,
+            "password": password,
+            "host": host,
+            "port": int(port)
+        }
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+        # 新密码使用的哈希参数，None 表示 password_hash.DEFAULT_PARAMS
+        self.password_params = password_params
+
+    @staticmethod
+    async def _init_connection(conn):
+        """新连接的初始化：json 列自动解码为 Python 对象"""
+        for json_type in ('json', 'jsonb'):
+            await conn.set_type_codec(
+                json_type, encoder=json.dumps, decoder=json.loads, schema='pg_catalog'
+            )
+
+    async def connect(self):
+        """创建异步连接池"""
+        try:
+            self.pool = await asyncpg.create_pool(
+                min_size=self.min_size,
+                max_size=self.max_size,
+                init=self._init_connection,
+                server_settings={'client_encoding': 'UTF8'},
+                **self.connection_params
+            )
+            print(f"✅ 成功连接到PostgreSQL数据库（异步连接池 {self.min_size}-{self.max_size}）")
+            return True
+        except Exception as e:
+            print(f"❌ 连接失败: {e}")
+            return False
+
+    async def close(self):
+        """关闭异步连接池"""
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+        print("✅ 数据库连接已关闭")
+
+    async def hash_password(self, password):
+        """在线程池中计算密码哈希"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, password_hash.hash_password, password, self.password_params)
+
+    async def verify_password(self, password, stored_hash):
+        """在线程池中验证密码"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, password_hash.verify_password, password, stored_hash)
+
+    async def execute_query(self, query, params=None, fetch=False):
+        """执行查询：fetch=True 返回字典列表，否则返回受影响行数"""
+        try:
+            async with self.pool.acquire() as conn:
+                if fetch:
+                    rows = await conn.fetch(query, *(params or ()))
+                    return [dict(row) for row in rows]
+                status = await conn.execute(query, *(params or ()))
+                # 状态字符串形如 "UPDATE 3" / "INSERT 0 1"
+                last = status.rsplit(' ', 1)[-1]
+                return int(last) if last.isdigit() else 0
+        except Exception as e:
+            print(f"❌ 查询执行失败: {e}")
+            return None
+
+    async def create_user(self, username, password, email=None):
+        """创建新用户"""
+        hashed_password = await self.hash_password(password)
+
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    user_id = await conn.fetchval(
+                        """
+                        INSERT INTO users (username, password_hash, email, last_login)
+                        VALUES ($1, $2, $3, $4) RETURNING id
+                        """,
+                        username, hashed_password, email, datetime.now()
+                    )
+                    await conn.execute("INSERT INTO user_settings (user_id) VALUES ($1)", user_id)
+            print(f"✅ 用户 '{username}' 创建成功，ID: {user_id}")
+            return user_id
+        except Exception as e:
+            print(f"❌ 创建用户失败: {e}")
+            return None
+
+    async def verify_user(self, username, password):
+        """验证用户登录"""
+        query = """
+        SELECT id, username, email, password_hash
+        FROM users
+        WHERE username = $1
+        """
+
+        result = await self.execute_query(query, (username,), fetch=True)
+
+        if result:
+            user = result[0]
+            if await self.verify_password(password, user['password_hash']):
+                if password_hash.needs_rehash(user['password_hash'], self.password_params):
+                    # 哈希参数已过时：按当前参数重新哈希，与更新登录时间合为一条语句
+                    await self.execute_query(
+                        "UPDATE users SET last_login = $1, password_hash = $2 WHERE id = $3",
+                        (datetime.now(), await self.hash_password(password), user['id'])
+                    )
+                else:
+                    await self.execute_query(
+                        "UPDATE users SET last_login = $1 WHERE id = $2",
+                        (datetime.now(), user['id'])
+                    )
+                print(f"✅ 用户 '{username}' 验证成功")
+                return {
+                    'id': user['id'],
+                    'username': user['username'],
+                    'email': user['email']
+                }
+            else:
+                print(f"❌ 密码错误")
+        else:
+            print(f"❌ 用户 '{username}' 不存在")
+
+        return None
+
+    async def user_exists(self, username):
+        """检查用户是否存在"""
+        result = await self.execute_query(
+            "SELECT id FROM users WHERE username = $1", (username,), fetch=True
+        )
+        return result is not None and len(result) > 0
+
+    async def add_tarot_reading(self, user_id, spread_type, question, cards_data, notes=None):
+        """添加塔罗牌占卜记录（记录和牌面在同一事务中写入）"""
+        parsed_cards = [tarot_cards.parse_card_data(card) for card in cards_data]
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    reading_id = await conn.fetchval(
+                        """
+                        INSERT INTO tarot_readings (user_id, spread_type, question, notes)
+                        VALUES ($1, $2, $3, $4) RETURNING id
+                        """,
+                        user_id, spread_type, question, notes
+                    )
+                    await conn.executemany(
+                        """
+                        INSERT INTO reading_cards (reading_id, card_id, card_name, position, reversed, interpretation)
+                        VALUES ($1, $2, $3, $4, $5, $6)
+                        """,
+                        [
+                            (reading_id, card_id, custom_name, card.get('position'),
+                             reversed_, card.get('interpretation', ''))
+                            for card, (card_id, custom_name, reversed_) in zip(cards_data, parsed_cards)
+                        ]
+                    )
+            print(f"✅ 占卜记录添加成功，ID: {reading_id}")
+            return reading_id
+        except Exception as e:
+            print(f"❌ 添加占卜记录失败: {e}")
+            return None
+
+    async def get_user_readings(self, user_id, limit=None):
+        """获取用户的占卜记录"""
+        query = """
+        SELECT
+            tr.id, tr.spread_type, tr.question, tr.reading_date, tr.notes,
+            COALESCE(
+                json_agg(
+                    json_build_object(
+                        'card_id', rc.card_id,
+                        'name', COALESCE(c.name_zh, rc.card_name),
+                        'position', rc.position,
+                        'orientation', CASE WHEN rc.reversed THEN 'reversed' ELSE 'upright' END,
+                        'interpretation', rc.interpretation
+                    ) ORDER BY rc.id
+                ) FILTER (WHERE rc.id IS NOT NULL),
+                '[]'
+            ) as cards
+        FROM tarot_readings tr
+        LEFT JOIN reading_cards rc ON tr.id = rc.reading_id
+        LEFT JOIN cards c ON c.id = rc.card_id
+        WHERE tr.user_id = $1
+        GROUP BY tr.id, tr.spread_type, tr.question, tr.reading_date, tr.notes
+        ORDER BY tr.reading_date DESC
+        """
+
+        if limit:
+            query += " LIMIT $2"
+            result = await self.execute_query(query, (user_id, limit), fetch=True)
+        else:
+            result = await self.execute_query(query, (user_id,), fetch=True)
+
+        return result or []
+
+    async def get_reading_by_id(self, reading_id):
+        """根据ID获取占卜记录"""
+        query = """
+        SELECT
+            tr.id, tr.spread_type, tr.question, tr.reading_date, tr.notes,
+            u.username,
+            COALESCE(
+                json_agg(
+                    json_build_object(
+                        'card_id', rc.card_id,
+                        'name', COALESCE(c.name_zh, rc.card_name),
+                        'position', rc.position,
+                        'orientation', CASE WHEN rc.reversed THEN 'reversed' ELSE 'upright' END,
+                        'interpretation', rc.interpretation
+                    ) ORDER BY rc.id
+                ) FILTER (WHERE rc.id IS NOT NULL),
+                '[]'
+            ) as cards
+        FROM tarot_readings tr
+        JOIN users u ON tr.user_id = u.id
+        LEFT JOIN reading_cards rc ON tr.id = rc.reading_id
+        LEFT JOIN cards c ON c.id = rc.card_id
+        WHERE tr.id = $1
+        GROUP BY tr.id, tr.spread_type, tr.question, tr.reading_date, tr.notes, u.username
+        """
+
+        result = await self.execute_query(query, (reading_id,), fetch=True)
+        return result[0] if result else None
+
+    async def update_user_settings(self, user_id, language=None, theme=None, notification_enabled=None):
+        """更新用户设置"""
+        updates = []
+        params = []
+
+        for column, value in (('language', language), ('theme', theme),
+                              ('notification_enabled', notification_enabled)):
+            if value is not None:
+                params.append(value)
+                updates.append(f"{column} = ${len(params)}")
+
+        if not updates:
+            return False
+
+        params.append(user_id)
+        query = f"UPDATE user_settings SET {', '.join(updates)} WHERE user_id = ${len(params)}"
+
+        result = await self.execute_query(query, params)
+        if result:
+            print("✅ 用户设置更新成功")
+            return True
+        else:
+            print("❌ 用户设置更新失败")
+            return False
+
+    async def get_user_settings(self, user_id):
+        """获取用户设置"""
+        result = await self.execute_query(
+            "SELECT * FROM user_settings WHERE user_id = $1", (user_id,), fetch=True
+        )
+        return result[0] if result else None
+
+    async def delete_reading(self, reading_id):
+        """删除占卜记录"""
+        result = await self.execute_query("DELETE FROM tarot_readings WHERE id = $1", (reading_id,))
+
+        if result:
+            print(f"✅ 占卜记录 {reading_id} 删除成功")
+            return True
+        else:
+            print(f"❌ 占卜记录 {reading_id} 删除失败")
+            return False
+
+    async def get_user_stats(self, user_id):
+        """获取用户统计信息（读取触发器维护的 user_reading_stats，一次主键查询）"""
+        result = await self.execute_query(
+            """
+            SELECT total_readings, last_reading, spread_counts, card_counts
+            FROM user_reading_stats
+            WHERE user_id = $1
+            """,
+            (user_id,), fetch=True
+        )
+        return build_user_stats(result[0] if result else None)
+
+    async def search_readings(self, user_id, keyword, limit=20):
+        """全文检索占卜记录，按相关度排序并附带高亮摘要"""
+        variants = reading_search.keyword_variants(keyword)
+        if not variants:
+            return []
+        count = len(variants)
+
+        query = f"""
+        SELECT
+            tr.id, tr.user_id, tr.spread_type, tr.question, tr.reading_date, tr.notes,
+            ts_rank_cd(rs.document, q) AS rank,
+            (SELECT string_agg(COALESCE(c.name_zh || ' ' || c.name_en, rc.card_name), ' ' ORDER BY rc.id)
+             FROM reading_cards rc LEFT JOIN cards c ON c.id = rc.card_id
+             WHERE rc.reading_id = tr.id) AS card_names,
+            (SELECT string_agg(rc.interpretation, ' ' ORDER BY rc.id)
+             FROM reading_cards rc WHERE rc.reading_id = tr.id) AS interpretations
+        FROM reading_search rs
+        CROSS JOIN (SELECT {reading_search.tsquery_sql(count, "${}")} AS q) AS query
+        JOIN tarot_readings tr ON tr.id = rs.reading_id
+        WHERE rs.user_id = ${count + 1} AND rs.document @@ q
+        ORDER BY rank DESC, tr.reading_date DESC
+        LIMIT ${count + 2}
+        """
+
+        result = await self.execute_query(query, (*variants, user_id, limit), fetch=True) or []
+        return reading_search.attach_snippets(result, variants)
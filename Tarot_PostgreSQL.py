@@ -1,12 +1,62 @@
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values
+from contextlib import contextmanager
 from datetime import datetime
-import hashlib
+import io
+import json
 import secrets
+import threading
+import time
 
+from db_pool import get_shared_pool
+import migrations
+import prepared_statements
+from prepared_statements import PreparedStatement
+from query_stats import QueryStats
+import reading_search
+from storage_backend import TarotStorageBackend, build_user_stats
+import tarot_cards
 
-class TarotPostgreSQLManager:
-    def __init__(self, dbname, user, password, host="localhost", port="5432"):
+
+class _CopyRows:
+    """copy_expert 的输出目标：把 COPY 文本按行拆开，解析每行的 JSON 后交给回调
+
+    JSON 文本中没有换行和制表符，COPY 文本格式只会把其中的反斜杠写成两个。
+    """
+
+    def __init__(self, on_row):
+        self.on_row = on_row
+        self.count = 0
+        self._tail = b""
+
+    def write(self, data):
+        lines = (self._tail + data).split(b"\n")
+        self._tail = lines.pop()
+        for line in lines:
+            self.on_row(json.loads(line.replace(b"\\\\", b"\\")))
+            self.count += 1
+
+
+def _copy_line(values):
+    """一行 COPY 文本格式的数据（制表符分隔，\\N 表示 NULL）"""
+    fields = []
+    for value in values:
+        if value is None:
+            fields.append("\\N")
+        elif isinstance(value, bool):
+            fields.append("t" if value else "f")
+        else:
+            fields.append(str(value).replace("\\", "\\\\").replace("\t", "\\t")
+                          .replace("\n", "\\n").replace("\r", "\\r"))
+    return "\t".join(fields) + "\n"
+
+
+class TarotPostgreSQLManager(TarotStorageBackend):
+    def __init__(self, dbname, user, password, host="localhost", port="5432",
+                 pooled=False, minconn=1, maxconn=10,
+                 slow_query_threshold=0.2, metrics_path=None):
+        super().__init__()
         self.connection_params = {
             "dbname": dbname,
             "user": user,
@@ -16,9 +66,24 @@ class TarotPostgreSQLManager:
         }
         self.conn = None
         self.cursor = None
+        # 连接池模式：所有使用相同连接参数的管理器共享同一个进程级连接池
+        self.pooled = pooled
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.pool = None
+        self._lock = threading.RLock()
+        # 当前线程所在的工作单元：连接和保存点深度（见 transaction）
+        self._local = threading.local()
+        # 每条语句的耗时/行数/往返次数，按语句指纹汇总（见 query_stats.py）
+        self.query_stats = QueryStats(slow_query_threshold, metrics_path)
+        # 热点语句的预备语句对象；各连接上已准备的语句按连接全局记录
+        self._prepared_statements = {}
+        self._statement_cache = prepared_statements.shared_cache
     
     def connect(self):
         """连接到PostgreSQL数据库"""
+        if self.pooled:
+            return self._connect_pool()
         try:
             self.conn = psycopg2.connect(**self.connection_params)
             self.cursor = self.conn.cursor()
@@ -29,181 +94,636 @@ class TarotPostgreSQLManager:
             print(f"❌ 连接失败: {e}")
             return False
     
-    def hash_password(self, password):
-        """安全的密码哈希函数"""
-        salt = secrets.token_hex(16)
-        password_hash = hashlib.pbkdf2_hmac(
-            'sha256', 
-            password.encode('utf-8'), 
-            salt.encode('utf-8'), 
-            100000
-        ).hex()
-        return f"{salt}${password_hash}"
-    
-    def verify_password(self, password, stored_hash):
-        """验证密码"""
-        salt, stored_password_hash = stored_hash.split('$')
-        new_hash = hashlib.pbkdf2_hmac(
-            'sha256',
-            password.encode('utf-8'),
-            salt.encode('utf-8'),
-            100000
-        ).hex()
-        return new_hash == stored_password_hash
+    def _connect_pool(self):
+        """接入共享连接池"""
+        try:
+            self.pool = get_shared_pool(self.connection_params, self.minconn, self.maxconn)
+            # 借出一次以确认数据库可达
+            with self.connection():
+                pass
+            print(f"✅ 成功接入PostgreSQL连接池 ({self.minconn}-{self.maxconn})")
+            return True
+        except Exception as e:
+            self.pool = None
+            print(f"❌ 连接失败: {e}")
+            return False
+    
+    def is_connected(self):
+        """是否已连接（或已接入连接池）"""
+        return self.pool is not None or self.conn is not None
     
-    def execute_query(self, query, params=None, fetch=False):
-        """执行查询"""
+    @contextmanager
+    def connection(self):
+        """借出一个连接：连接池模式下每次调用单独借出，否则串行使用独占连接
+        
+        处于 transaction() 块中时，返回该工作单元的连接。
+        """
+        tx_conn = getattr(self._local, 'conn', None)
+        if tx_conn is not None:
+            yield tx_conn
+            return
+        
+        if self.pool is None:
+            with self._lock:
+                yield self.conn
+            return
+        
+        conn = self.pool.getconn()
         try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # 连接已损坏，不再放回池中
+            self.pool.putconn(conn, close=True)
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                self.pool.putconn(conn)
+    
+    def in_transaction(self):
+        """当前线程是否处于 transaction() 块中"""
+        return getattr(self._local, 'conn', None) is not None
+    
+    @contextmanager
+    def transaction(self):
+        """工作单元：块内的语句共用一个连接和事务，正常退出时只提交一次
+        
+        块内 execute_query 不再逐条提交，出错时抛出异常（而不是返回 None），
+        整个工作单元回滚。嵌套调用使用保存点，内层异常只回滚到保存点。
+        """
+        if self.in_transaction():
+            conn = self._local.conn
+            self._local.depth += 1
+            savepoint = f"tarot_sp_{self._local.depth}"
+            with conn.cursor() as cursor:
+                cursor.execute(f"SAVEPOINT {savepoint}")
+            try:
+                yield self
+            except BaseException:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                    cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+                raise
+            else:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+            finally:
+                self._local.depth -= 1
+            return
+        
+        with self.connection() as conn:
+            self._local.conn = conn
+            self._local.depth = 0
+            try:
+                yield self
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._local.conn = None
+    
+    def execute_query(self, query, params=None, fetch=False):
+        """执行查询（耗时、行数和往返次数记入 self.query_stats，失败原因见 query_stats.last_error）
+        
+        在 transaction() 块中不单独提交，失败时抛出异常。
+        """
+        returns_rows = fetch and (query.strip().upper().startswith('SELECT') or 'RETURNING' in query.upper())
+        return self._execute(query, params, fetch, returns_rows)
+    
+    def run_statement(self, name, params):
+        """执行登记的热点语句（服务端预备语句，每个连接只 PREPARE 一次）"""
+        statement = self._prepared_statements.get(name)
+        if statement is None:
+            query, returns_rows = self.statements[name]
+            statement = self._prepared_statements.setdefault(
+                name, PreparedStatement(f"tarot_{name}", query, returns_rows)
+            )
+        return self._execute(statement.query, params, statement.returns_rows, statement.returns_rows, statement)
+    
+    def _send(self, conn, cursor, query, params, statement):
+        """发送语句，返回网络往返次数；预备语句在该连接上首次使用时先 PREPARE"""
+        if statement is None:
             if params:
-                self.cursor.execute(query, params)
+                cursor.execute(query, params)
             else:
-                self.cursor.execute(query)
+                cursor.execute(query)
+            return 1
+        
+        round_trips = 1
+        if not self._statement_cache.is_prepared(conn, statement.name):
+            cursor.execute(statement.prepare_sql)
+            self._statement_cache.mark_prepared(conn, statement.name)
+            round_trips += 1
+        try:
+            cursor.execute(statement.execute_sql, params)
+        except psycopg2.errors.InvalidSqlStatementName:
+            if self.in_transaction():
+                raise
+            # 服务端的预备语句已被清除（如 DISCARD ALL），重新准备一次
+            conn.rollback()
+            self._statement_cache.forget(conn)
+            cursor.execute(statement.prepare_sql)
+            self._statement_cache.mark_prepared(conn, statement.name)
+            cursor.execute(statement.execute_sql, params)
+            round_trips += 2
+        return round_trips
+    
+    def _execute(self, query, params, fetch, returns_rows, statement=None):
+        """execute_query / run_statement 的共同实现"""
+        start = time.perf_counter()
+        in_transaction = self.in_transaction()
+        try:
+            with self.connection() as conn:
+                try:
+                    with conn.cursor() as cursor:
+                        round_trips = self._send(conn, cursor, query, params, statement)
+                        
+                        result = None
+                        rows = max(cursor.rowcount, 0)
+                        if returns_rows:
+                            if statement is None:
+                                columns = [desc[0] for desc in cursor.description]
+                            else:
+                                # 结果形状只在第一次执行时读取
+                                if statement.columns is None:
+                                    statement.columns = [desc[0] for desc in cursor.description]
+                                columns = statement.columns
+                            results = cursor.fetchall()
+                            result = [dict(zip(columns, row)) for row in results]
+                            rows = len(result)
+                        elif not fetch:
+                            result = cursor.rowcount
+                    if not in_transaction:
+                        # 连接归还前结束事务，INSERT ... RETURNING 也需要提交
+                        conn.commit()
+                except Exception:
+                    if not in_transaction:
+                        conn.rollback()
+                    raise
+                
+                elapsed = time.perf_counter() - start
+                # 取执行计划会回滚连接上的事务，工作单元中不取
+                plan = None
+                if self.query_stats.is_slow(elapsed) and not in_transaction:
+                    plan = self._explain(conn, statement.execute_sql if statement else query, params)
             
-            if fetch:
-                if query.strip().upper().startswith('SELECT') or 'RETURNING' in query.upper():
-                    columns = [desc[0] for desc in self.cursor.description]
-                    results = self.cursor.fetchall()
-                    return [dict(zip(columns, row)) for row in results]
-            else:
-                self.conn.commit()
-                if query.strip().upper().startswith('INSERT'):
-                    return self.cursor.rowcount
-                else:
-                    return self.cursor.rowcount
+            # 提交另算一次往返（工作单元中提交由 transaction 统一完成）
+            if not in_transaction:
+                round_trips += 1
+            self.query_stats.record(query, elapsed, rows, round_trips=round_trips, params=params, plan=plan)
+            return result
                     
         except Exception as e:
-            self.conn.rollback()
+            self.query_stats.record(query, time.perf_counter() - start, error=e, params=params)
+            if in_transaction:
+                raise
             print(f"❌ 查询执行失败: {e}")
             return None
     
+    def _explain(self, conn, query, params):
+        """慢查询的执行计划（只做 EXPLAIN，不会再次执行语句）"""
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("EXPLAIN " + query, params or None)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+            conn.rollback()
+            return plan
+        except Exception as e:
+            conn.rollback()
+            return f"(无法获取执行计划: {e})"
+    
     def initialize_database(self):
-        """初始化数据库表结构"""
-        #先删除旧表（如果存在）- 仅用于开发环境
-        """drop_tables = [
-            "DROP TABLE IF EXISTS user_settings CASCADE",
-            "DROP TABLE IF EXISTS reading_cards CASCADE", 
-            "DROP TABLE IF EXISTS tarot_readings CASCADE",
-            "DROP TABLE IF EXISTS users CASCADE"
-        ]
-        
-        for drop_sql in drop_tables:
-            try:
-                self.cursor.execute(drop_sql)
-            except:
-                pass"""
-        
-        # 创建新表
-        tables = [
-            """
-            CREATE TABLE users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(50) UNIQUE NOT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                email VARCHAR(100),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP
-            )
-            """,
-            """
-            CREATE TABLE tarot_readings (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                spread_type VARCHAR(50) NOT NULL,
-                question TEXT,
-                reading_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                notes TEXT
-            )
-            """,
-            """
-            CREATE TABLE reading_cards (
-                id SERIAL PRIMARY KEY,
-                reading_id INTEGER NOT NULL REFERENCES tarot_readings(id) ON DELETE CASCADE,
-                card_name VARCHAR(100) NOT NULL,
-                position VARCHAR(50),
-                orientation VARCHAR(10) DEFAULT 'upright',
-                interpretation TEXT
-            )
-            """,
-            """
-            CREATE TABLE user_settings (
-                user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
-                language VARCHAR(10) DEFAULT 'zh_CN',
-                theme VARCHAR(20) DEFAULT 'light',
-                notification_enabled BOOLEAN DEFAULT TRUE
-            )
-            """
-        ]
+        """初始化/升级数据库表结构（已是最新版本时只做一次版本查询）"""
+        try:
+            with self.connection() as conn:
+                version = migrations.migrate(conn)
+            print(f"✅ 数据库初始化完成（结构版本 {version}）")
+            return True
+        except Exception as e:
+            print(f"❌ 数据库初始化失败: {e}")
+            return False
+    
+    def add_tarot_readings_bulk(self, readings, page_size=1000):
+        """批量添加占卜记录及其牌面，按输入顺序返回新记录的ID列表
         
-        for i, table_sql in enumerate(tables):
-            try:
-                self.cursor.execute(table_sql)
-                print(f"✅ 表创建成功 [{i+1}/{len(tables)}]")
-            except Exception as e:
-                print(f"❌ 创建表失败 [{i+1}/{len(tables)}]: {e}")
+        readings 中每项为字典：user_id、spread_type、question、cards、notes，
+        可选 reading_date（补录历史时使用，缺省为当前时间）和 client_id
+        （客户端生成的 UUID；已写入过的 client_id 不再重复写入，返回已有记录的ID）。
+        先一次性预分配全部记录ID，再用多行 VALUES 分页写入记录和牌面，
+        整批只提交一次，无论多少张牌都只需要少量网络往返。
+        在 transaction() 块中时随工作单元一起提交，失败时抛出异常。
+        """
+        if not readings:
+            return []
         
-        self.conn.commit()
-        print("✅ 数据库初始化完成")
+        in_transaction = self.in_transaction()
+        try:
+            with self.connection() as conn:
+                try:
+                    with conn.cursor() as cursor:
+                        # 预分配ID，保证返回顺序与输入一致
+                        cursor.execute(
+                            "SELECT nextval(pg_get_serial_sequence('tarot_readings', 'id')) "
+                            "FROM generate_series(1, %s)",
+                            (len(readings),)
+                        )
+                        reading_ids = [row[0] for row in cursor.fetchall()]
+                        
+                        reading_rows = []
+                        card_rows = []
+                        for reading_id, reading in zip(reading_ids, readings):
+                            reading_rows.append((
+                                reading_id,
+                                reading['user_id'],
+                                reading['spread_type'],
+                                reading.get('question'),
+                                reading.get('reading_date'),
+                                reading.get('notes'),
+                                reading.get('client_id')
+                            ))
+                            for card in reading.get('cards', []):
+                                card_id, custom_name, reversed_ = tarot_cards.parse_card_data(card)
+                                card_rows.append((
+                                    reading_id,
+                                    card_id,
+                                    custom_name,
+                                    card.get('position'),
+                                    reversed_,
+                                    card.get('interpretation', '')
+                                ))
+                        
+                        inserted = execute_values(
+                            cursor,
+                            """
+                            INSERT INTO tarot_readings (id, user_id, spread_type, question, reading_date, notes, client_id)
+                            VALUES %s
+                            ON CONFLICT (client_id) DO NOTHING
+                            RETURNING id
+                            """,
+                            reading_rows,
+                            template="(%s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP), %s, %s)",
+                            page_size=page_size,
+                            fetch=True
+                        )
+                        if len(inserted) < len(reading_ids):
+                            # 重试时已写入过的 client_id：跳过其牌面，返回已有记录的ID
+                            inserted_ids = {row[0] for row in inserted}
+                            card_rows = [row for row in card_rows if row[0] in inserted_ids]
+                            skipped = {}
+                            for index, (reading_id, reading) in enumerate(zip(reading_ids, readings)):
+                                if reading_id not in inserted_ids:
+                                    skipped.setdefault(reading['client_id'], []).append(index)
+                            cursor.execute(
+                                "SELECT client_id::text, id FROM tarot_readings WHERE client_id = ANY(%s::uuid[])",
+                                (list(skipped),)
+                            )
+                            for client_id, existing_id in cursor.fetchall():
+                                for index in skipped[client_id]:
+                                    reading_ids[index] = existing_id
+                        if card_rows:
+                            execute_values(
+                                cursor,
+                                """
+                                INSERT INTO reading_cards (reading_id, card_id, card_name, position, reversed, interpretation)
+                                VALUES %s
+                                """,
+                                card_rows,
+                                page_size=page_size
+                            )
+                    if not in_transaction:
+                        conn.commit()
+                except Exception:
+                    if not in_transaction:
+                        conn.rollback()
+                    raise
+            
+            return reading_ids
+            
+        except Exception as e:
+            if in_transaction:
+                raise
+            print(f"❌ 批量添加占卜记录失败: {e}")
+            return None
     
-    def create_user(self, username, password, email=None):
-        """创建新用户"""
-        password_hash = self.hash_password(password)
+    # 导入时记录和牌面先 COPY 进临时表，再用一条语句写入正式表
+    IMPORT_STAGING = """
+    CREATE TEMP TABLE import_readings (
+        id INTEGER, user_id INTEGER, spread_type TEXT, question TEXT,
+        reading_date TIMESTAMP, notes TEXT, client_id UUID
+    ) ON COMMIT DROP;
+    CREATE TEMP TABLE import_cards (
+        ordinal INTEGER, reading_id INTEGER, card_id SMALLINT, card_name TEXT,
+        position TEXT, reversed BOOLEAN, interpretation TEXT
+    ) ON COMMIT DROP
+    """
+    
+    IMPORT_QUERY = """
+    WITH inserted AS (
+        INSERT INTO tarot_readings (id, user_id, spread_type, question, reading_date, notes, client_id)
+        SELECT id, user_id, spread_type, question, COALESCE(reading_date, CURRENT_TIMESTAMP), notes, client_id
+        FROM import_readings
+        ORDER BY id
+        ON CONFLICT (client_id) DO NOTHING
+        RETURNING id
+    ), inserted_cards AS (
+        INSERT INTO reading_cards (reading_id, card_id, card_name, position, reversed, interpretation)
+        SELECT ic.reading_id, ic.card_id, ic.card_name, ic.position, ic.reversed, ic.interpretation
+        FROM import_cards ic
+        JOIN inserted ON inserted.id = ic.reading_id
+        ORDER BY ic.ordinal
+    )
+    SELECT id FROM inserted
+    """
+    
+    def import_readings(self, readings, page_size=1000):
+        """导入带 client_id 的历史记录，按输入顺序返回新记录ID（已导入过的为 None）
         
-        query = """
-        INSERT INTO users (username, password_hash, email, last_login) 
-        VALUES (%s, %s, %s, %s) RETURNING id
+        与 add_tarot_readings_bulk 相同先预分配ID，随后记录和牌面各用一次 COPY FROM STDIN
+        装入临时表，再由一条 INSERT ... SELECT 写入正式表并跳过已有的 client_id，
+        整批只有常数次网络往返。page_size 仅为与基类接口一致而保留。
         """
+        if not readings:
+            return []
         
-        result = self.execute_query(
-            query, 
-            (username, password_hash, email, datetime.now()),
-            fetch=True
-        )
-        
-        if result and len(result) > 0:
-            user_id = result[0]['id']
-            # 创建用户设置
-            settings_query = "INSERT INTO user_settings (user_id) VALUES (%s)"
-            self.execute_query(settings_query, (user_id,))
-            print(f"✅ 用户 '{username}' 创建成功，ID: {user_id}")
-            return user_id
-        else:
-            print(f"❌ 创建用户失败")
+        start = time.perf_counter()
+        in_transaction = self.in_transaction()
+        try:
+            with self.connection() as conn:
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute(
+                            "SELECT nextval(pg_get_serial_sequence('tarot_readings', 'id')) "
+                            "FROM generate_series(1, %s)",
+                            (len(readings),)
+                        )
+                        reading_ids = [row[0] for row in cursor.fetchall()]
+                        
+                        reading_rows = io.StringIO()
+                        card_rows = io.StringIO()
+                        ordinal = 0
+                        for reading_id, reading in zip(reading_ids, readings):
+                            reading_rows.write(_copy_line((
+                                reading_id,
+                                reading['user_id'],
+                                reading['spread_type'],
+                                reading.get('question'),
+                                reading.get('reading_date'),
+                                reading.get('notes'),
+                                reading['client_id']
+                            )))
+                            for card in reading.get('cards', []):
+                                card_id, custom_name, reversed_ = tarot_cards.parse_card_data(card)
+                                ordinal += 1
+                                card_rows.write(_copy_line((
+                                    ordinal,
+                                    reading_id,
+                                    card_id,
+                                    custom_name,
+                                    card.get('position'),
+                                    reversed_,
+                                    card.get('interpretation', '')
+                                )))
+                        
+                        cursor.execute(self.IMPORT_STAGING)
+                        reading_rows.seek(0)
+                        cursor.copy_expert("COPY import_readings FROM STDIN", reading_rows)
+                        card_rows.seek(0)
+                        cursor.copy_expert("COPY import_cards FROM STDIN", card_rows)
+                        cursor.execute(self.IMPORT_QUERY)
+                        inserted = {row[0] for row in cursor.fetchall()}
+                        # 同一事务中可能再次导入
+                        cursor.execute("DROP TABLE import_readings, import_cards")
+                    if not in_transaction:
+                        conn.commit()
+                except Exception:
+                    if not in_transaction:
+                        conn.rollback()
+                    raise
+            
+            self.query_stats.record(self.IMPORT_QUERY, time.perf_counter() - start, len(inserted),
+                                    round_trips=6, log_slow=False)
+            return [reading_id if reading_id in inserted else None for reading_id in reading_ids]
+            
+        except Exception as e:
+            self.query_stats.record(self.IMPORT_QUERY, time.perf_counter() - start, error=e)
+            if in_transaction:
+                raise
+            print(f"❌ 导入占卜记录失败: {e}")
             return None
     
-    def verify_user(self, username, password):
-        """验证用户登录"""
+    EPOCH_EXPRESSION = "EXTRACT(EPOCH FROM {column})::BIGINT"
+    
+    # 历史记录查询只取当前页的记录，再为每条记录聚合牌面
+    READING_QUERY = """
+    SELECT
+        tr.id, tr.user_id, tr.spread_type, tr.question, tr.reading_date, tr.notes,
+        tr.client_id::text AS client_id, tr.outcome,
+        COALESCE((
+            SELECT json_agg(
+                json_build_object(
+                    'card_id', rc.card_id,
+                    'name', COALESCE(c.name_zh, rc.card_name),
+                    'position', rc.position,
+                    'orientation', CASE WHEN rc.reversed THEN 'reversed' ELSE 'upright' END,
+                    'interpretation', rc.interpretation
+                ) ORDER BY rc.id
+            )
+            FROM reading_cards rc
+            LEFT JOIN cards c ON c.id = rc.card_id
+            WHERE rc.reading_id = tr.id
+        ), '[]') AS cards
+    FROM tarot_readings tr
+    WHERE {where}
+    ORDER BY tr.reading_date DESC, tr.id DESC
+    """
+    
+    def iter_user_readings(self, user_id, batch_size=500):
+        """逐条生成用户的全部占卜记录（服务端游标，内存占用与历史长度无关）
+        
+        迭代期间独占一个连接，请完整遍历或显式关闭生成器。
+        """
+        in_transaction = self.in_transaction()
+        with self.connection() as conn:
+            try:
+                with conn.cursor(name=f"reading_stream_{secrets.token_hex(4)}") as cursor:
+                    cursor.itersize = batch_size
+                    cursor.execute(self.READING_QUERY.format(where="tr.user_id = %s"), (user_id,))
+                    columns = None
+                    for row in cursor:
+                        if columns is None:
+                            columns = [desc[0] for desc in cursor.description]
+                        yield dict(zip(columns, row))
+                if not in_transaction:
+                    conn.commit()
+            except BaseException:
+                if not in_transaction:
+                    conn.rollback()
+                raise
+    
+    # 导出时每条记录在服务端组装成一个 JSON 对象，经 COPY 流式传回
+    EXPORT_QUERY = """
+    SELECT json_build_object(
+        'id', tr.id,
+        'user_id', tr.user_id,
+        'username', u.username,
+        'spread_type', tr.spread_type,
+        'question', tr.question,
+        'reading_date', tr.reading_date,
+        'notes', tr.notes,
+        'cards', COALESCE((
+            SELECT json_agg(
+                json_build_object(
+                    'card_id', rc.card_id,
+                    'name', COALESCE(c.name_zh, rc.card_name),
+                    'name_en', c.name_en,
+                    'position', rc.position,
+                    'reversed', rc.reversed,
+                    'interpretation', rc.interpretation
+                ) ORDER BY rc.id
+            )
+            FROM reading_cards rc
+            LEFT JOIN cards c ON c.id = rc.card_id
+            WHERE rc.reading_id = tr.id
+        ), '[]')
+    )
+    FROM tarot_readings tr
+    JOIN users u ON u.id = tr.user_id
+    WHERE {where}
+    ORDER BY tr.user_id, tr.reading_date, tr.id
+    """
+    
+    def export_readings(self, on_reading, user_id=None):
+        """按用户、时间顺序逐条导出占卜记录（COPY ... TO STDOUT 流式传输）"""
+        def on_row(reading):
+            reading['reading_date'] = datetime.fromisoformat(reading['reading_date'])
+            on_reading(reading)
+        
+        start = time.perf_counter()
+        in_transaction = self.in_transaction()
+        sink = _CopyRows(on_row)
+        with self.connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    if user_id is None:
+                        query = self.EXPORT_QUERY.format(where="TRUE")
+                    else:
+                        query = cursor.mogrify(
+                            self.EXPORT_QUERY.format(where="tr.user_id = %s"), (user_id,)
+                        ).decode('utf-8')
+                    cursor.copy_expert(f"COPY ({query}) TO STDOUT", sink, size=1 << 16)
+                if not in_transaction:
+                    conn.commit()
+            except BaseException:
+                if not in_transaction:
+                    conn.rollback()
+                raise
+        self.query_stats.record(self.EXPORT_QUERY, time.perf_counter() - start, sink.count, log_slow=False)
+        return sink.count
+    
+    def get_user_stats(self, user_id):
+        """获取用户统计信息（读取触发器维护的 user_reading_stats，一次主键查询）"""
         query = """
-        SELECT id, username, email, password_hash 
-        FROM users 
-        WHERE username = %s
+        SELECT total_readings, last_reading, spread_counts, card_counts
+        FROM user_reading_stats
+        WHERE user_id = %s
         """
+        result = self.execute_query(query, (user_id,), fetch=True)
+        return build_user_stats(result[0] if result else None)
+    
+    # 登录后首屏所需的数据合并为一次查询：用户、设置、统计投影和第一页记录
+    SESSION_QUERY = """
+    SELECT
+        u.id, u.username, u.email, u.created_at, u.last_login,
+        (SELECT row_to_json(s) FROM user_settings s WHERE s.user_id = u.id) AS settings,
+        (SELECT row_to_json(st) FROM (
+            SELECT total_readings, last_reading, spread_counts, card_counts
+            FROM user_reading_stats
+            WHERE user_id = u.id
+        ) st) AS stats,
+        COALESCE((
+            SELECT json_agg(r ORDER BY r.reading_date DESC, r.id DESC)
+            FROM ({readings} LIMIT %s) r
+        ), '[]') AS recent_readings
+    FROM users u
+    WHERE u.id = %s
+    """
+    
+    def _statement_queries(self):
+        """热点语句，另加登录后的会话查询"""
+        statements = super()._statement_queries()
+        statements['session_bootstrap'] = (
+            self.SESSION_QUERY.format(readings=self.READING_QUERY.format(where="tr.user_id = u.id")),
+            True
+        )
+        return statements
+    
+    def _load_session_data(self, user_id, page_size):
+        """一次往返读取会话数据（JSON 中的时间为字符串，这里转换回 datetime）"""
+        result = self.run_statement('session_bootstrap', (page_size, user_id))
+        if not result:
+            return None
         
-        result = self.execute_query(query, (username,), fetch=True)
+        row = result[0]
+        readings = row['recent_readings']
+        for reading in readings:
+            reading['reading_date'] = datetime.fromisoformat(reading['reading_date'])
+        stats = row['stats']
+        if stats and stats['last_reading']:
+            stats['last_reading'] = datetime.fromisoformat(stats['last_reading'])
         
-        if result and len(result) > 0:
-            user = result[0]
-            stored_hash = user['password_hash']
-            
-            # 验证密码
-            if self.verify_password(password, stored_hash):
-                # 更新最后登录时间
-                update_query = "UPDATE users SET last_login = %s WHERE id = %s"
-                self.execute_query(update_query, (datetime.now(), user['id']))
-                print(f"✅ 用户 '{username}' 验证成功")
-                return {
-                    'id': user['id'],
-                    'username': user['username'],
-                    'email': user['email']
-                }
-            else:
-                print(f"❌ 密码错误")
-        else:
-            print(f"❌ 用户 '{username}' 不存在")
+        return {
+            'user': {
+                'id': row['id'],
+                'username': row['username'],
+                'email': row['email'],
+                'created_at': row['created_at'],
+                'last_login': row['last_login'],
+            },
+            'settings': row['settings'],
+            'stats': stats,
+            'readings': readings,
+        }
+    
+    def search_readings(self, user_id, keyword, limit=20):
+        """全文检索占卜记录，按相关度排序并附带高亮摘要
+        
+        问题、牌名、备注和牌意解读由触发器维护在 reading_search 的 GIN 索引中，
+        中文按单字和二元组切分，检索耗时不随记录数增长。
+        """
+        variants = reading_search.keyword_variants(keyword)
+        if not variants:
+            return []
+        
+        query = f"""
+        SELECT
+            tr.id, tr.user_id, tr.spread_type, tr.question, tr.reading_date, tr.notes,
+            ts_rank_cd(rs.document, q) AS rank,
+            (SELECT string_agg(COALESCE(c.name_zh || ' ' || c.name_en, rc.card_name), ' ' ORDER BY rc.id)
+             FROM reading_cards rc LEFT JOIN cards c ON c.id = rc.card_id
+             WHERE rc.reading_id = tr.id) AS card_names,
+            (SELECT string_agg(rc.interpretation, ' ' ORDER BY rc.id)
+             FROM reading_cards rc WHERE rc.reading_id = tr.id) AS interpretations
+        FROM reading_search rs
+        CROSS JOIN (SELECT {reading_search.tsquery_sql(len(variants))} AS q) AS query
+        JOIN tarot_readings tr ON tr.id = rs.reading_id
+        WHERE rs.user_id = %s AND rs.document @@ q
+        ORDER BY rank DESC, tr.reading_date DESC
+        LIMIT %s
+        """
         
-        return None
+        result = self.execute_query(query, (*variants, user_id, limit), fetch=True) or []
+        return reading_search.attach_snippets(result, variants)
     
-    def user_exists(self, username):
-        """检查用户是否存在"""
-        query = "SELECT id FROM users WHERE username = %s"
-        result = self.execute_query(query, (username,), fetch=True)
-        return result is not None and len(result) > 0
\ No newline at end of file
+    def close(self):
+        """关闭数据库连接（连接池模式下只释放本管理器对池的引用）"""
+        self.flush_last_login()
+        if self.pool is not None:
+            self.pool = None
+            return
+        if self.cursor:
+            self.cursor.close()
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+        print("✅ 数据库连接已关闭")
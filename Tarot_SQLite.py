@@ -0,0 +1,518 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import migrations
+from query_stats import QueryStats
+import reading_search
+from storage_backend import TarotStorageBackend, build_user_stats
+import tarot_cards
+
+
+def _adapt_datetime(value):
+    return value.isoformat(" ")
+
+
+def _convert_timestamp(value):
+    return datetime.fromisoformat(value.decode())
+
+
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_converter("TIMESTAMP", _convert_timestamp)
+
+
+class TarotSQLiteManager(TarotStorageBackend):
+    """本地 SQLite 文件存储后端
+
+    不需要安装和配置数据库服务器，数据保存在单个文件中。表结构与 PostgreSQL
+    后端一致（见 migrations.SQLITE_MIGRATIONS）；检索使用 FTS5，统计在本地直接查询。
+    连接以自动提交模式打开，多条语句的写入由这里显式开启事务。
+    """
+
+    def __init__(self, path, slow_query_threshold=0.2, metrics_path=None):
+        super().__init__()
+        self.path = str(path)
+        self.conn = None
+        self._lock = threading.RLock()
+        # 当前线程所在的工作单元的保存点深度（见 transaction）
+        self._local = threading.local()
+        # 每条语句的耗时/行数，按语句指纹汇总（见 query_stats.py）
+        self.query_stats = QueryStats(slow_query_threshold, metrics_path)
+        # 热点语句：name -> (原始 SQL, 转换占位符后的 SQL, 是否返回结果行)
+        self._statement_texts = {}
+
+    def connect(self):
+        """打开（必要时创建）SQLite 数据库文件"""
+        try:
+            self.conn = sqlite3.connect(
+                self.path,
+                isolation_level=None,
+                check_same_thread=False,
+                detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
+            )
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute("PRAGMA synchronous = NORMAL")
+            self.conn.execute("PRAGMA foreign_keys = ON")
+            print(f"✅ 成功打开SQLite数据库: {self.path}")
+            return True
+        except Exception as e:
+            self.conn = None
+            print(f"❌ 连接失败: {e}")
+            return False
+
+    def is_connected(self):
+        """是否已打开数据库文件"""
+        return self.conn is not None
+
+    @contextmanager
+    def connection(self):
+        """独占使用数据库连接（SQLite 同一时间只有一个写入者）"""
+        with self._lock:
+            yield self.conn
+
+    def in_transaction(self):
+        """当前线程是否处于 transaction() 块中"""
+        return getattr(self._local, 'depth', None) is not None
+
+    @contextmanager
+    def transaction(self):
+        """工作单元：块内的语句在同一个事务中执行，正常退出时只提交一次
+
+        块内独占数据库连接，execute_query 失败时抛出异常（而不是返回 None），
+        整个工作单元回滚。嵌套调用使用保存点，内层异常只回滚到保存点。
+        """
+        with self.connection() as conn:
+            if self.in_transaction():
+                self._local.depth += 1
+                savepoint = f"tarot_sp_{self._local.depth}"
+                conn.execute(f"SAVEPOINT {savepoint}")
+                try:
+                    yield self
+                except BaseException:
+                    conn.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                    conn.execute(f"RELEASE SAVEPOINT {savepoint}")
+                    raise
+                else:
+                    conn.execute(f"RELEASE SAVEPOINT {savepoint}")
+                finally:
+                    self._local.depth -= 1
+                return
+
+            conn.execute("BEGIN IMMEDIATE")
+            self._local.depth = 0
+            try:
+                yield self
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                self._local.depth = None
+
+    def execute_query(self, query, params=None, fetch=False):
+        """执行查询（%s 占位符会转换为 SQLite 的 ?；耗时和行数记入 self.query_stats）
+
+        在 transaction() 块中失败时抛出异常。
+        """
+        returns_rows = fetch and (query.strip().upper().startswith('SELECT') or 'RETURNING' in query.upper())
+        return self._execute(query, query.replace('%s', '?'), params, fetch, returns_rows)
+
+    def run_statement(self, name, params):
+        """执行登记的热点语句
+
+        sqlite3 模块按 SQL 文本缓存已编译的语句（cached_statements），这里只需保证
+        每次发送同一份已转换占位符的文本，并省去每次的占位符替换和语句类型判断。
+        """
+        statement = self._statement_texts.get(name)
+        if statement is None:
+            query, returns_rows = self.statements[name]
+            statement = self._statement_texts.setdefault(name, (query, query.replace('%s', '?'), returns_rows))
+        query, sqlite_query, returns_rows = statement
+        return self._execute(query, sqlite_query, params, returns_rows, returns_rows)
+
+    def _execute(self, query, sqlite_query, params, fetch, returns_rows):
+        """execute_query / run_statement 的共同实现"""
+        start = time.perf_counter()
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(sqlite_query, params or ())
+
+                    result = None
+                    rows = max(cursor.rowcount, 0)
+                    if returns_rows:
+                        columns = [desc[0] for desc in cursor.description]
+                        results = cursor.fetchall()
+                        result = [dict(zip(columns, row)) for row in results]
+                        rows = len(result)
+                    elif not fetch:
+                        result = cursor.rowcount
+                finally:
+                    cursor.close()
+
+                elapsed = time.perf_counter() - start
+                plan = self._explain(conn, query, params) if self.query_stats.is_slow(elapsed) else None
+
+            self.query_stats.record(query, elapsed, rows, round_trips=1, params=params, plan=plan)
+            return result
+
+        except Exception as e:
+            self.query_stats.record(query, time.perf_counter() - start, error=e, params=params)
+            if self.in_transaction():
+                raise
+            print(f"❌ 查询执行失败: {e}")
+            return None
+
+    def _explain(self, conn, query, params):
+        """慢查询的执行计划（EXPLAIN QUERY PLAN，不会再次执行语句）"""
+        try:
+            rows = conn.execute("EXPLAIN QUERY PLAN " + query.replace('%s', '?'), params or ()).fetchall()
+            return "\n".join(row[3] for row in rows)
+        except Exception as e:
+            return f"(无法获取执行计划: {e})"
+
+    def initialize_database(self):
+        """初始化/升级数据库表结构（已是最新版本时只做一次版本查询）"""
+        try:
+            with self.connection() as conn:
+                version = migrations.migrate_sqlite(conn)
+            print(f"✅ 数据库初始化完成（结构版本 {version}）")
+            return True
+        except Exception as e:
+            print(f"❌ 数据库初始化失败: {e}")
+            return False
+
+    @staticmethod
+    def _search_columns(reading, parsed_cards):
+        """生成 FTS5 各列的切分文本：问题、牌名、备注与牌意解读"""
+        card_names = []
+        interpretations = []
+        for card, (card_id, custom_name, _) in zip(reading.get('cards', []), parsed_cards):
+            if card_id is None:
+                card_names.append(custom_name or '')
+            else:
+                catalog_card = tarot_cards.CARDS[card_id]
+                card_names.extend((catalog_card.name_zh, catalog_card.name_en))
+            interpretations.append(card.get('interpretation') or '')
+        body = " ".join([reading.get('notes') or ''] + interpretations)
+        return (
+            reading_search.ngram_text(reading.get('question')),
+            reading_search.ngram_text(" ".join(card_names)),
+            reading_search.ngram_text(body)
+        )
+
+    def add_tarot_readings_bulk(self, readings, page_size=1000):
+        """批量添加占卜记录及其牌面，按输入顺序返回新记录的ID列表
+
+        整批在一个事务中写入并同步更新检索表，只提交一次；在 transaction() 块中时
+        随工作单元一起提交，失败时抛出异常。已写入过的 client_id 不再重复写入。
+        page_size 仅为与 PostgreSQL 后端保持接口一致，本地写入不需要分页。
+        """
+        if not readings:
+            return []
+
+        in_transaction = self.in_transaction()
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                if not in_transaction:
+                    cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    reading_ids = []
+                    card_rows = []
+                    search_rows = []
+                    for reading in readings:
+                        cursor.execute(
+                            """
+                            INSERT INTO tarot_readings (user_id, spread_type, question, reading_date, notes, client_id)
+                            VALUES (?, ?, ?, COALESCE(?, datetime('now', 'localtime')), ?, ?)
+                            ON CONFLICT (client_id) DO NOTHING
+                            """,
+                            (
+                                reading['user_id'],
+                                reading['spread_type'],
+                                reading.get('question'),
+                                reading.get('reading_date'),
+                                reading.get('notes'),
+                                reading.get('client_id')
+                            )
+                        )
+                        if cursor.rowcount == 0:
+                            # 重试时已写入过的 client_id：返回已有记录的ID
+                            cursor.execute(
+                                "SELECT id FROM tarot_readings WHERE client_id = ?", (reading['client_id'],)
+                            )
+                            reading_ids.append(cursor.fetchone()[0])
+                            continue
+                        reading_id = cursor.lastrowid
+                        reading_ids.append(reading_id)
+
+                        parsed_cards = [tarot_cards.parse_card_data(card) for card in reading.get('cards', [])]
+                        for card, (card_id, custom_name, reversed_) in zip(reading.get('cards', []), parsed_cards):
+                            card_rows.append((
+                                reading_id,
+                                card_id,
+                                custom_name,
+                                card.get('position'),
+                                reversed_,
+                                card.get('interpretation', '')
+                            ))
+                        search_rows.append(
+                            (reading_id,) + self._search_columns(reading, parsed_cards) + (reading['user_id'],)
+                        )
+
+                    if card_rows:
+                        cursor.executemany(
+                            """
+                            INSERT INTO reading_cards (reading_id, card_id, card_name, position, reversed, interpretation)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                            """,
+                            card_rows
+                        )
+                    cursor.executemany(
+                        """
+                        INSERT INTO reading_search (rowid, question, card_names, body, user_id)
+                        VALUES (?, ?, ?, ?, ?)
+                        """,
+                        search_rows
+                    )
+                    if not in_transaction:
+                        cursor.execute("COMMIT")
+                except Exception:
+                    if not in_transaction:
+                        cursor.execute("ROLLBACK")
+                    raise
+                finally:
+                    cursor.close()
+
+            return reading_ids
+
+        except Exception as e:
+            if in_transaction:
+                raise
+            print(f"❌ 批量添加占卜记录失败: {e}")
+            return None
+
+    # 时间以文本保存，经儒略日换算为秒
+    EPOCH_EXPRESSION = "CAST(ROUND((julianday({column}) - 2440587.5) * 86400) AS INTEGER)"
+
+    # 与 PostgreSQL 版本相同：只取当前页的记录，再为每条记录聚合牌面（JSON 文本）
+    READING_QUERY = """
+    SELECT
+        tr.id, tr.user_id, tr.spread_type, tr.question, tr.reading_date, tr.notes, tr.client_id,
+        tr.outcome,
+        (
+            SELECT json_group_array(json_object(
+                'card_id', card_id,
+                'name', name,
+                'position', position,
+                'orientation', orientation,
+                'interpretation', interpretation
+            ))
+            FROM (
+                SELECT
+                    rc.card_id,
+                    COALESCE(c.name_zh, rc.card_name) AS name,
+                    rc.position,
+                    CASE WHEN rc.reversed THEN 'reversed' ELSE 'upright' END AS orientation,
+                    rc.interpretation
+                FROM reading_cards rc
+                LEFT JOIN cards c ON c.id = rc.card_id
+                WHERE rc.reading_id = tr.id
+                ORDER BY rc.id
+            )
+        ) AS cards
+    FROM tarot_readings tr
+    WHERE {where}
+    ORDER BY tr.reading_date DESC, tr.id DESC
+    """
+
+    def _decode_reading(self, row):
+        """牌面在 SQLite 中以 JSON 文本返回，解码为列表；结果以 0/1 保存，转换为布尔"""
+        row['cards'] = json.loads(row['cards']) if row['cards'] else []
+        if row.get('outcome') is not None:
+            row['outcome'] = bool(row['outcome'])
+        return row
+
+    def iter_user_readings(self, user_id, batch_size=500):
+        """逐条生成用户的全部占卜记录（按批读取，内存占用与历史长度无关）
+
+        迭代期间独占数据库连接，请完整遍历或显式关闭生成器。
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    self.READING_QUERY.format(where="tr.user_id = %s").replace('%s', '?'), (user_id,)
+                )
+                columns = [desc[0] for desc in cursor.description]
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield self._decode_reading(dict(zip(columns, row)))
+            finally:
+                cursor.close()
+
+    EXPORT_QUERY = """
+    SELECT
+        tr.id, tr.user_id, u.username, tr.spread_type, tr.question, tr.reading_date, tr.notes,
+        (
+            SELECT json_group_array(json_object(
+                'card_id', card_id,
+                'name', name,
+                'name_en', name_en,
+                'position', position,
+                'reversed', json(CASE WHEN reversed THEN 'true' ELSE 'false' END),
+                'interpretation', interpretation
+            ))
+            FROM (
+                SELECT
+                    rc.card_id,
+                    COALESCE(c.name_zh, rc.card_name) AS name,
+                    c.name_en,
+                    rc.position,
+                    rc.reversed,
+                    rc.interpretation
+                FROM reading_cards rc
+                LEFT JOIN cards c ON c.id = rc.card_id
+                WHERE rc.reading_id = tr.id
+                ORDER BY rc.id
+            )
+        ) AS cards
+    FROM tarot_readings tr
+    JOIN users u ON u.id = tr.user_id
+    WHERE {where}
+    ORDER BY tr.user_id, tr.reading_date, tr.id
+    """
+
+    def export_readings(self, on_reading, user_id=None, batch_size=2000):
+        """按用户、时间顺序逐条导出占卜记录（按批读取）"""
+        start = time.perf_counter()
+        count = 0
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                if user_id is None:
+                    cursor.execute(self.EXPORT_QUERY.format(where="1"))
+                else:
+                    cursor.execute(self.EXPORT_QUERY.format(where="tr.user_id = ?"), (user_id,))
+                columns = [desc[0] for desc in cursor.description]
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        on_reading(self._decode_reading(dict(zip(columns, row))))
+                    count += len(rows)
+            finally:
+                cursor.close()
+        self.query_stats.record(self.EXPORT_QUERY, time.perf_counter() - start, count, log_slow=False)
+        return count
+
+    def get_user_stats(self, user_id):
+        """获取用户统计信息（本地文件直接聚合，不需要投影表）"""
+        totals = self.execute_query(
+            """
+            SELECT COUNT(*) AS total_readings, MAX(reading_date) AS "last_reading [timestamp]"
+            FROM tarot_readings
+            WHERE user_id = %s
+            """,
+            (user_id,), fetch=True
+        )
+        if not totals or not totals[0]['total_readings']:
+            return build_user_stats(None)
+
+        spreads = self.execute_query(
+            """
+            SELECT spread_type, COUNT(*) AS count
+            FROM tarot_readings
+            WHERE user_id = %s
+            GROUP BY spread_type
+            """,
+            (user_id,), fetch=True
+        ) or []
+        cards = self.execute_query(
+            """
+            SELECT rc.card_id, COUNT(*) AS count
+            FROM reading_cards rc
+            JOIN tarot_readings tr ON tr.id = rc.reading_id
+            WHERE tr.user_id = %s AND rc.card_id IS NOT NULL
+            GROUP BY rc.card_id
+            """,
+            (user_id,), fetch=True
+        ) or []
+
+        return build_user_stats({
+            'total_readings': totals[0]['total_readings'],
+            'last_reading': totals[0]['last_reading'],
+            'spread_counts': {row['spread_type']: row['count'] for row in spreads},
+            # 与 PostgreSQL 的 JSONB 计数保持一致，键为字符串形式的牌编号
+            'card_counts': {str(row['card_id']): row['count'] for row in cards},
+        })
+
+    def _load_session_data(self, user_id, page_size):
+        """读取会话数据（进程内调用没有网络往返，直接组合现有查询）"""
+        result = self.execute_query(
+            "SELECT id, username, email, created_at, last_login FROM users WHERE id = %s",
+            (user_id,), fetch=True
+        )
+        if not result:
+            return None
+
+        stats = self.get_user_stats(user_id)
+        return {
+            'user': result[0],
+            'settings': self.get_user_settings(user_id),
+            'stats': stats,
+            'readings': self.execute_query(
+                self.READING_QUERY.format(where="tr.user_id = %s") + " LIMIT %s",
+                (user_id, page_size), fetch=True
+            ) or [],
+        }
+
+    def search_readings(self, user_id, keyword, limit=20):
+        """全文检索占卜记录，按相关度排序并附带高亮摘要
+
+        reading_search 为 FTS5 表，写入记录时按与 PostgreSQL 相同的规则切分
+        （中文单字和二元组），查询时一个查询词的所有片段都需命中。
+        """
+        variants = reading_search.keyword_variants(keyword)
+        # 每个查询词的片段都需命中，查询词之间任一命中即可
+        groups = [reading_search.ngram_text(variant).split() for variant in variants]
+        groups = [tokens for tokens in groups if tokens]
+        if not groups:
+            return []
+        match = " OR ".join("(" + " AND ".join(f'"{token}"' for token in tokens) + ")" for tokens in groups)
+
+        query = """
+        SELECT
+            tr.id, tr.user_id, tr.spread_type, tr.question, tr.reading_date, tr.notes,
+            -bm25(reading_search, 10.0, 4.0, 1.0) AS rank,
+            (SELECT group_concat(COALESCE(c.name_zh || ' ' || c.name_en, rc.card_name), ' ')
+             FROM reading_cards rc LEFT JOIN cards c ON c.id = rc.card_id
+             WHERE rc.reading_id = tr.id) AS card_names,
+            (SELECT group_concat(rc.interpretation, ' ')
+             FROM reading_cards rc WHERE rc.reading_id = tr.id) AS interpretations
+        FROM reading_search
+        JOIN tarot_readings tr ON tr.id = reading_search.rowid
+        WHERE reading_search MATCH %s AND reading_search.user_id = %s
+        ORDER BY rank DESC, tr.reading_date DESC
+        LIMIT %s
+        """
+
+        result = self.execute_query(query, (match, user_id, limit), fetch=True) or []
+        return reading_search.attach_snippets(result, variants)
+
+    def close(self):
+        """关闭数据库文件"""
+        self.flush_last_login()
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+        print("✅ 数据库连接已关闭")
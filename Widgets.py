@@ -2,10 +2,15 @@
 
 from PySide6.QtWidgets import (QApplication, QMainWindow, QPushButton, QLabel, QVBoxLayout, QWidget, QLineEdit,QHBoxLayout,
                                 QMessageBox,QInputDialog, QDialog, QGroupBox, QFormLayout,QCheckBox, QProgressBar,QComboBox)
-import Tarot_PostgreSQL as tps
-from PySide6.QtCore import Qt, QTimer
+from PySide6.QtCore import Qt, QTimer, QObject, Signal
 import psycopg2
+import sqlite3
 import config_manager as cmg
+import password_hash
+from storage_backend import create_backend
+from reading_cache import ReadingCache
+from journal import JournaledBackend
+from auth_service import AuthService
 
 class FirstRunWizard(QDialog):
     def __init__(self, parent=None):
@@ -15,6 +20,10 @@ class FirstRunWizard(QDialog):
         self.config_manager = cmg.SecureConfigManager()
 
         self.db_config = {}
+        # 密码哈希参数校准耗时数秒，放到后台线程，结果经信号回到界面
+        self.auth_service = AuthService(None, max_workers=1)
+        self.auth_signals = AuthSignals()
+        self.auth_signals.calibration_finished.connect(self.on_calibration_finished)
         self.initUI()
     
     def initUI(self):
@@ -24,8 +33,26 @@ class FirstRunWizard(QDialog):
         title_label.setAlignment(Qt.AlignCenter)
         title_label.setStyleSheet("font-size: 16px; font-weight: bold;")
 
+        # Storage Backend
+        backend_group = QGroupBox("存储方式")
+        backend_layout = QFormLayout(backend_group)
+
+        self.backend_combo = QComboBox()
+        self.backend_combo.addItem("PostgreSQL 服务器", "postgresql")
+        self.backend_combo.addItem("本地 SQLite（无需安装数据库）", "sqlite")
+        self.backend_combo.currentIndexChanged.connect(self.on_backend_changed)
+        backend_layout.addRow("Backend:", self.backend_combo)
+
+        # SQLite 数据库文件
+        self.sqlite_group = QGroupBox("SQLite Database File")
+        sqlite_layout = QFormLayout(self.sqlite_group)
+        self.path_input = QLineEdit(str(self.config_manager.default_sqlite_path()))
+        sqlite_layout.addRow("Path:", self.path_input)
+        self.sqlite_group.setVisible(False)
+
         # Database Configuration
         db_group = QGroupBox("Database Configuration")
+        self.db_group = db_group
         db_layout = QFormLayout(db_group)
 
         # Host
@@ -109,14 +136,30 @@ class FirstRunWizard(QDialog):
         self.layout = QVBoxLayout()
         self.setLayout(self.layout)
         self.layout.addWidget(title_label)
+        self.layout.addWidget(backend_group)
         self.layout.addWidget(db_group)
+        self.layout.addWidget(self.sqlite_group)
         self.layout.addWidget(test_group)
         self.layout.addWidget(init_group)
         self.layout.addWidget(self.progress_bar)
         self.layout.addLayout(button_layout)
     
+    def on_backend_changed(self):
+        """切换存储方式时显示对应的配置项，并要求重新测试"""
+        use_sqlite = self.backend_combo.currentData() == "sqlite"
+        self.db_group.setVisible(not use_sqlite)
+        self.sqlite_group.setVisible(use_sqlite)
+        self.finish_button.setEnabled(False)
+        self.db_config = {}
+        self.test_result.setText("点击'测试连接'验证数据库连接")
+    
     def get_connection_config(self):
         """获取连接配置"""
+        if self.backend_combo.currentData() == "sqlite":
+            return {
+                'backend': 'sqlite',
+                'path': self.path_input.text().strip()
+            }
         return {
             'host': self.host_input.text().strip(),
             'port': self.port_input.text().strip(),
@@ -129,6 +172,15 @@ class FirstRunWizard(QDialog):
         """测试数据库连接"""
         config = self.get_connection_config()
         
+        if config.get('backend') == 'sqlite':
+            if not config['path']:
+                self.test_result.setText("❌ 请填写数据库文件路径")
+                return
+            self.test_button.setEnabled(False)
+            self.test_result.setText("正在测试连接...")
+            QTimer.singleShot(100, lambda: self._perform_sqlite_test(config))
+            return
+        
         # 验证输入
         if not all([config['host'], config['port'], config['dbname'], config['user']]):
             self.test_result.setText("❌ 请填写所有必填字段")
@@ -196,14 +248,61 @@ class FirstRunWizard(QDialog):
         finally:
             self.test_button.setEnabled(True)
     
+    def _perform_sqlite_test(self, config):
+        """检查 SQLite 数据库文件能否创建/打开"""
+        try:
+            conn = sqlite3.connect(config['path'])
+            version = conn.execute("SELECT sqlite_version()").fetchone()[0]
+            has_tables = conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users')"
+            ).fetchone()[0]
+            conn.close()
+            
+            self.test_result.setText(
+                f"✅ 数据库文件可用！\n"
+                f"SQLite 版本: {version}\n"
+                f"数据库表状态: {'已存在' if has_tables else '需要初始化'}"
+            )
+            self.finish_button.setEnabled(True)
+            self.db_config = config
+        except Exception as e:
+            self.test_result.setText(f"❌ 无法打开数据库文件: {e}")
+        finally:
+            self.test_button.setEnabled(True)
+    
     def finish_setup(self):
         """完成设置"""
         if not self.db_config:
             QMessageBox.warning(self, "错误", "请先测试连接并确保连接成功")
             return
         
+        # 按本机性能校准密码哈希参数，登录时单次哈希约 0.25 秒（后台线程中执行，
+        # 完成后回调 on_calibration_finished）
+        self.set_busy(True, "正在按本机性能校准密码哈希参数...")
+        future = self.auth_service.submit_calibration()
+        self.auth_signals.forward(future, self.auth_signals.calibration_finished)
+    
+    def set_busy(self, busy, message=""):
+        """进行中时禁用按钮并显示进度"""
+        self.test_button.setEnabled(not busy)
+        self.finish_button.setEnabled(not busy)
+        self.cancel_button.setEnabled(not busy)
+        self.progress_bar.setRange(0, 0)  # 无限进度条
+        self.progress_bar.setVisible(busy)
+        if message:
+            self.test_result.setText(message)
+    
+    def on_calibration_finished(self, params):
+        """校准完成（GUI 线程）：保存配置，按需初始化数据库"""
+        self.auth_service.shutdown(wait=False)
+        if isinstance(params, Exception):
+            self.set_busy(False, f"❌ 校准密码哈希参数失败: {params}")
+            return
+        self.db_config['password_hash'] = password_hash.encode_params(params)
+        
         # 保存配置
         if not self.config_manager.save_database_config(self.db_config):
+            self.set_busy(False)
             QMessageBox.critical(self, "错误", "保存数据库配置失败")
             return
         
@@ -211,6 +310,7 @@ class FirstRunWizard(QDialog):
         if self.auto_init_check.isChecked():
             self.initialize_database()
         else:
+            self.set_busy(False)
             QMessageBox.information(self, "设置完成", 
                                   "数据库配置已保存！\n"
                                   "您现在可以使用塔罗牌日记了。")
@@ -230,56 +330,11 @@ class FirstRunWizard(QDialog):
     def _perform_database_init(self):
         """执行数据库初始化"""
         try:
-            conn = psycopg2.connect(**self.db_config)
-            cursor = conn.cursor()
-            
-            # 创建表
-            tables = [
-                """
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    username VARCHAR(50) UNIQUE NOT NULL,
-                    password_hash VARCHAR(255) NOT NULL,
-                    email VARCHAR(100),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_login TIMESTAMP
-                )
-                """,
-                """
-                CREATE TABLE IF NOT EXISTS tarot_readings (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    spread_type VARCHAR(50) NOT NULL,
-                    question TEXT,
-                    reading_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    notes TEXT
-                )
-                """,
-                """
-                CREATE TABLE IF NOT EXISTS reading_cards (
-                    id SERIAL PRIMARY KEY,
-                    reading_id INTEGER NOT NULL REFERENCES tarot_readings(id) ON DELETE CASCADE,
-                    card_name VARCHAR(100) NOT NULL,
-                    position VARCHAR(50),
-                    orientation VARCHAR(10) DEFAULT 'upright',
-                    interpretation TEXT
-                )
-                """,
-                """
-                CREATE TABLE IF NOT EXISTS user_settings (
-                    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
-                    language VARCHAR(10) DEFAULT 'zh_CN',
-                    theme VARCHAR(20) DEFAULT 'light',
-                    notification_enabled BOOLEAN DEFAULT TRUE
-                )
-                """
-            ]
-            
-            for i, table_sql in enumerate(tables, 1):
-                cursor.execute(table_sql)
-            
-            conn.commit()
-            conn.close()
+            # 配置中还有哈希参数等非连接字段，统一经由后端建立连接；表结构由 migrations 维护
+            db_manager = create_backend(self.db_config)
+            if not db_manager.connect() or not db_manager.initialize_database():
+                raise RuntimeError("无法连接或初始化数据库")
+            db_manager.close()
             
             QMessageBox.information(self, "设置完成", 
                                   "✅ 数据库配置已保存！\n"
@@ -293,18 +348,49 @@ class FirstRunWizard(QDialog):
                                "配置已保存，但您需要手动创建数据库表。")
             self.accept()
 
+class AuthSignals(QObject):
+    """把认证线程池的结果送回 GUI 线程
+
+    信号在工作线程中发射，接收方在 GUI 线程，Qt 会以排队方式投递，
+    槽函数里可以直接操作界面。
+    """
+    login_finished = Signal(object)
+    register_finished = Signal(object)
+    calibration_finished = Signal(object)
+
+    def forward(self, future, signal):
+        """Future 完成后通过 signal 发出结果
+
+        出错时打印错误并发出异常对象本身，槽函数据此把数据库或驱动错误与
+        “密码错误”“用户名已存在”区分开。
+        """
+        def emit(f):
+            error = f.exception()
+            if error is not None:
+                print(f"❌ 后台请求失败: {error}")
+                signal.emit(error)
+            else:
+                signal.emit(f.result())
+        future.add_done_callback(emit)
+
 class CheckIn():
-    def __init__(self, db_config):
+    def __init__(self, db_config, db_manager=None):
         self.window = QMainWindow()
         self.window.setWindowTitle("Check In")
         self.window.setGeometry(100, 100, 400, 300)
-        self.db_manager = tps.TarotPostgreSQLManager(
-            dbname=db_config['dbname'],
-            user=db_config['user'],
-            password=db_config['password'],
-            host=db_config['host'],
-            port=db_config['port']
-        )
+        self.config_manager = cmg.SecureConfigManager()
+        if db_manager is None:
+            # 未传入管理器时按配置创建（PostgreSQL 同样从进程级共享连接池取连接）
+            db_manager = ReadingCache(create_backend(db_config))
+            if db_config.get('backend') != 'sqlite':
+                db_manager = JournaledBackend(db_manager, self.config_manager.journal_file,
+                                              cipher=self.config_manager)
+        self.db_manager = db_manager
+        # 密码哈希和数据库往返放到后台线程，结果经信号回到界面
+        self.auth_service = AuthService(self.db_manager)
+        self.auth_signals = AuthSignals()
+        self.auth_signals.login_finished.connect(self.on_login_finished)
+        self.auth_signals.register_finished.connect(self.on_register_finished)
         # Initialize UI components
         self.main_window = None
         self.initUI()
@@ -336,6 +422,10 @@ class CheckIn():
         self.password_layout.addWidget(self.password_label)
         self.password_layout.addWidget(self.password_input)
 
+        # Remember me
+        self.remember_check = QCheckBox("记住我")
+        self.remember_check.setChecked(True)
+
         # Check-in button
         self.checkin_button = QPushButton("Check In")
         self.checkin_button.setStyleSheet("font-size: 14px;")
@@ -346,12 +436,23 @@ class CheckIn():
         self.register_button.setStyleSheet("font-size: 14px;")
         self.register_button.clicked.connect(self.show_register)
 
+        # 登录/注册进行中的状态
+        self.status_label = QLabel("")
+        self.status_label.setAlignment(Qt.AlignCenter)
+        self.status_label.setStyleSheet("color: #666; font-size: 12px;")
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)  # 无限进度条
+        self.progress_bar.setVisible(False)
+
         # Add widgets to the layout
         self.layout.addWidget(self.label)
         self.layout.addLayout(self.account_layout)
         self.layout.addLayout(self.password_layout)
+        self.layout.addWidget(self.remember_check)
         self.layout.addWidget(self.checkin_button)
         self.layout.addWidget(self.register_button)
+        self.layout.addWidget(self.status_label)
+        self.layout.addWidget(self.progress_bar)
         #add background image
 
 
@@ -360,10 +461,13 @@ class CheckIn():
         container.setLayout(self.layout)
         self.window.setCentralWidget(container)
 
-        if not self.db_manager.connect():
-            QMessageBox.critical(self.window, "错误", "无法连接数据库，请检查数据库设置")
+        if not self.db_manager.is_connected():
+            if not self.db_manager.connect():
+                QMessageBox.critical(self.window, "错误", "无法连接数据库，请检查数据库设置")
 
         self.db_manager.initialize_database()
+        if not getattr(self.db_manager, 'online', True):
+            self.status_label.setText("离线模式：新的占卜记录会先保存在本地，数据库恢复后自动同步")
 
     def check_in(self):
         """登录验证"""
@@ -374,17 +478,35 @@ class CheckIn():
             QMessageBox.warning(self.window, "输入错误", "请输入账号和密码")
             return
         
-        # 验证用户
-        user = self.db_manager.verify_user(self.username, self.password)
-        
-        if user:
+        # 验证用户（后台线程中执行，完成后回调 on_login_finished）
+        self.set_busy(True, "正在验证账号...")
+        future = self.auth_service.submit_login(self.username, self.password)
+        self.auth_signals.forward(future, self.auth_signals.login_finished)
+
+    def set_busy(self, busy, message=""):
+        """进行中时禁用按钮并显示进度"""
+        self.checkin_button.setEnabled(not busy)
+        self.register_button.setEnabled(not busy)
+        self.account_input.setEnabled(not busy)
+        self.password_input.setEnabled(not busy)
+        self.progress_bar.setVisible(busy)
+        self.status_label.setText(message)
+
+    def on_login_finished(self, user):
+        """登录验证完成（GUI 线程）"""
+        self.set_busy(False)
+        if isinstance(user, Exception):
+            QMessageBox.critical(self.window, "登录失败", f"无法完成验证，请检查数据库连接:\n{user}")
+        elif user:
             # 登录成功
             QMessageBox.information(self.window, "登录成功", f"欢迎回来，{user['username']}！")
             
-            # 创建并显示主窗口
-            self.main_window = MainWindow(user, self.db_manager)
-            self.main_window.show()
-            self.window.hide()
+            if self.remember_check.isChecked():
+                token = self.db_manager.create_session(user['id'])
+                if token:
+                    self.config_manager.save_session_token(token)
+            
+            self.open_main_window(user)
         else:
             QMessageBox.warning(self.window, "登录失败", "用户名或密码错误")
 
@@ -395,22 +517,56 @@ class CheckIn():
             if ok and password:
                 email, ok = QInputDialog.getText(self.window, "注册新账号", "请输入邮箱（可选）:")
                 if ok:
-                    # 创建新用户
-                    user_id = self.db_manager.create_user(self.new_username, password, email if email else None)
-                    if user_id:
-                        QMessageBox.information(self.window, "注册成功", f"用户 {self.new_username} 创建成功！")
-                        # 自动填充登录表单
-                        self.account_input.setText(self.new_username)
-                        self.password_input.setText("")
-                    else:
-                        QMessageBox.warning(self.window, "注册失败", "用户名可能已存在")
-        pass
+                    # 创建新用户（后台线程中执行，完成后回调 on_register_finished）
+                    self.set_busy(True, "正在创建账号...")
+                    future = self.auth_service.submit_register(self.new_username, password, email if email else None)
+                    self.auth_signals.forward(future, self.auth_signals.register_finished)
+
+    def on_register_finished(self, user_id):
+        """注册完成（GUI 线程）"""
+        self.set_busy(False)
+        if isinstance(user_id, Exception):
+            QMessageBox.critical(self.window, "注册失败", f"无法创建账号，请检查数据库连接:\n{user_id}")
+        elif user_id:
+            QMessageBox.information(self.window, "注册成功", f"用户 {self.new_username} 创建成功！")
+            # 自动填充登录表单
+            self.account_input.setText(self.new_username)
+            self.password_input.setText("")
+        else:
+            QMessageBox.warning(self.window, "注册失败", "用户名可能已存在")
+
+    def open_main_window(self, user):
+        """创建并显示主窗口（首屏数据由一次会话查询提供）"""
+        session = self.db_manager.load_session(user['id'])
+        self.main_window = MainWindow(user, self.db_manager, session)
+        self.main_window.show()
+        self.window.hide()
+
+    def restore_session(self):
+        """用保存的“记住我”令牌恢复登录，成功返回用户字典"""
+        token = self.config_manager.load_session_token()
+        if not token:
+            return None
+        user = self.db_manager.restore_session(token)
+        if user is None and getattr(self.db_manager, 'online', True):
+            # 令牌已过期或被注销（离线时无法校验，保留令牌）
+            self.config_manager.delete_session_token()
+        return user
 
     def show(self):
+        # 有有效的登录令牌时直接进入主窗口
+        user = self.restore_session()
+        if user:
+            self.open_main_window(user)
+            return
         self.window.show()
         
 class MainWindow():
-    def __init__(self, user, db_manager):
+    def __init__(self, user, db_manager, session=None):
+        self.user = user
+        self.db_manager = db_manager
+        # 登录时一次读取的用户、设置、统计和最近记录（sessions.UserSession）
+        self.session = session
         self.window = QMainWindow()
         self.window.setWindowTitle("My Tarot Diary")
         self.window.setGeometry(100, 100, 800, 600)
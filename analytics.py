@@ -0,0 +1,317 @@
+# analytics.py
+"""抽牌统计分析（NumPy 向量化）
+
+把一个用户抽过的全部牌面读成三个数组：牌编号（int16）、是否逆位（bool）、
+抽牌时间（datetime64[s]），之后的统计全部是数组运算（bincount、cumsum、
+布尔掩码），没有逐条的 Python 循环：
+
+    engine = DrawAnalytics(db_manager)
+    engine.summary(user_id)               # 仪表盘需要的全部统计
+    engine.rolling(user_id, window_days=30)
+
+每个用户的数组和已算出的结果按数据代数缓存：后端是 ReadingCache（或其外层的
+JournaledBackend）时直接使用其 generation()，任何写入和变更通知都会让代数变化；
+否则由调用方在写入后调用 invalidate_user。几万次抽牌的统计在缓存命中时是微秒级，
+重新计算也只要几毫秒；读库的耗时与历史记录条数成正比，每个代数只读一次。
+"""
+from collections import OrderedDict
+import threading
+
+try:
+    import numpy
+except ImportError:  # 只在使用统计分析时需要
+    numpy = None
+
+import tarot_cards
+
+CARD_COUNT = len(tarot_cards.CARDS)
+
+# 花色分组：0 为大阿尔卡那，1~4 依次为 tarot_cards.SUITS 中的花色
+SUIT_GROUPS = ("major",) + tuple(suit for suit, _, _ in tarot_cards.SUITS)
+
+WEEKDAYS = ("周一", "周二", "周三", "周四", "周五", "周六", "周日")
+
+
+def _suit_index():
+    """牌编号 -> 花色分组下标"""
+    return numpy.array(
+        [0 if card.is_major else SUIT_GROUPS.index(card.suit) for card in tarot_cards.CARDS],
+        dtype=numpy.int8
+    )
+
+
+def _ratio(numerator, denominator):
+    """逐元素相除，分母为 0 处为 0"""
+    numerator = numpy.asarray(numerator, dtype=numpy.float64)
+    return numpy.divide(numerator, denominator, out=numpy.zeros_like(numerator),
+                        where=numpy.asarray(denominator) > 0)
+
+
+class UserDraws:
+    """一个用户的全部抽牌（按时间升序）及其派生统计
+
+    card_ids、reversed、timestamps、reading_ids 为等长数组，同一次占卜的牌相邻；
+    派生统计第一次访问时计算并保存在实例上，数组本身不再变化（数据有变时整个实例被替换）。
+    """
+
+    _SUIT_INDEX = None
+
+    def __init__(self, card_ids, reversed_, timestamps, reading_ids):
+        self.card_ids = numpy.asarray(card_ids, dtype=numpy.int16)
+        self.reversed = numpy.asarray(reversed_, dtype=bool)
+        self.timestamps = numpy.asarray(timestamps, dtype='datetime64[s]')
+        self.reading_ids = numpy.asarray(reading_ids, dtype=numpy.int64)
+        self._results = {}
+        # 派生统计之间互相调用，需要可重入
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_rows(cls, rows):
+        """由 user_draws 语句的结果行构造（reading_time 为 Unix 秒数）"""
+        count = len(rows)
+        return cls(
+            numpy.fromiter((row['card_id'] for row in rows), dtype=numpy.int16, count=count),
+            numpy.fromiter((bool(row['reversed']) for row in rows), dtype=bool, count=count),
+            numpy.fromiter((row['reading_time'] for row in rows), dtype=numpy.int64, count=count)
+            .view('datetime64[s]'),
+            numpy.fromiter((row['reading_id'] for row in rows), dtype=numpy.int64, count=count),
+        )
+
+    def __len__(self):
+        return len(self.card_ids)
+
+    def _memo(self, key, compute):
+        with self._lock:
+            if key not in self._results:
+                self._results[key] = compute()
+            return self._results[key]
+
+    # ---- 频次 ----
+
+    def card_counts(self):
+        """每张牌被抽到的次数（长度 78，下标为牌编号）"""
+        return self._memo('card_counts', lambda: numpy.bincount(self.card_ids, minlength=CARD_COUNT))
+
+    def card_reversed_counts(self):
+        """每张牌逆位的次数"""
+        return self._memo('card_reversed_counts', lambda: numpy.bincount(
+            self.card_ids, weights=self.reversed, minlength=CARD_COUNT
+        ).astype(numpy.int64))
+
+    def card_reversed_ratios(self):
+        """每张牌的逆位比例（没抽到过的牌为 0）"""
+        return self._memo('card_reversed_ratios',
+                          lambda: _ratio(self.card_reversed_counts(), self.card_counts()))
+
+    def card_shares(self):
+        """每张牌占全部抽牌的比例"""
+        return self._memo('card_shares', lambda: _ratio(self.card_counts(), len(self)))
+
+    def suit_counts(self):
+        """按花色分组的次数（顺序同 SUIT_GROUPS）"""
+        if UserDraws._SUIT_INDEX is None:
+            UserDraws._SUIT_INDEX = _suit_index()
+        return self._memo('suit_counts', lambda: numpy.bincount(
+            UserDraws._SUIT_INDEX[self.card_ids], minlength=len(SUIT_GROUPS)
+        ))
+
+    def suit_reversed_ratios(self):
+        """按花色分组的逆位比例"""
+        if UserDraws._SUIT_INDEX is None:
+            UserDraws._SUIT_INDEX = _suit_index()
+        return self._memo('suit_reversed_ratios', lambda: _ratio(
+            numpy.bincount(UserDraws._SUIT_INDEX[self.card_ids], weights=self.reversed,
+                           minlength=len(SUIT_GROUPS)),
+            self.suit_counts()
+        ))
+
+    def reversed_ratio(self):
+        """全部抽牌的逆位比例"""
+        return self._memo('reversed_ratio', lambda: float(self.reversed.mean()) if len(self) else 0.0)
+
+    def top_cards(self, limit=10):
+        """最常抽到的牌 -> [(牌编号, 次数, 逆位比例)]，次数相同时编号小的在前"""
+        def compute():
+            counts = self.card_counts()
+            # 稳定排序保证次数相同时按编号
+            order = numpy.argsort(-counts, kind='stable')[:limit]
+            order = order[counts[order] > 0]
+            ratios = self.card_reversed_ratios()
+            return [(int(card_id), int(counts[card_id]), float(ratios[card_id])) for card_id in order]
+        return self._memo(('top_cards', limit), compute)
+
+    # ---- 时间分布 ----
+
+    def weekday_counts(self):
+        """按星期几（周一为 0）的次数"""
+        def compute():
+            # 1970-01-01 是星期四
+            return numpy.bincount((self._seconds() // 86400 + 3) % 7, minlength=7)
+        return self._memo('weekday_counts', compute)
+
+    def hour_counts(self):
+        """按小时（0~23）的次数"""
+        def compute():
+            return numpy.bincount(self._seconds() // 3600 % 24, minlength=24)
+        return self._memo('hour_counts', compute)
+
+    def _seconds(self):
+        """抽牌时间的 Unix 秒数（int64 视图，不复制）"""
+        return self.timestamps.view(numpy.int64)
+
+    def _days(self):
+        """(起始日期, 每次抽牌距起始日期的天数)"""
+        def compute():
+            days = self.timestamps.astype('datetime64[D]')
+            start = days.min()
+            return start, (days - start).astype(numpy.int64)
+        return self._memo('days', compute)
+
+    def rolling(self, window_days=30):
+        """按天滑动窗口：dates 为每一天，draws/reversed_ratio 为截至当天 window_days 天内的
+        抽牌数和逆位比例"""
+        def compute():
+            if not len(self):
+                return {'dates': numpy.array([], dtype='datetime64[D]'),
+                        'draws': numpy.array([], dtype=numpy.int64),
+                        'reversed_ratio': numpy.array([], dtype=numpy.float64)}
+            start, offsets = self._days()
+            span = int(offsets.max()) + 1
+            daily = numpy.bincount(offsets, minlength=span)
+            daily_reversed = numpy.bincount(offsets, weights=self.reversed, minlength=span)
+            draws = _window_sums(daily, window_days)
+            return {
+                'dates': start + numpy.arange(span),
+                'draws': draws,
+                'reversed_ratio': _ratio(_window_sums(daily_reversed, window_days), draws),
+            }
+        return self._memo(('rolling', window_days), compute)
+
+    def rolling_card_counts(self, window_days=30):
+        """按天滑动窗口的每张牌次数：形状为 (天数, 78) 的数组，行与 rolling() 的 dates 对应"""
+        def compute():
+            if not len(self):
+                return numpy.zeros((0, CARD_COUNT), dtype=numpy.int64)
+            _, offsets = self._days()
+            span = int(offsets.max()) + 1
+            daily = numpy.bincount(offsets * CARD_COUNT + self.card_ids,
+                                   minlength=span * CARD_COUNT).reshape(span, CARD_COUNT)
+            return _window_sums(daily, window_days)
+        return self._memo(('rolling_card_counts', window_days), compute)
+
+    def summary(self, top=10):
+        """仪表盘需要的全部统计（可直接转成 JSON 的普通类型）"""
+        def compute():
+            return {
+                'total_draws': len(self),
+                'total_readings': int(numpy.count_nonzero(numpy.diff(self.reading_ids))) + 1 if len(self) else 0,
+                'first_draw': self.timestamps.min().item() if len(self) else None,
+                'last_draw': self.timestamps.max().item() if len(self) else None,
+                'reversed_ratio': self.reversed_ratio(),
+                'top_cards': [
+                    {'card_id': card_id, 'name': tarot_cards.card_name(card_id),
+                     'count': count, 'reversed_ratio': ratio}
+                    for card_id, count, ratio in self.top_cards(top)
+                ],
+                'suit_counts': dict(zip(SUIT_GROUPS, self.suit_counts().tolist())),
+                'suit_reversed_ratios': dict(zip(SUIT_GROUPS, self.suit_reversed_ratios().tolist())),
+                'weekday_counts': dict(zip(WEEKDAYS, self.weekday_counts().tolist())),
+                'hour_counts': self.hour_counts().tolist(),
+            }
+        return self._memo(('summary', top), compute)
+
+
+def _window_sums(values, window):
+    """沿第 0 维的滑动窗口和（窗口为截至当前的 window 个元素，开头不足时取已有部分）"""
+    sums = numpy.cumsum(values, axis=0)
+    sums[window:] = sums[window:] - sums[:-window].copy()
+    return sums
+
+
+class UserCache:
+    """按用户和数据代数缓存的 LRU：load(user_id) 的结果在数据代数变化前一直有效
+
+    backend 带 generation() 时（ReadingCache）由其决定缓存何时过期，否则写入后需调用
+    invalidate_user。load 返回 None 表示读取失败，不缓存。
+    """
+
+    def __init__(self, backend, load, max_users=32):
+        self.backend = backend
+        self.load = load
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._generations = {}
+        # 无法确定写入涉及哪个用户时整体失效
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def _generation(self, user_id):
+        local = (self._epoch, self._generations.get(user_id, 0))
+        generation = getattr(self.backend, 'generation', None)
+        return (generation(user_id), local) if generation is not None else local
+
+    def invalidate_user(self, user_id):
+        """让该用户的结果在下次访问时重新读取"""
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def clear(self):
+        """让全部用户的结果在下次访问时重新读取"""
+        with self._lock:
+            self._epoch += 1
+
+    def get(self, user_id):
+        """用户的缓存结果，读取失败时返回 None"""
+        with self._lock:
+            generation = self._generation(user_id)
+            entry = self._users.get(user_id)
+            if entry is not None and entry[0] == generation:
+                self._users.move_to_end(user_id)
+                return entry[1]
+
+        # 先取代数再查询：查询期间的写入会让这次结果在下次访问时过期
+        value = self.load(user_id)
+        if value is None:
+            return None
+        with self._lock:
+            self._users[user_id] = (generation, value)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return value
+
+
+class DrawAnalytics:
+    """按用户缓存 UserDraws 的统计分析入口
+
+    backend 为任意存储后端；带 generation() 的后端（ReadingCache）由其决定缓存
+    何时过期，否则写入后需调用 invalidate_user。最多缓存 max_users 个用户。
+    """
+
+    def __init__(self, backend, max_users=32):
+        if numpy is None:
+            raise RuntimeError("统计分析需要安装 numpy")
+        self.backend = backend
+        self._cache = UserCache(backend, self._load, max_users)
+
+    def _load(self, user_id):
+        rows = self.backend.run_statement('user_draws', (user_id,))
+        return UserDraws.from_rows(rows) if rows is not None else None
+
+    def invalidate_user(self, user_id):
+        """让该用户的统计在下次访问时重新读取"""
+        self._cache.invalidate_user(user_id)
+
+    def draws(self, user_id):
+        """用户的 UserDraws（按代数缓存），读取失败时返回 None"""
+        return self._cache.get(user_id)
+
+    def summary(self, user_id, top=10):
+        """仪表盘统计，读取失败时返回 None"""
+        draws = self.draws(user_id)
+        return draws.summary(top) if draws is not None else None
+
+    def rolling(self, user_id, window_days=30):
+        """按天滑动窗口的抽牌数和逆位比例，读取失败时返回 None"""
+        draws = self.draws(user_id)
+        return draws.rolling(window_days) if draws is not None else None
@@ -0,0 +1,64 @@
+# auth_service.py
+"""在后台线程池中执行登录和注册
+
+verify_user/create_user 包含一次完整的 PBKDF2 派生和若干数据库往返，直接在 GUI
+线程中调用会让界面卡住。这里把它们提交到线程池，返回 concurrent.futures.Future；
+界面通过 Future 的回调（见 Widgets.AuthSignals）在完成后收到结果。
+hashlib 在派生密钥时会释放 GIL，多个登录可以在不同线程中真正并行，
+服务端同时处理大量验证时也不会互相阻塞。
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+import password_hash
+
+
+class AuthService:
+    """登录/注册线程池
+
+    db_manager 需可在多个线程中使用（连接池模式的 TarotPostgreSQLManager、
+    TarotSQLiteManager 及其外层的 ReadingCache 均满足）；首次设置向导中还没有
+    存储后端，传入 None，只用于校准密码哈希参数。
+    """
+
+    def __init__(self, db_manager, max_workers=None):
+        self.db_manager = db_manager
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or min(8, os.cpu_count() or 1),
+            thread_name_prefix="tarot-auth"
+        )
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _submit(self, func, *args):
+        with self._lock:
+            self._pending += 1
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def pending(self):
+        """尚未完成的请求数"""
+        with self._lock:
+            return self._pending
+
+    def submit_login(self, username, password):
+        """提交登录验证，Future 的结果与 verify_user 相同（用户字典或 None）"""
+        return self._submit(self.db_manager.verify_user, username, password)
+
+    def submit_register(self, username, password, email=None):
+        """提交注册，Future 的结果与 create_user 相同（新用户ID或 None）"""
+        return self._submit(self.db_manager.create_user, username, password, email)
+
+    def submit_calibration(self):
+        """提交密码哈希参数校准，Future 的结果与 password_hash.calibrate 相同"""
+        return self._submit(password_hash.calibrate)
+
+    def shutdown(self, wait=True):
+        """关闭线程池"""
+        self.executor.shutdown(wait=wait)
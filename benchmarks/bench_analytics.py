@@ -0,0 +1,76 @@
+# bench_analytics.py
+"""测量抽牌统计分析（analytics.py）的读取、计算和缓存命中耗时
+
+用法:
+    python benchmarks/bench_analytics.py --readings 30000
+    python benchmarks/bench_analytics.py --dbname tarot_diary --user postgres --password *** --seed 30000
+
+不指定 --dbname 时在临时 SQLite 文件中生成 --readings 条记录（1~3 张牌）；指定时使用
+该 PostgreSQL 数据库中 benchmark_export 用户的记录，--seed 会先写入指定条数的合成记录。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import analytics
+from bench_export import seed
+from reading_cache import ReadingCache
+
+
+def timed(label, func, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{label:<28} {elapsed * 1000:>10.3f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dbname")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--readings", type=int, default=30000, help="临时 SQLite 库中生成的记录数")
+    parser.add_argument("--seed", type=int, default=0, help="先向 PostgreSQL 写入的合成记录数")
+    args = parser.parse_args()
+
+    if args.dbname:
+        from Tarot_PostgreSQL import TarotPostgreSQLManager
+        db = TarotPostgreSQLManager(args.dbname, args.user, args.password, args.host, args.port)
+        count = args.seed
+    else:
+        from Tarot_SQLite import TarotSQLiteManager
+        db = TarotSQLiteManager(os.path.join(tempfile.mkdtemp(prefix="tarot_analytics_"), "bench.db"))
+        count = args.readings
+    if not db.connect() or not db.initialize_database():
+        sys.exit(1)
+    if count:
+        seed(db, count)
+    user_id = db.run_statement('user_by_name', ("benchmark_export",))[0]['id']
+
+    cache = ReadingCache(db)
+    engine = analytics.DrawAnalytics(cache)
+    draws = timed("读取抽牌", lambda: engine.draws(user_id))
+    print(f"{len(draws)} 次抽牌")
+    timed("summary（首次计算）", lambda: engine.summary(user_id))
+    timed("rolling 30 天（首次计算）", lambda: engine.rolling(user_id, 30))
+    timed("每张牌滚动计数 90 天", lambda: draws.rolling_card_counts(90))
+    timed("summary（缓存命中）", lambda: engine.summary(user_id), repeat=1000)
+
+    fresh = analytics.UserDraws(draws.card_ids, draws.reversed, draws.timestamps, draws.reading_ids)
+    timed("summary（内存数组重新计算）", fresh.summary)
+
+    cache.invalidate_user(user_id)
+    timed("写入后重新读取并计算", lambda: engine.summary(user_id))
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
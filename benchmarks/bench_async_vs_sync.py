@@ -0,0 +1,99 @@
+# bench_async_vs_sync.py
+"""比较同步管理器（线程 + 连接池）与异步管理器在 1/10/100 个并发调用方下的吞吐量
+
+用法:
+    python benchmarks/bench_async_vs_sync.py --dbname tarot_diary --user postgres --password ***
+
+每个调用方连续执行 --ops 次 user_exists 查询，统计总吞吐量和单次延迟分位数。
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from Tarot_PostgreSQL import TarotPostgreSQLManager
+from Tarot_AsyncPostgreSQL import TarotAsyncPostgreSQLManager
+
+CONCURRENCY_LEVELS = (1, 10, 100)
+
+
+def summarize(label, callers, latencies, elapsed):
+    """打印一行结果"""
+    latencies.sort()
+    count = len(latencies)
+    p50 = latencies[count // 2] * 1000
+    p95 = latencies[min(count - 1, int(count * 0.95))] * 1000
+    print(f"{label:<6} {callers:>8} {count:>8} {count / elapsed:>12.1f} {p50:>10.2f} {p95:>10.2f}")
+
+
+def run_sync(args, callers):
+    """同步管理器：每个调用方一个线程，共享连接池"""
+    db = TarotPostgreSQLManager(
+        args.dbname, args.user, args.password, args.host, args.port,
+        pooled=True, minconn=1, maxconn=args.pool_size
+    )
+    if not db.connect():
+        sys.exit(1)
+
+    def caller(_):
+        latencies = []
+        for _ in range(args.ops):
+            start = time.perf_counter()
+            db.user_exists("benchmark_user")
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        results = list(executor.map(caller, range(callers)))
+    elapsed = time.perf_counter() - start
+    summarize("sync", callers, [x for r in results for x in r], elapsed)
+
+
+async def run_async(args, callers):
+    """异步管理器：每个调用方一个协程，共享异步连接池"""
+    db = TarotAsyncPostgreSQLManager(
+        args.dbname, args.user, args.password, args.host, args.port,
+        min_size=1, max_size=args.pool_size
+    )
+    if not await db.connect():
+        sys.exit(1)
+
+    async def caller():
+        latencies = []
+        for _ in range(args.ops):
+            start = time.perf_counter()
+            await db.user_exists("benchmark_user")
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(caller() for _ in range(callers)))
+    elapsed = time.perf_counter() - start
+    summarize("async", callers, [x for r in results for x in r], elapsed)
+    await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dbname", default="tarot_diary")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--ops", type=int, default=200, help="每个调用方执行的查询次数")
+    parser.add_argument("--pool-size", type=int, default=20, help="两种管理器使用相同的连接池上限")
+    args = parser.parse_args()
+
+    print(f"{'mode':<6} {'callers':>8} {'ops':>8} {'ops/s':>12} {'p50 ms':>10} {'p95 ms':>10}")
+    for callers in CONCURRENCY_LEVELS:
+        run_sync(args, callers)
+        asyncio.run(run_async(args, callers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# bench_cooccurrence.py
+"""测量牌面共现（cooccurrence.py）的写入开销、读取和查询耗时
+
+用法:
+    python benchmarks/bench_cooccurrence.py --readings 30000
+    python benchmarks/bench_cooccurrence.py --dbname tarot_diary --user postgres --password *** --seed 30000
+
+不指定 --dbname 时在临时 SQLite 文件中生成 --readings 条记录（1~3 张牌）；指定时使用
+该 PostgreSQL 数据库中 benchmark_export 用户的记录，--seed 会先写入指定条数的合成记录。
+最后用自连接从头统计一遍同一用户的牌对，作为不维护投影时每次查询的代价。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import cooccurrence
+from bench_export import seed, synthetic_readings
+from reading_cache import ReadingCache
+
+FULL_SCAN = """
+    SELECT a.card_id AS card_a, b.card_id AS card_b, COUNT(*) AS together
+    FROM tarot_readings tr
+    JOIN reading_cards a ON a.reading_id = tr.id
+    JOIN reading_cards b ON b.reading_id = tr.id AND b.id > a.id
+    WHERE tr.user_id = %s AND a.card_id IS NOT NULL AND b.card_id IS NOT NULL
+    GROUP BY a.card_id, b.card_id
+"""
+
+
+def timed(label, func, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{label:<28} {elapsed * 1000:>10.3f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dbname")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--readings", type=int, default=30000, help="临时 SQLite 库中生成的记录数")
+    parser.add_argument("--seed", type=int, default=0, help="先向 PostgreSQL 写入的合成记录数")
+    args = parser.parse_args()
+
+    if args.dbname:
+        from Tarot_PostgreSQL import TarotPostgreSQLManager
+        db = TarotPostgreSQLManager(args.dbname, args.user, args.password, args.host, args.port)
+        count = args.seed
+    else:
+        from Tarot_SQLite import TarotSQLiteManager
+        db = TarotSQLiteManager(os.path.join(tempfile.mkdtemp(prefix="tarot_cooccurrence_"), "bench.db"))
+        count = args.readings
+    if not db.connect() or not db.initialize_database():
+        sys.exit(1)
+    if count:
+        timed(f"写入 {count} 条记录", lambda: seed(db, count))
+    user_id = db.run_statement('user_by_name', ("benchmark_export",))[0]['id']
+
+    cache = ReadingCache(db)
+    engine = cooccurrence.CooccurrenceEngine(cache)
+    matrix = timed("读取牌对矩阵", lambda: engine.card_matrix(user_id))
+    print(f"{len(matrix)} 个非零牌对，{matrix.total // 2} 次共现")
+    timed("读取带牌位的矩阵", lambda: engine.position_matrix(user_id))
+    timed("星星的搭档（缓存命中）", lambda: engine.top_partners(user_id, "星星"), repeat=1000)
+    timed("星星在未来牌位的搭档", lambda: engine.top_partners(user_id, "星星", position="未来"), repeat=1000)
+
+    reading = next(synthetic_readings(user_id, 1))
+    reading['cards'] = (reading['cards'] * 3)[:3]
+    timed("写入一条三张牌的记录", lambda: cache.add_tarot_readings_bulk([reading]))
+    timed("写入后重新读取并查询", lambda: engine.top_partners(user_id, "星星"))
+    timed("自连接从头统计牌对", lambda: db.execute_query(FULL_SCAN, (user_id,), fetch=True))
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# bench_export.py
+"""测量日记导出（export.py）各格式的吞吐量
+
+用法:
+    python benchmarks/bench_export.py --readings 100000
+    python benchmarks/bench_export.py --dbname tarot_diary --user postgres --password *** --seed 100000
+
+不指定 --dbname 时在临时 SQLite 文件中生成 --readings 条记录；指定时导出该 PostgreSQL
+数据库的全部记录，--seed 会先为 benchmark_export 用户写入指定条数的合成记录。
+每种格式单独导出一次，最后把全部格式在一次扫描中同时导出。
+"""
+import argparse
+from datetime import datetime, timedelta
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import export
+import tarot_cards
+
+SPREADS = ("一日一牌", "三张牌展开", "凯尔特十字")
+POSITIONS = ("过去", "现在", "未来")
+
+
+def synthetic_readings(user_id, count):
+    """生成 count 条合成记录（每天一条，1~3 张牌）"""
+    start = datetime(2020, 1, 1, 8, 0)
+    for index in range(count):
+        cards = [
+            {
+                'card_id': random.choice(tarot_cards.CARDS)[0],
+                'position': POSITIONS[position],
+                'reversed': random.random() < 0.3,
+                'interpretation': "合成的牌意解读",
+            }
+            for position in range(random.randint(1, 3))
+        ]
+        yield {
+            'user_id': user_id,
+            'spread_type': random.choice(SPREADS),
+            'question': f"第 {index} 个问题：明天会不会顺利？",
+            'reading_date': start + timedelta(hours=index * 6),
+            'cards': cards,
+            'notes': None,
+        }
+
+
+def seed(db, count, batch_size=5000):
+    if not db.user_exists("benchmark_export"):
+        db.create_user("benchmark_export", "benchmark_export")
+    user_id = db.run_statement('user_by_name', ("benchmark_export",))[0]['id']
+    batch = []
+    for reading in synthetic_readings(user_id, count):
+        batch.append(reading)
+        if len(batch) == batch_size:
+            db.add_tarot_readings_bulk(batch)
+            batch = []
+    if batch:
+        db.add_tarot_readings_bulk(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dbname")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--readings", type=int, default=50000, help="临时 SQLite 库中生成的记录数")
+    parser.add_argument("--seed", type=int, default=0, help="先向 PostgreSQL 写入的合成记录数")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tarot_export_")
+    if args.dbname:
+        from Tarot_PostgreSQL import TarotPostgreSQLManager
+        db = TarotPostgreSQLManager(args.dbname, args.user, args.password, args.host, args.port)
+        count = args.seed
+    else:
+        from Tarot_SQLite import TarotSQLiteManager
+        db = TarotSQLiteManager(os.path.join(workdir, "bench.db"))
+        count = args.readings
+    if not db.connect() or not db.initialize_database():
+        sys.exit(1)
+    if count:
+        seed(db, count)
+
+    formats = [name for name in export.WRITERS if name != 'parquet' or export.pyarrow is not None]
+    print(f"{'format':<22} {'readings':>10} {'seconds':>9} {'readings/s':>12} {'MB':>8}")
+    for targets in [[name] for name in formats] + [formats]:
+        paths = {os.path.join(workdir, f"diary.{name}"): name for name in targets}
+        stats = export.export_diary(db, paths)
+        size = sum(os.path.getsize(path) for path in paths) / (1 << 20)
+        print(f"{'+'.join(targets):<22} {stats['readings']:>10} {stats['seconds']:>9.2f} "
+              f"{stats['readings'] / stats['seconds']:>12.0f} {size:>8.1f}")
+    print(f"输出目录: {workdir}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
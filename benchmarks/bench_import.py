@@ -0,0 +1,108 @@
+# bench_import.py
+"""测量 Markdown 日记导入（diary_import.py）的解析和写入吞吐量
+
+用法:
+    python benchmarks/bench_import.py --entries 100000
+    python benchmarks/bench_import.py --entries 100000 --dbname tarot_diary --user postgres --password ***
+
+生成 --entries 个条目的合成日记（混用全角/半角冒号、各种正逆位写法和牌位，夹杂
+少量无法解析的条目），先分别用单进程和进程池只解析一遍，再导入到 benchmark_import
+用户名下：不指定 --dbname 时写入临时 SQLite 文件，指定时写入该 PostgreSQL 数据库（COPY）。
+"""
+import argparse
+from datetime import date, timedelta
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import diary_import
+import tarot_cards
+
+POSITIONS = ("过去", "现在", "未来")
+
+
+def card_text(card):
+    """随机选一种写法"""
+    _, name_zh, name_en, arcana, _, number = card
+    reversed_ = random.random() < 0.3
+    style = random.randrange(4)
+    if style == 0:
+        name = f"逆位{name_zh}" if reversed_ else name_zh
+    elif style == 1:
+        name = f"逆 {name_zh}" if reversed_ else name_zh
+    elif style == 2:
+        name = f"{name_zh}（逆位）" if reversed_ else f"正位{name_zh}"
+    else:
+        name = f"{number} {name_en}" if arcana == "major" else name_en
+        name = f"reversed {name}" if reversed_ else name
+    return name
+
+
+def write_diary(path, count):
+    start = date(2015, 1, 1)
+    with open(path, 'w', encoding='utf-8') as f:
+        for index in range(count):
+            colon = random.choice("：:")
+            f.write(f"#### {start + timedelta(days=index // 3):%Y.%m.%d}\n")
+            if random.random() < 0.002:
+                f.write("这一行没有字段名\n\n")
+                continue
+            cards = random.sample(tarot_cards.CARDS, random.choice((1, 1, 3)))
+            if len(cards) == 1:
+                labels = [card_text(cards[0])]
+            else:
+                labels = [f"{card_text(card)}（{position}）" for card, position in zip(cards, POSITIONS)]
+            f.write(f"问题{colon}第 {index} 个问题：明天会不会顺利？\n")
+            f.write(f"牌面{colon}{'、'.join(labels)}\n")
+            f.write(f"牌意解读{colon}{'；'.join('合成的牌意解读' for _ in cards)}\n\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=50000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--dbname")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tarot_import_")
+    path = os.path.join(workdir, "diary.md")
+    write_diary(path, args.entries)
+    print(f"{args.entries} 个条目，{os.path.getsize(path) / (1 << 20):.1f} MB")
+
+    for workers in sorted({1, args.workers}):
+        start = time.perf_counter()
+        with open(path, encoding='utf-8') as f:
+            parsed = sum(len(chunk) for chunk in diary_import.parse_chunks(
+                diary_import._chunked(diary_import.iter_entries(f), 1000), workers))
+        seconds = time.perf_counter() - start
+        print(f"解析 {workers:>2} 进程: {parsed} 个条目 {seconds:.2f} 秒 ({parsed / seconds:.0f} 条/秒)")
+
+    if args.dbname:
+        from Tarot_PostgreSQL import TarotPostgreSQLManager
+        db = TarotPostgreSQLManager(args.dbname, args.user, args.password, args.host, args.port)
+    else:
+        from Tarot_SQLite import TarotSQLiteManager
+        db = TarotSQLiteManager(os.path.join(workdir, "bench.db"))
+    if not db.connect() or not db.initialize_database():
+        sys.exit(1)
+    if not db.user_exists("benchmark_import"):
+        db.create_user("benchmark_import", "benchmark_import")
+    user_id = db.run_statement('user_by_name', ("benchmark_import",))[0]['id']
+
+    report = diary_import.import_diary(db, path, user_id, workers=args.workers)
+    print(f"导入: {len(report.entries) / report.seconds:.0f} 条/秒")
+    report = diary_import.import_diary(db, path, user_id, workers=args.workers)
+    print(f"重复导入: {len(report.entries) / report.seconds:.0f} 条/秒")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# bench_outcomes.py
+"""测量占卜结果（outcomes.py）的批量记录吞吐量和命中率看板耗时
+
+用法:
+    python benchmarks/bench_outcomes.py --readings 30000
+    python benchmarks/bench_outcomes.py --dbname tarot_diary --user postgres --password *** --seed 30000
+
+不指定 --dbname 时在临时 SQLite 文件中生成 --readings 条记录（1~3 张牌）；指定时使用
+该 PostgreSQL 数据库中 benchmark_export 用户的记录，--seed 会先写入指定条数的合成记录。
+为全部记录随机记上结果后读取看板，最后用连接查询从头统计一遍按牌的命中次数，
+作为不维护投影时每次打开看板的代价。
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import outcomes
+from bench_export import seed
+from reading_cache import ReadingCache
+
+FULL_SCAN = """
+    SELECT rc.card_id, rc.reversed,
+           SUM(CASE WHEN tr.outcome THEN 1 ELSE 0 END) AS hits, COUNT(*) AS total
+    FROM tarot_readings tr
+    JOIN reading_cards rc ON rc.reading_id = tr.id
+    WHERE tr.user_id = %s AND tr.outcome IS NOT NULL AND rc.card_id IS NOT NULL
+    GROUP BY rc.card_id, rc.reversed
+"""
+
+
+def timed(label, func, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{label:<28} {elapsed * 1000:>10.3f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dbname")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--readings", type=int, default=30000, help="临时 SQLite 库中生成的记录数")
+    parser.add_argument("--seed", type=int, default=0, help="先向 PostgreSQL 写入的合成记录数")
+    args = parser.parse_args()
+
+    if args.dbname:
+        from Tarot_PostgreSQL import TarotPostgreSQLManager
+        db = TarotPostgreSQLManager(args.dbname, args.user, args.password, args.host, args.port)
+        count = args.seed
+    else:
+        from Tarot_SQLite import TarotSQLiteManager
+        db = TarotSQLiteManager(os.path.join(tempfile.mkdtemp(prefix="tarot_outcomes_"), "bench.db"))
+        count = args.readings
+    if not db.connect() or not db.initialize_database():
+        sys.exit(1)
+    if count:
+        seed(db, count)
+    user_id = db.run_statement('user_by_name', ("benchmark_export",))[0]['id']
+    reading_ids = [row['id'] for row in db.execute_query(
+        "SELECT id FROM tarot_readings WHERE user_id = %s", (user_id,), fetch=True
+    )]
+
+    cache = ReadingCache(db)
+    tracker = outcomes.OutcomeTracker(cache)
+    results = {reading_id: random.random() < 0.6 for reading_id in reading_ids}
+    start = time.perf_counter()
+    tracker.record_many(results)
+    seconds = time.perf_counter() - start
+    print(f"记录 {len(results)} 条结果: {seconds:.2f} 秒 ({len(results) / seconds:.0f} 条/秒)")
+
+    timed("读取计数并计算看板", lambda: tracker.summary(user_id))
+    timed("看板（缓存命中）", lambda: tracker.summary(user_id), repeat=1000)
+    stats = tracker.stats(user_id)
+    fresh = outcomes.OutcomeStats(stats.card_hits, stats.card_totals,
+                                  stats.spreads, stats.spread_hits, stats.spread_totals)
+    timed("看板（内存计数重新计算）", fresh.summary)
+    timed("记录一条结果", lambda: tracker.record(reading_ids[0], False))
+    timed("记录后重新读取并计算", lambda: tracker.summary(user_id))
+    timed("连接查询从头统计", lambda: db.execute_query(FULL_SCAN, (user_id,), fetch=True))
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
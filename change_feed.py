@@ -0,0 +1,242 @@
+# change_feed.py
+"""占卜记录变更订阅（PostgreSQL LISTEN/NOTIFY）
+
+tarot_readings / reading_cards 上的语句级触发器（结构版本 8）在提交时发出通知，
+负载形如 "i|7|101,102"：操作（i 新增、u 修改、d 删除）、用户ID、记录ID 列表。
+ChangeFeedListener 在独立连接上 LISTEN，把同一时刻到达的通知合并后按ID批量读取
+记录，生成增量变更交给回调；ReadingListModel 把这些变更应用到内存中的有序列表，
+界面只需按返回的行号插入、删除或刷新对应的行，不必清空重载整个历史。
+
+同一账号在多台机器上打开、或本机任何写入之后，各窗口都能及时更新，无需轮询。
+监听连接断开期间的通知会丢失，重连后通过 on_resync 回调通知调用方完整重载一次。
+"""
+from bisect import bisect_left, insort
+import select
+import threading
+import time
+
+import psycopg2
+
+CHANNEL = "tarot_changes"
+
+INSERT = "insert"
+UPDATE = "update"
+DELETE = "delete"
+
+_OPS = {'i': INSERT, 'u': UPDATE, 'd': DELETE}
+
+
+def parse_payload(payload):
+    """解析通知负载 -> (操作, 用户ID, [记录ID])，格式不对时返回 None"""
+    try:
+        op, user_id, ids = payload.split('|')
+        return _OPS[op], int(user_id), [int(reading_id) for reading_id in ids.split(',')]
+    except (KeyError, ValueError):
+        return None
+
+
+class ReadingChange:
+    """一条记录的变更；删除时 reading 为 None"""
+
+    __slots__ = ('op', 'user_id', 'reading_id', 'reading')
+
+    def __init__(self, op, user_id, reading_id, reading=None):
+        self.op = op
+        self.user_id = user_id
+        self.reading_id = reading_id
+        self.reading = reading
+
+    def __repr__(self):
+        return f"ReadingChange({self.op}, user={self.user_id}, id={self.reading_id})"
+
+
+def coalesce(notifications):
+    """合并一批通知 -> {记录ID: (操作, 用户ID)}
+
+    同一记录先新增后修改（如先写记录再写牌面）仍记为新增；删除优先于其他操作。
+    """
+    merged = {}
+    for op, user_id, reading_ids in notifications:
+        for reading_id in reading_ids:
+            previous = merged.get(reading_id)
+            if previous is None or op == DELETE or (op == INSERT and previous[0] == UPDATE):
+                merged[reading_id] = (op, user_id)
+    return merged
+
+
+class ChangeFeedListener:
+    """后台线程：订阅变更通知，读取变更后的记录并回调 on_changes(changes)
+
+    backend 需提供 connection_params 和 get_readings_by_ids（TarotPostgreSQLManager，
+    或其外层的 ReadingCache / JournaledBackend）。只关心某个用户时传入 user_id，
+    其他用户的通知直接忽略。回调在监听线程中执行，界面需自行转回 GUI 线程。
+    后端带读缓存时，收到通知会先让该用户的缓存失效。
+    """
+
+    def __init__(self, backend, on_changes, on_resync=None, user_id=None,
+                 coalesce_window=0.05, poll_interval=1.0, max_backoff=60.0):
+        self.backend = backend
+        self.on_changes = on_changes
+        self.on_resync = on_resync
+        self.user_id = user_id
+        self.coalesce_window = coalesce_window
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="tarot-change-feed", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        delay = 1.0
+        connected_before = False
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.backend.connection_params)
+                conn.set_session(autocommit=True)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL}")
+                if connected_before and self.on_resync is not None:
+                    # 断线期间的通知已经丢失
+                    self.on_resync()
+                connected_before = True
+                delay = 1.0
+                self._listen(conn)
+            except psycopg2.Error as e:
+                print(f"❌ 变更订阅连接中断: {e}")
+            finally:
+                if conn is not None:
+                    conn.close()
+            self._stop.wait(delay)
+            delay = min(delay * 2, self.max_backoff)
+
+    def _listen(self, conn):
+        while not self._stop.is_set():
+            ready, _, _ = select.select([conn], [], [], self.poll_interval)
+            if not ready:
+                continue
+            conn.poll()
+            if self.coalesce_window:
+                # 稍等同一批写入的后续通知，合并成一次查询
+                time.sleep(self.coalesce_window)
+                conn.poll()
+            notifies = list(conn.notifies)
+            conn.notifies.clear()
+            changes = self.changes_for(notify.payload for notify in notifies)
+            if changes:
+                self.on_changes(changes)
+
+    def changes_for(self, payloads):
+        """把一批通知负载转换为 ReadingChange 列表（读取失败时返回空列表并请求重载）"""
+        notifications = []
+        for payload in payloads:
+            parsed = parse_payload(payload)
+            if parsed is None or (self.user_id is not None and parsed[1] != self.user_id):
+                continue
+            notifications.append(parsed)
+        merged = coalesce(notifications)
+        if not merged:
+            return []
+
+        invalidate = getattr(self.backend, 'invalidate_user', None)
+        if invalidate is not None:
+            for user_id in {user_id for _, user_id in merged.values()}:
+                invalidate(user_id)
+
+        changes = []
+        to_fetch = [reading_id for reading_id, (op, _) in merged.items() if op != DELETE]
+        fetched = {}
+        if to_fetch:
+            readings = self.backend.get_readings_by_ids(to_fetch)
+            if readings is None:
+                if self.on_resync is not None:
+                    self.on_resync()
+                return []
+            fetched = {reading['id']: reading for reading in readings}
+
+        for reading_id, (op, user_id) in merged.items():
+            reading = fetched.get(reading_id)
+            if op == DELETE or reading is None:
+                # 读取前已被删除
+                changes.append(ReadingChange(DELETE, user_id, reading_id))
+            else:
+                changes.append(ReadingChange(op, user_id, reading_id, reading))
+        return changes
+
+
+class ReadingListModel:
+    """按 (reading_date, id) 倒序排列的占卜记录，增量应用变更
+
+    apply() 返回界面需要执行的行操作：('insert', 行号, 记录)、('remove', 行号)、
+    ('update', 行号, 记录)，按顺序执行即可与模型保持一致。
+    """
+
+    def __init__(self, readings=()):
+        self.reset(readings)
+
+    def reset(self, readings):
+        self._readings = {reading['id']: reading for reading in readings}
+        # 升序保存排序键，行号 = 长度 - 1 - 下标
+        self._keys = sorted(self._key(reading) for reading in self._readings.values())
+
+    @staticmethod
+    def _key(reading):
+        return (reading['reading_date'], reading['id'])
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        for _, reading_id in reversed(self._keys):
+            yield self._readings[reading_id]
+
+    def __getitem__(self, row):
+        return self._readings[self._keys[len(self._keys) - 1 - row][1]]
+
+    def row_of(self, reading_id):
+        """记录所在的行号，不在列表中时返回 None"""
+        reading = self._readings.get(reading_id)
+        if reading is None:
+            return None
+        return len(self._keys) - 1 - bisect_left(self._keys, self._key(reading))
+
+    def _remove(self, reading_id):
+        row = self.row_of(reading_id)
+        del self._keys[len(self._keys) - 1 - row]
+        del self._readings[reading_id]
+        return row
+
+    def _insert(self, reading):
+        key = self._key(reading)
+        insort(self._keys, key)
+        self._readings[reading['id']] = reading
+        return len(self._keys) - 1 - bisect_left(self._keys, key)
+
+    def apply(self, changes):
+        """应用一批 ReadingChange，返回行操作列表"""
+        operations = []
+        for change in changes:
+            existing = self._readings.get(change.reading_id)
+            if change.op == DELETE:
+                if existing is not None:
+                    operations.append(('remove', self._remove(change.reading_id)))
+            elif existing is None:
+                operations.append(('insert', self._insert(change.reading), change.reading))
+            elif self._key(existing) == self._key(change.reading):
+                self._readings[change.reading_id] = change.reading
+                operations.append(('update', self.row_of(change.reading_id), change.reading))
+            else:
+                # 时间变了，位置随之改变
+                operations.append(('remove', self._remove(change.reading_id)))
+                operations.append(('insert', self._insert(change.reading), change.reading))
+        return operations
@@ -1,8 +1,11 @@
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values
 from datetime import datetime
 import hashlib
 import secrets
+import migrations
+import tarot_cards
 
 class TarotPostgreSQLManager:
     def __init__(self, dbname, user, password, host="localhost", port="5432"):
@@ -76,72 +79,13 @@ class TarotPostgreSQLManager:
             return None
     
     def initialize_database(self):
-        """初始化数据库表结构"""
-        #先删除旧表（如果存在）- 仅用于开发环境
-        """drop_tables = [
-            "DROP TABLE IF EXISTS user_settings CASCADE",
-            "DROP TABLE IF EXISTS reading_cards CASCADE", 
-            "DROP TABLE IF EXISTS tarot_readings CASCADE",
-            "DROP TABLE IF EXISTS users CASCADE"
-        ]
-        
-        for drop_sql in drop_tables:
-            try:
-                self.cursor.execute(drop_sql)
-            except:
-                pass"""
-        
-        # 创建新表
-        tables = [
-            """
-            CREATE TABLE users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(50) UNIQUE NOT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                email VARCHAR(100),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP
-            )
-            """,
-            """
-            CREATE TABLE tarot_readings (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                spread_type VARCHAR(50) NOT NULL,
-                question TEXT,
-                reading_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                notes TEXT
-            )
-            """,
-            """
-            CREATE TABLE reading_cards (
-                id SERIAL PRIMARY KEY,
-                reading_id INTEGER NOT NULL REFERENCES tarot_readings(id) ON DELETE CASCADE,
-                card_name VARCHAR(100) NOT NULL,
-                position VARCHAR(50),
-                orientation VARCHAR(10) DEFAULT 'upright',
-                interpretation TEXT
-            )
-            """,
-            """
-            CREATE TABLE user_settings (
-                user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
-                language VARCHAR(10) DEFAULT 'zh_CN',
-                theme VARCHAR(20) DEFAULT 'light',
-                notification_enabled BOOLEAN DEFAULT TRUE
-            )
-            """
-        ]
-        
-        for i, table_sql in enumerate(tables):
-            try:
-                self.cursor.execute(table_sql)
-                print(f"✅ 表创建成功 [{i+1}/{len(tables)}]")
-            except Exception as e:
-                print(f"❌ 创建表失败 [{i+1}/{len(tables)}]: {e}")
-        
-        self.conn.commit()
-        print("✅ 数据库初始化完成")
+        """初始化/升级数据库表结构（与主程序相同，由 migrations 维护）"""
+        try:
+            version = migrations.migrate(self.conn)
+            print(f"✅ 数据库初始化完成（结构版本 {version}）")
+        except Exception as e:
+            self.conn.rollback()
+            print(f"❌ 数据库初始化失败: {e}")
     
     def create_user(self, username, password, email=None):
         """创建新用户"""
@@ -227,19 +171,23 @@ class TarotPostgreSQLManager:
             
             reading_id = reading_result[0]
             
-            # 插入每张牌的信息
+            # 所有牌面用一条多行 INSERT 写入；标准牌只存编号，无法识别的牌名存入 card_name
             card_query = """
-            INSERT INTO reading_cards (reading_id, card_name, position, orientation, interpretation)
-            VALUES (%s, %s, %s, %s, %s)
+            INSERT INTO reading_cards (reading_id, card_id, card_name, position, reversed, interpretation)
+            VALUES %s
             """
+            card_rows = []
             for card in cards_data:
-                self.cursor.execute(card_query, (
-                    reading_id, 
-                    card['name'], 
-                    card['position'], 
-                    card.get('orientation', 'upright'), 
+                card_id, custom_name, reversed_ = tarot_cards.parse_card_data(card)
+                card_rows.append((
+                    reading_id,
+                    card_id,
+                    custom_name,
+                    card.get('position'),
+                    reversed_,
                     card.get('interpretation', '')
                 ))
+            execute_values(self.cursor, card_query, card_rows)
             
             # 提交事务
             self.conn.commit()
@@ -258,14 +206,16 @@ class TarotPostgreSQLManager:
             tr.id, tr.spread_type, tr.question, tr.reading_date, tr.notes,
             json_agg(
                 json_build_object(
-                    'name', rc.card_name,
+                    'card_id', rc.card_id,
+                    'name', COALESCE(c.name_zh, rc.card_name),
                     'position', rc.position,
-                    'orientation', rc.orientation,
+                    'orientation', CASE WHEN rc.reversed THEN 'reversed' ELSE 'upright' END,
                     'interpretation', rc.interpretation
-                )
+                ) ORDER BY rc.id
             ) as cards
         FROM tarot_readings tr
         LEFT JOIN reading_cards rc ON tr.id = rc.reading_id
+        LEFT JOIN cards c ON c.id = rc.card_id
         WHERE tr.user_id = %s
         GROUP BY tr.id, tr.spread_type, tr.question, tr.reading_date, tr.notes
         ORDER BY tr.reading_date DESC
@@ -287,15 +237,17 @@ class TarotPostgreSQLManager:
             u.username,
             json_agg(
                 json_build_object(
-                    'name', rc.card_name,
+                    'card_id', rc.card_id,
+                    'name', COALESCE(c.name_zh, rc.card_name),
                     'position', rc.position,
-                    'orientation', rc.orientation,
+                    'orientation', CASE WHEN rc.reversed THEN 'reversed' ELSE 'upright' END,
                     'interpretation', rc.interpretation
-                )
+                ) ORDER BY rc.id
             ) as cards
         FROM tarot_readings tr
         JOIN users u ON tr.user_id = u.id
         LEFT JOIN reading_cards rc ON tr.id = rc.reading_id
+        LEFT JOIN cards c ON c.id = rc.card_id
         WHERE tr.id = %s
         GROUP BY tr.id, tr.spread_type, tr.question, tr.reading_date, tr.notes, u.username
         """
@@ -392,10 +344,11 @@ class TarotPostgreSQLManager:
         SELECT DISTINCT tr.*
         FROM tarot_readings tr
         LEFT JOIN reading_cards rc ON tr.id = rc.reading_id
+        LEFT JOIN cards c ON c.id = rc.card_id
         WHERE tr.user_id = %s AND (
             tr.question ILIKE %s OR 
             tr.notes ILIKE %s OR
-            rc.card_name ILIKE %s OR
+            COALESCE(c.name_zh || ' ' || c.name_en, rc.card_name) ILIKE %s OR
             rc.interpretation ILIKE %s
         )
         ORDER BY tr.reading_date DESC
@@ -421,6 +374,7 @@ class TarotPostgreSQLManager:
 from PySide6.QtWidgets import QApplication, QMainWindow, QPushButton, QLabel, QVBoxLayout, QWidget, QLineEdit, QHBoxLayout, QMessageBox,QInputDialog
 from PySide6.QtCore import Qt
 import sys
+import Tarot_PostgreSQL
 
 class CheckIn:
     def __init__(self):
@@ -428,8 +382,9 @@ class CheckIn:
         self.window.setWindowTitle("塔罗牌日记 - 登录")
         self.window.setGeometry(100, 100, 400, 300)
         
-        # 使用PostgreSQL数据库
-        self.db = TarotPostgreSQLManager(
+        # 界面使用主程序的 PostgreSQL 后端（连接池、变更通知、按ID批量读取），
+        # 上面的 TarotPostgreSQLManager 只保留给文件末尾的测试代码
+        self.db = Tarot_PostgreSQL.TarotPostgreSQLManager(
             dbname="tarot_diary",
             user="postgres",      # 替换为你的用户名
             password="password",  # 替换为你的密码
@@ -567,7 +522,13 @@ from PySide6.QtWidgets import (QTabWidget, QTextEdit, QComboBox,
                                QListWidget, QListWidgetItem, QSplitter,
                                QInputDialog, QMenu, QDialog, QDialogButtonBox,
                                QFormLayout)
-from PySide6.QtCore import QTimer
+from PySide6.QtCore import QTimer, QObject, Signal
+from change_feed import ChangeFeedListener, ReadingListModel
+
+class ChangeFeedSignals(QObject):
+    """把变更订阅线程的结果送回 GUI 线程"""
+    changes = Signal(object)
+    resync = Signal()
 
 class MainWindow:
     def __init__(self, user, db_manager):
@@ -576,8 +537,12 @@ class MainWindow:
         self.window = QMainWindow()
         self.window.setWindowTitle(f"塔罗牌日记 - {user['username']}")
         self.window.setGeometry(100, 100, 1200, 800)
+        # 列表中的记录（按时间倒序），变更通知到达时增量更新
+        self.readings_model = ReadingListModel()
+        self.change_feed = None
         
         self.initUI()
+        self.start_change_feed()
     
     def initUI(self):
         """初始化主界面"""
@@ -749,21 +714,55 @@ class MainWindow:
             else:
                 self.theme_combo.setCurrentText("浅色主题")
     
+    def start_change_feed(self):
+        """订阅本账号的记录变更（需要支持 LISTEN/NOTIFY 的 PostgreSQL 后端）"""
+        self.feed_signals = ChangeFeedSignals()
+        self.feed_signals.changes.connect(self.apply_reading_changes)
+        self.feed_signals.resync.connect(self.load_readings)
+        self.change_feed = ChangeFeedListener(
+            self.db,
+            self.feed_signals.changes.emit,
+            self.feed_signals.resync.emit,
+            user_id=self.user['id']
+        )
+        self.change_feed.start()
+    
+    def reading_item_text(self, reading):
+        """列表中一条记录的显示文本"""
+        item_text = f"{reading['spread_type']} - {reading['reading_date'].strftime('%Y-%m-%d %H:%M')}"
+        if reading['question']:
+            # 截断长问题
+            question = reading['question'][:50] + "..." if len(reading['question']) > 50 else reading['question']
+            item_text += f"\n  问题: {question}"
+        return item_text
+    
+    def reading_item(self, reading):
+        item = QListWidgetItem(self.reading_item_text(reading))
+        item.setData(Qt.UserRole, reading['id'])  # 存储记录ID
+        return item
+    
     def load_readings(self):
         """加载占卜记录"""
         self.readings_list.clear()
         readings = self.db.get_user_readings(self.user['id'])
+        self.readings_model.reset(readings)
         
-        for reading in readings:
-            item_text = f"{reading['spread_type']} - {reading['reading_date'].strftime('%Y-%m-%d %H:%M')}"
-            if reading['question']:
-                # 截断长问题
-                question = reading['question'][:50] + "..." if len(reading['question']) > 50 else reading['question']
-                item_text += f"\n  问题: {question}"
-            
-            item = QListWidgetItem(item_text)
-            item.setData(Qt.UserRole, reading['id'])  # 存储记录ID
-            self.readings_list.addItem(item)
+        for reading in self.readings_model:
+            self.readings_list.addItem(self.reading_item(reading))
+    
+    def apply_reading_changes(self, changes):
+        """把变更通知应用到列表，只改动受影响的行"""
+        operations = self.readings_model.apply(changes)
+        if self.search_input.text().strip():
+            # 正在显示搜索结果，清空搜索后再显示最新列表
+            return
+        for operation in operations:
+            if operation[0] == 'insert':
+                self.readings_list.insertItem(operation[1], self.reading_item(operation[2]))
+            elif operation[0] == 'remove':
+                self.readings_list.takeItem(operation[1])
+            else:
+                self.readings_list.item(operation[1]).setText(self.reading_item_text(operation[2]))
     
     def search_readings(self):
         """搜索占卜记录"""
@@ -777,7 +776,13 @@ class MainWindow:
                 item.setData(Qt.UserRole, reading['id'])
                 self.readings_list.addItem(item)
         else:
-            self.load_readings()
+            self.show_model_readings()
+    
+    def show_model_readings(self):
+        """显示模型中的记录"""
+        self.readings_list.clear()
+        for reading in self.readings_model:
+            self.readings_list.addItem(self.reading_item(reading))
     
     def show_reading_details(self, item):
         """显示占卜记录详情"""
@@ -806,7 +811,8 @@ class MainWindow:
             # 显示卡片
             cards_text = "\n卡片:\n"
             for i, card in enumerate(reading['cards'], 1):
-                cards_text += f"{i}. {card['name']} ({card['position']}) - {card['orientation']}\n"
+                label = tarot_cards.card_label(card['name'], card['orientation'] == 'reversed', card['position'])
+                cards_text += f"{i}. {label}\n"
                 if card['interpretation']:
                     cards_text += f"   解释: {card['interpretation']}\n"
             
@@ -840,7 +846,7 @@ class MainWindow:
                                            QMessageBox.Yes | QMessageBox.No)
                 if reply == QMessageBox.Yes:
                     if self.db.delete_reading(reading_id):
-                        self.load_readings()
+                        # 该行由变更通知移除
                         QMessageBox.information(self.window, "成功", "记录已删除")
     
     def start_reading(self):
@@ -872,8 +878,7 @@ class MainWindow:
         if reading_id:
             QMessageBox.information(self.window, "成功", "占卜记录已保存！")
             self.question_input.clear()
-            self.tabs.setCurrentIndex(0)  # 切换到记录标签页
-            self.load_readings()
+            self.tabs.setCurrentIndex(0)  # 切换到记录标签页，新记录由变更通知插入
     
     def save_settings(self):
         """保存用户设置"""
@@ -894,6 +899,7 @@ class MainWindow:
                                    "确定要退出登录吗？", 
                                    QMessageBox.Yes | QMessageBox.No)
         if reply == QMessageBox.Yes:
+            self.change_feed.stop()
             self.db.close()
             self.window.close()
             # 这里可以添加重新显示登录窗口的逻辑
@@ -11,6 +11,7 @@ else:
     base_path = os.path.abspath(os.path.dirname(__file__))  # 开发环境下的脚本所在目录     
 sys.path.append(os.path.join(base_path, ".."))          # add parent directory to sys.path
 from config_manager import SecureConfigManager
+import migrations
 
 class FirstRunWizard(QDialog):
     def __init__(self, parent=None):
@@ -253,54 +254,9 @@ class FirstRunWizard(QDialog):
         """执行数据库初始化"""
         try:
             conn = psycopg2.connect(**self.db_config)
-            cursor = conn.cursor()
-            
-            # 创建表
-            tables = [
-                """
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    username VARCHAR(50) UNIQUE NOT NULL,
-                    password_hash VARCHAR(255) NOT NULL,
-                    email VARCHAR(100),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_login TIMESTAMP
-                )
-                """,
-                """
-                CREATE TABLE IF NOT EXISTS tarot_readings (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    spread_type VARCHAR(50) NOT NULL,
-                    question TEXT,
-                    reading_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    notes TEXT
-                )
-                """,
-                """
-                CREATE TABLE IF NOT EXISTS reading_cards (
-                    id SERIAL PRIMARY KEY,
-                    reading_id INTEGER NOT NULL REFERENCES tarot_readings(id) ON DELETE CASCADE,
-                    card_name VARCHAR(100) NOT NULL,
-                    position VARCHAR(50),
-                    orientation VARCHAR(10) DEFAULT 'upright',
-                    interpretation TEXT
-                )
-                """,
-                """
-                CREATE TABLE IF NOT EXISTS user_settings (
-                    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
-                    language VARCHAR(10) DEFAULT 'zh_CN',
-                    theme VARCHAR(20) DEFAULT 'light',
-                    notification_enabled BOOLEAN DEFAULT TRUE
-                )
-                """
-            ]
-            
-            for i, table_sql in enumerate(tables, 1):
-                cursor.execute(table_sql)
+            # 表结构统一由 migrations 维护
+            migrations.migrate(conn)
             
-            conn.commit()
             conn.close()
             
             QMessageBox.information(self, "设置完成", 
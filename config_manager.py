@@ -15,6 +15,9 @@ class SecureConfigManager:
         self.config_dir = self._get_config_dir()
         self.config_file = self.config_dir / "database_config.json"
         self.key_file = self.config_dir / "encryption.key"
+        self.session_file = self.config_dir / "session.token"
+        # 数据库不可达时新占卜记录的本地预写日志（见 journal.py）
+        self.journal_file = self.config_dir / "readings.journal"
         self.fernet = None
         self._initialize_encryption()
     
@@ -92,23 +95,34 @@ class SecureConfigManager:
             return None
     
     def save_database_config(self, db_config):
-        """保存数据库配置"""
+        """保存数据库配置
+        
+        backend 为 'sqlite' 时只需要数据库文件路径 path，否则为 PostgreSQL 连接信息。
+        """
+        backend = db_config.get('backend', 'postgresql')
+        
         # 验证必要字段
-        required_fields = ['host', 'port', 'dbname', 'user', 'password']
+        if backend == 'sqlite':
+            required_fields = ['path']
+        else:
+            required_fields = ['host', 'port', 'dbname', 'user', 'password']
         for field in required_fields:
             if field not in db_config or not db_config[field]:
                 raise ValueError(f"缺少必要的数据库配置字段: {field}")
         
         # 加密敏感信息
         encrypted_config = {
-            'host': self.encrypt(db_config['host']),
-            'port': self.encrypt(str(db_config['port'])),
-            'dbname': self.encrypt(db_config['dbname']),
-            'user': self.encrypt(db_config['user']),
-            'password': self.encrypt(db_config['password']),
+            field: self.encrypt(str(db_config[field])) for field in required_fields
+        }
+        # 可选配置：连接池大小、查询统计、校准过的密码哈希参数
+        for field in ('pool_min', 'pool_max', 'slow_query_ms', 'metrics_path', 'password_hash'):
+            if db_config.get(field) is not None:
+                encrypted_config[field] = self.encrypt(str(db_config[field]))
+        encrypted_config.update({
             'save_timestamp': self.encrypt(str(os.path.getmtime(__file__))),
+            'backend': backend,
             'version': '1.0'
-        }
+        })
         
         try:
             with open(self.config_file, 'w', encoding='utf-8') as f:
@@ -136,7 +150,7 @@ class SecureConfigManager:
             # 解密所有字段
             decrypted_config = {}
             for key, encrypted_value in encrypted_config.items():
-                if key == 'version':
+                if key in ('version', 'backend'):
                     decrypted_config[key] = encrypted_value
                 else:
                     decrypted_value = self.decrypt(encrypted_value)
@@ -174,6 +188,38 @@ class SecureConfigManager:
             print(f"❌ 删除配置失败: {e}")
         return False
     
+    def save_session_token(self, token):
+        """保存“记住我”令牌（加密后写入）"""
+        try:
+            with open(self.session_file, 'w', encoding='utf-8') as f:
+                f.write(self.encrypt(token))
+            if platform.system() != "Windows":
+                os.chmod(self.session_file, 0o600)
+            return True
+        except Exception as e:
+            print(f"❌ 保存登录令牌失败: {e}")
+            return False
+    
+    def load_session_token(self):
+        """读取“记住我”令牌，没有时返回 None"""
+        if not self.session_file.exists():
+            return None
+        try:
+            with open(self.session_file, 'r', encoding='utf-8') as f:
+                return self.decrypt(f.read().strip())
+        except Exception as e:
+            print(f"❌ 读取登录令牌失败: {e}")
+            return None
+    
+    def delete_session_token(self):
+        """删除“记住我”令牌"""
+        if self.session_file.exists():
+            self.session_file.unlink()
+    
+    def default_sqlite_path(self):
+        """SQLite 后端默认的数据库文件位置（与配置文件同目录）"""
+        return self.config_dir / "tarot_diary.db"
+    
     def get_config_info(self):
         """获取配置信息（不包含密码）"""
         config = self.load_database_config()
@@ -0,0 +1,184 @@
+# cooccurrence.py
+"""牌面共现分析：哪些牌经常在同一次占卜中一起出现、出现在哪些牌位
+
+计数由数据库触发器维护在 card_pair_counts / card_position_pair_counts 两张投影表里
+（见 migrations.py 的“牌面共现投影表”）：每次写入或删除只更新变化的牌所在的牌对，
+读取一个用户的共现矩阵只需读出非零的牌对（牌与牌之间至多 78*79/2 行），与历史
+记录条数无关：
+
+    engine = CooccurrenceEngine(db_manager)
+    engine.top_partners(user_id, "星星")                    # 最常与星星一起出现的牌
+    engine.top_partners(user_id, "星星", position="未来")   # 星星在“未来”牌位时的搭档及其牌位
+
+关联度量采用共现矩阵的常规定义：对称矩阵 M 的行和作为每个节点的边际计数，
+lift = M[a,b]·ΣM / (行和[a]·行和[b])，PMI = log2(lift)。只一起出现过一两次的牌对
+lift 波动很大，默认至少一起出现 2 次才参与排序。
+"""
+try:
+    import numpy
+except ImportError:  # 只在使用共现分析时需要
+    numpy = None
+
+from analytics import CARD_COUNT, UserCache
+import tarot_cards
+
+MEASURES = ('lift', 'pmi', 'count')
+
+
+class PairMatrix:
+    """对称共现矩阵的稀疏（COO）形式，只存上三角的非零项
+
+    labels[i] 为第 i 个节点：牌与牌的矩阵中是牌编号，带牌位的矩阵中是 (牌编号, 牌位)。
+    rows/cols/counts 为等长数组，rows <= cols。
+    """
+
+    def __init__(self, labels, rows, cols, counts):
+        self.labels = labels
+        self.rows = numpy.asarray(rows, dtype=numpy.int32)
+        self.cols = numpy.asarray(cols, dtype=numpy.int32)
+        self.counts = numpy.asarray(counts, dtype=numpy.int64)
+        self._index = {label: i for i, label in enumerate(labels)}
+        # 行和：非对角项在对称矩阵中出现两次，对角项（同一次占卜抽到两张同样的牌）一次
+        off_diagonal = self.rows != self.cols
+        self.margins = (
+            numpy.bincount(self.rows, weights=self.counts, minlength=len(labels))
+            + numpy.bincount(self.cols[off_diagonal], weights=self.counts[off_diagonal], minlength=len(labels))
+        ).astype(numpy.int64)
+        self.total = int(self.margins.sum())
+
+    @classmethod
+    def from_card_rows(cls, rows):
+        """由 card_pairs 语句的结果行构造，节点为全部 78 张牌"""
+        count = len(rows)
+        return cls(
+            tuple(range(CARD_COUNT)),
+            numpy.fromiter((row['card_a'] for row in rows), dtype=numpy.int32, count=count),
+            numpy.fromiter((row['card_b'] for row in rows), dtype=numpy.int32, count=count),
+            numpy.fromiter((row['together'] for row in rows), dtype=numpy.int64, count=count),
+        )
+
+    @classmethod
+    def from_position_rows(cls, rows):
+        """由 position_pairs 语句的结果行构造，节点为出现过的 (牌编号, 牌位)"""
+        index = {}
+        rows_, cols = [], []
+        for row in rows:
+            rows_.append(index.setdefault((row['card_a'], row['position_a']), len(index)))
+            cols.append(index.setdefault((row['card_b'], row['position_b']), len(index)))
+        return cls(tuple(index), rows_, cols, [row['together'] for row in rows])
+
+    def __len__(self):
+        """非零牌对的个数"""
+        return len(self.counts)
+
+    def index(self, label):
+        """节点下标，没出现过的节点返回 None"""
+        return self._index.get(label)
+
+    def dense(self):
+        """完整的对称计数矩阵（节点数 x 节点数）"""
+        matrix = numpy.zeros((len(self.labels), len(self.labels)), dtype=numpy.int64)
+        matrix[self.rows, self.cols] = self.counts
+        matrix[self.cols, self.rows] = self.counts
+        return matrix
+
+    def partners(self, label, min_count=1):
+        """与节点一起出现过的节点 -> (下标, 次数, lift, PMI) 四个等长数组"""
+        node = self.index(label)
+        if node is None:
+            empty = numpy.array([], dtype=numpy.int64)
+            return empty, empty, empty.astype(numpy.float64), empty.astype(numpy.float64)
+        as_row = self.rows == node
+        mask = (as_row | (self.cols == node)) & (self.counts >= min_count)
+        others = numpy.where(as_row, self.cols, self.rows)[mask]
+        counts = self.counts[mask]
+        lift = counts * self.total / (self.margins[node] * self.margins[others]).astype(numpy.float64)
+        return others, counts, lift, numpy.log2(lift)
+
+    def top_partners(self, label, limit=10, measure='lift', min_count=2):
+        """按 measure（lift / pmi / count）从高到低的搭档 -> [(节点, 次数, lift, PMI)]
+
+        度量相同时次数多的在前，再按节点下标。
+        """
+        if measure not in MEASURES:
+            raise ValueError(f"不支持的关联度量: {measure}")
+        others, counts, lift, pmi = self.partners(label, min_count)
+        primary = counts if measure == 'count' else lift
+        # lexsort 以最后一个键为主键
+        order = numpy.lexsort((others, -counts, -primary))[:limit]
+        return [
+            (self.labels[others[i]], int(counts[i]), float(lift[i]), float(pmi[i]))
+            for i in order
+        ]
+
+
+def resolve(card):
+    """牌编号或牌名 -> 牌编号，无法识别时抛出 ValueError"""
+    if isinstance(card, int):
+        card_id = card if 0 <= card < CARD_COUNT else None
+    else:
+        card_id, _ = tarot_cards.resolve_card(card)
+    if card_id is None:
+        raise ValueError(f"无法识别的牌: {card}")
+    return card_id
+
+
+class CooccurrenceEngine:
+    """按用户缓存共现矩阵的查询入口
+
+    backend 为任意存储后端；带 generation() 的后端（ReadingCache）由其决定缓存
+    何时过期，否则写入后需调用 invalidate_user。最多缓存 max_users 个用户。
+    """
+
+    def __init__(self, backend, max_users=32):
+        if numpy is None:
+            raise RuntimeError("共现分析需要安装 numpy")
+        self.backend = backend
+        self._cards = UserCache(backend, self._load_cards, max_users)
+        self._positions = UserCache(backend, self._load_positions, max_users)
+
+    def _load_cards(self, user_id):
+        rows = self.backend.run_statement('card_pairs', (user_id,))
+        return PairMatrix.from_card_rows(rows) if rows is not None else None
+
+    def _load_positions(self, user_id):
+        rows = self.backend.run_statement('position_pairs', (user_id,))
+        return PairMatrix.from_position_rows(rows) if rows is not None else None
+
+    def invalidate_user(self, user_id):
+        """让该用户的共现矩阵在下次访问时重新读取"""
+        self._cards.invalidate_user(user_id)
+        self._positions.invalidate_user(user_id)
+
+    def card_matrix(self, user_id):
+        """牌与牌的共现矩阵（节点为牌编号），读取失败时返回 None"""
+        return self._cards.get(user_id)
+
+    def position_matrix(self, user_id):
+        """带牌位的共现矩阵（节点为 (牌编号, 牌位)，没有牌位为空字符串），读取失败时返回 None"""
+        return self._positions.get(user_id)
+
+    def top_partners(self, user_id, card, position=None, limit=10, measure='lift', min_count=2):
+        """与一张牌关联最强的牌，读取失败时返回 None
+
+        card 为牌编号或牌名；给出 position 时只看这张牌在该牌位的占卜，结果带搭档的牌位。
+        """
+        card_id = resolve(card)
+        if position is None:
+            matrix = self.card_matrix(user_id)
+            label = card_id
+        else:
+            matrix = self.position_matrix(user_id)
+            label = (card_id, position)
+        if matrix is None:
+            return None
+
+        partners = []
+        for node, count, lift, pmi in matrix.top_partners(label, limit, measure, min_count):
+            partner_id, partner_position = node if position is not None else (node, None)
+            partner = {'card_id': partner_id, 'name': tarot_cards.card_name(partner_id)}
+            if position is not None:
+                partner['position'] = partner_position
+            partner.update(count=count, lift=lift, pmi=pmi)
+            partners.append(partner)
+        return partners
@@ -0,0 +1,170 @@
+# db_pool.py
+import atexit
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolError(psycopg2.Error):
+    """连接池错误（已关闭或等待超时）"""
+
+
+class TarotConnectionPool:
+    """线程安全的PostgreSQL连接池
+
+    每次调用单独借出一个连接，用完归还。空闲超过 health_check_interval 秒的连接
+    在借出前会先用 SELECT 1 检查，失效的连接直接丢弃并重新建立。
+    连接数达到 maxconn 时借出方会等待，而不是直接报错。
+    """
+
+    def __init__(self, connection_params, minconn=1, maxconn=10,
+                 health_check_interval=30, timeout=10):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"连接池大小配置无效: minconn={minconn}, maxconn={maxconn}")
+
+        self.connection_params = dict(connection_params)
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self.closed = False
+
+        self._idle = []   # [(conn, 归还时间)]，后进先出，保证热连接优先被复用
+        self._size = 0    # 已建立（空闲 + 借出）的连接数
+        self._cond = threading.Condition()
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        """建立一个新连接"""
+        return psycopg2.connect(client_encoding='UTF8', **self.connection_params)
+
+    def _is_healthy(self, conn, idle_since):
+        """检查空闲连接是否仍然可用"""
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        """关闭连接并释放一个名额"""
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def getconn(self):
+        """借出一个连接，池满时最多等待 timeout 秒"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                while True:
+                    if self.closed:
+                        raise PoolError("连接池已关闭")
+                    if self._idle:
+                        conn, idle_since = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        conn, idle_since = None, None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolError(f"连接池已耗尽（{self.maxconn} 个连接均在使用中）")
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._is_healthy(conn, idle_since):
+                return conn
+            print("⚠️ 丢弃失效的数据库连接")
+            self._discard(conn)
+
+    def putconn(self, conn, close=False):
+        """归还连接；close=True 或连接状态异常时直接关闭"""
+        if not close and not conn.closed:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                # 调用方遗留了未结束的事务
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+
+        if close or conn.closed or self.closed:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """关闭所有空闲连接；借出中的连接在归还时关闭"""
+        with self._cond:
+            self.closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        """连接池状态"""
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'maxconn': self.maxconn,
+            }
+
+
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+
+def get_shared_pool(connection_params, minconn=1, maxconn=10):
+    """获取进程内共享的连接池，相同连接参数只会建立一个池"""
+    key = tuple(sorted((k, str(v)) for k, v in connection_params.items()))
+    with _shared_pools_lock:
+        pool = _shared_pools.get(key)
+        if pool is None or pool.closed:
+            pool = TarotConnectionPool(connection_params, minconn, maxconn)
+            _shared_pools[key] = pool
+        return pool
+
+
+def close_shared_pools():
+    """关闭所有共享连接池"""
+    with _shared_pools_lock:
+        pools = list(_shared_pools.values())
+        _shared_pools.clear()
+    for pool in pools:
+        if not pool.closed:
+            pool.closeall()
+
+
+atexit.register(close_shared_pools)
@@ -0,0 +1,355 @@
+# diary_import.py
+"""Markdown 占卜日记批量导入
+
+读取 "My Tarot Diary.md" 这样的日记（以及 export.py 导出的 Markdown）：
+
+    #### 2025.09.04
+    问题：明天早上会不会在八点之前醒来
+    牌面：逆位宝剑一、17 The Star（未来）
+    牌意解读：……
+
+文件按行流式读取，以日期标题切分为条目；解析在进程池中并行进行，主进程按原顺序
+收集结果，攒满一批后交给存储后端的 import_readings 写入（PostgreSQL 为 COPY）。
+每个条目的结果（已导入、已存在、失败及原因、无法识别的牌名等）记入 ImportReport。
+
+解析时容忍的写法：全角和半角冒号；"逆位宝剑一"、"逆 权杖四"、"宝剑一（逆位）"、
+"正位太阳" 等正逆位写法；中英文牌名和带编号的大阿尔卡那；"（过去）" 形式的牌位。
+牌意解读只有一张牌时作为该牌的解读；多张牌且按 "；" 分段后段数与牌数相同时逐张
+对应（即导出的格式），否则整段作为备注。
+
+每个条目按用户、内容和同内容条目的序号生成确定的 client_id，同一文件重复导入时
+已导入的条目会被跳过，中途失败后可以直接重新运行。
+
+    python diary_import.py "My Tarot Diary.md" --username alice --sqlite tarot.db
+"""
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+from datetime import datetime
+import hashlib
+import os
+import re
+import sys
+import time
+import uuid
+
+import tarot_cards
+
+# 条目日期标题，如 "#### 2025.09.04"、"### 2025-9-4"、"#### 2025年9月4日"
+HEADING_PATTERN = re.compile(r"^#{1,6}\s*(\d{4})\s*[.\-/年]\s*(\d{1,2})\s*[.\-/月]\s*(\d{1,2})\s*日?\s*$")
+FIELD_PATTERN = re.compile(r"^\s*(问题|牌面|牌意解读|解读|备注)\s*[:：]\s*(.*)$")
+CARD_SEPARATOR = re.compile(r"[、，,；;/|+]")
+POSITION_PATTERN = re.compile(r"^(.*?)\s*[（(]([^（）()]*)[）)]$")
+
+FIELDS = {'问题': 'question', '牌面': 'cards', '牌意解读': 'interpretation', '解读': 'interpretation',
+          '备注': 'notes'}
+
+# 按牌数推断牌阵
+SPREADS = {1: "一日一牌", 3: "三张牌展开", 10: "凯尔特十字"}
+
+# 条目状态
+IMPORTED = "imported"
+DUPLICATE = "duplicate"
+FAILED = "failed"
+
+# client_id 的命名空间
+CLIENT_ID_NAMESPACE = uuid.UUID("6c1f0a52-2f3d-4b8e-9d61-6b7d2f8e4a10")
+
+
+def iter_entries(lines):
+    """把日记逐行切分为条目 -> (标题所在行号, 条目文本)
+
+    条目从日期标题开始，到下一个标题为止；其他标题（如导出时的 "## 用户名"）只作为
+    分隔，标题之前和非日期标题之后的内容被忽略。
+    """
+    start = None
+    body = []
+    for line_no, line in enumerate(lines, 1):
+        stripped = line.strip()
+        if stripped.startswith("#"):
+            if start is not None:
+                yield start, "\n".join(body)
+            if HEADING_PATTERN.match(stripped):
+                start, body = line_no, [stripped]
+            else:
+                start, body = None, []
+        elif start is not None and stripped:
+            body.append(stripped)
+    if start is not None:
+        yield start, "\n".join(body)
+
+
+def parse_card(text):
+    """解析一张牌的写法 -> (牌面字典, 警告或 None)
+
+    牌名和正逆位由 tarot_cards.resolve_card 识别；末尾括号里不是正逆位标记时作为牌位。
+    """
+    name = text.strip()
+    position = None
+    card_id, reversed_ = tarot_cards.resolve_card(name)
+    match = POSITION_PATTERN.match(name)
+    if card_id is None and match:
+        name = match.group(1)
+        position = match.group(2).strip() or None
+        card_id, reversed_ = tarot_cards.resolve_card(name)
+
+    card = {'position': position, 'reversed': reversed_}
+    if card_id is None:
+        card['name'] = name
+        return card, f"无法识别的牌名: {text.strip()}"
+    card['card_id'] = card_id
+    return card, None
+
+
+def parse_entry(text):
+    """解析一个条目 -> (记录字典, 消息列表)；无法导入时记录为 None
+
+    记录不含 user_id 和 client_id，由调用方补上。
+    """
+    lines = text.split("\n")
+    heading = HEADING_PATTERN.match(lines[0])
+    try:
+        reading_date = datetime(*(int(heading.group(index)) for index in (1, 2, 3)))
+    except ValueError:
+        return None, [f"日期无效: {lines[0]}"]
+
+    values = {}
+    field = None
+    for line in lines[1:]:
+        match = FIELD_PATTERN.match(line)
+        if match:
+            field = FIELDS[match.group(1)]
+            values[field] = match.group(2).strip()
+        elif field is not None:
+            # 多行内容接在上一个字段后面
+            values[field] = f"{values[field]}\n{line}" if values[field] else line
+        else:
+            return None, [f"无法识别的行: {line}"]
+
+    messages = []
+    cards = []
+    for token in CARD_SEPARATOR.split(values.get('cards', "")):
+        if token.strip():
+            card, warning = parse_card(token)
+            cards.append(card)
+            if warning:
+                messages.append(warning)
+    if not cards:
+        return None, ["缺少牌面"]
+
+    notes = values.get('notes') or None
+    interpretation = values.get('interpretation', "")
+    parts = [part.strip() for part in interpretation.split("；")]
+    if len(cards) == 1:
+        cards[0]['interpretation'] = interpretation
+    elif len(parts) == len(cards):
+        for card, part in zip(cards, parts):
+            card['interpretation'] = part
+    elif interpretation:
+        notes = f"{interpretation}\n{notes}" if notes else interpretation
+
+    reading = {
+        'spread_type': SPREADS.get(len(cards), f"{len(cards)}张牌展开"),
+        'question': values.get('question') or None,
+        'reading_date': reading_date,
+        'cards': cards,
+        'notes': notes,
+    }
+    return reading, messages
+
+
+def parse_chunk(entries):
+    """解析一组条目（进程池的工作函数）-> [(行号, 日期标题, 内容摘要, 记录, 消息)]"""
+    results = []
+    for line_no, text in entries:
+        reading, messages = parse_entry(text)
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        results.append((line_no, text.split("\n", 1)[0].lstrip("#").strip(), digest, reading, messages))
+    return results
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_chunks(chunks, workers=None):
+    """按顺序逐组产出 parse_chunk 的结果
+
+    workers 为 None 时取 CPU 核数；只有一组或 workers <= 1 时在本进程解析。
+    进程池中同时在途的组数有上限，文件再大内存占用也不变。
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return
+    second = next(chunks, None)
+    if second is None or workers <= 1:
+        yield parse_chunk(first)
+        if second is not None:
+            yield parse_chunk(second)
+            for chunk in chunks:
+                yield parse_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque([executor.submit(parse_chunk, first), executor.submit(parse_chunk, second)])
+        for chunk in chunks:
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+            pending.append(executor.submit(parse_chunk, chunk))
+        while pending:
+            yield pending.popleft().result()
+
+
+class EntryResult:
+    """单个条目的导入结果"""
+
+    __slots__ = ('line', 'date', 'status', 'reading_id', 'messages')
+
+    def __init__(self, line, date, status=None, reading_id=None, messages=()):
+        self.line = line
+        self.date = date
+        self.status = status
+        self.reading_id = reading_id
+        self.messages = list(messages)
+
+    def __repr__(self):
+        return f"EntryResult(line={self.line}, {self.date}, {self.status})"
+
+
+class ImportReport:
+    """一次导入的逐条目结果"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self.seconds = 0.0
+
+    def count(self, status):
+        return sum(1 for entry in self.entries if entry.status == status)
+
+    @property
+    def problems(self):
+        """失败或带警告的条目"""
+        return [entry for entry in self.entries if entry.status == FAILED or entry.messages]
+
+    def summary(self):
+        return (f"{len(self.entries)} 个条目：导入 {self.count(IMPORTED)}，已存在 {self.count(DUPLICATE)}，"
+                f"失败 {self.count(FAILED)}，用时 {self.seconds:.2f} 秒")
+
+    def write_csv(self, path):
+        """把每个条目的结果写成 CSV（带 BOM）"""
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['line', 'date', 'status', 'reading_id', 'messages'])
+            for entry in self.entries:
+                writer.writerow([entry.line, entry.date, entry.status, entry.reading_id,
+                                 "；".join(entry.messages)])
+
+
+def _load(backend, readings, results):
+    """写入一批记录并更新对应条目的结果；整批失败时逐条重试以找出出错的条目"""
+    reading_ids = backend.import_readings(readings)
+    if reading_ids is None:
+        reading_ids = []
+        for reading, result in zip(readings, results):
+            single = backend.import_readings([reading]) if len(readings) > 1 else None
+            if single is None:
+                error = getattr(getattr(backend, 'query_stats', None), 'last_error', None)
+                result.messages.append(f"写入失败: {error}" if error else "写入失败")
+                reading_ids.append(False)
+            else:
+                reading_ids.extend(single)
+
+    for reading_id, result in zip(reading_ids, results):
+        if reading_id is False:
+            result.status = FAILED
+        elif reading_id is None:
+            result.status = DUPLICATE
+        else:
+            result.status = IMPORTED
+            result.reading_id = reading_id
+
+
+def import_diary(backend, path, user_id, workers=None, chunk_size=1000, batch_size=5000):
+    """把 Markdown 日记导入到 user_id 名下，返回 ImportReport"""
+    report = ImportReport(path)
+    start = time.perf_counter()
+    occurrences = {}
+    readings = []
+    results = []
+    with open(path, encoding='utf-8-sig') as f:
+        for parsed in parse_chunks(_chunked(iter_entries(f), chunk_size), workers):
+            for line_no, date, digest, reading, messages in parsed:
+                result = EntryResult(line_no, date, messages=messages)
+                report.entries.append(result)
+                if reading is None:
+                    result.status = FAILED
+                    continue
+                # 同一内容的第几次出现，使重复导入时得到同样的 client_id
+                occurrence = occurrences.get(digest, 0)
+                occurrences[digest] = occurrence + 1
+                reading['user_id'] = user_id
+                reading['client_id'] = str(uuid.uuid5(CLIENT_ID_NAMESPACE, f"{user_id}:{digest}:{occurrence}"))
+                readings.append(reading)
+                results.append(result)
+                if len(readings) >= batch_size:
+                    _load(backend, readings, results)
+                    readings, results = [], []
+    if readings:
+        _load(backend, readings, results)
+
+    report.seconds = time.perf_counter() - start
+    if report.count(FAILED):
+        print(f"⚠️ 日记导入完成，部分条目失败: {report.summary()}")
+    else:
+        print(f"✅ 日记导入完成: {report.summary()}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把 Markdown 占卜日记导入数据库")
+    parser.add_argument("path")
+    parser.add_argument("--username", required=True, help="导入到哪个用户名下")
+    parser.add_argument("--sqlite", help="SQLite 数据库文件（不指定时连接 PostgreSQL）")
+    parser.add_argument("--dbname", default="tarot_diary")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--workers", type=int, help="解析进程数（默认 CPU 核数）")
+    parser.add_argument("--report", help="逐条目结果写入的 CSV 文件")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        from Tarot_SQLite import TarotSQLiteManager
+        db = TarotSQLiteManager(args.sqlite)
+    else:
+        from Tarot_PostgreSQL import TarotPostgreSQLManager
+        db = TarotPostgreSQLManager(args.dbname, args.user, args.password, args.host, args.port)
+    if not db.connect() or not db.initialize_database():
+        sys.exit(1)
+    user = db.run_statement('user_by_name', (args.username,))
+    if not user:
+        print(f"❌ 用户不存在: {args.username}")
+        sys.exit(1)
+
+    report = import_diary(db, args.path, user[0]['id'], workers=args.workers)
+    for entry in report.problems:
+        print(f"  第 {entry.line} 行 {entry.date} [{entry.status}] {'；'.join(entry.messages)}")
+    if args.report:
+        report.write_csv(args.report)
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
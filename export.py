@@ -0,0 +1,232 @@
+# export.py
+"""占卜日记导出：JSON Lines、CSV、Markdown、Parquet
+
+记录由存储后端的 export_readings 按用户、时间顺序逐条推送（PostgreSQL 使用
+COPY ... TO STDOUT，SQLite 按批读取游标），每条到达后立即写入各个输出文件，
+内存中只保留当前记录（Parquet 另有一个行组的缓冲）。一次扫描可以同时写出多种格式：
+
+    export_diary(db_manager, {"diary.md": "md", "diary.parquet": "parquet"})
+
+CSV 和 Parquet 为一行一张牌的扁平表（没有牌面的记录占一行，牌面列为空），便于
+表格软件和分析工具直接使用；JSON Lines 为一行一条记录，牌面嵌套在 cards 中；
+Markdown 与 "My Tarot Diary.md" 的格式相同。
+"""
+import csv
+import json
+from datetime import datetime
+from pathlib import Path
+import time
+
+import tarot_cards
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # 只在导出 Parquet 时需要
+    pyarrow = None
+
+# 输出文件的写缓冲
+BUFFER_BYTES = 1 << 20
+
+# 扁平表的列：记录字段 + 牌面字段
+FLAT_COLUMNS = [
+    'reading_id', 'user_id', 'username', 'reading_date', 'spread_type', 'question', 'notes',
+    'card_index', 'card_id', 'card_name', 'card_name_en', 'position', 'reversed', 'interpretation',
+]
+
+
+def flat_rows(reading):
+    """一条记录 -> 扁平表的行（每张牌一行）"""
+    head = (
+        reading['id'], reading['user_id'], reading.get('username'), reading['reading_date'],
+        reading['spread_type'], reading.get('question'), reading.get('notes'),
+    )
+    cards = reading.get('cards') or []
+    if not cards:
+        yield head + (None,) * 7
+        return
+    for index, card in enumerate(cards, 1):
+        yield head + (
+            index, card.get('card_id'), card.get('name'), card.get('name_en'),
+            card.get('position'), card.get('reversed', False), card.get('interpretation'),
+        )
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+class JsonLinesWriter:
+    """每行一条记录的 JSON"""
+
+    def __init__(self, path, multi_user=False):
+        self._file = open(path, 'w', encoding='utf-8', buffering=BUFFER_BYTES)
+
+    def write(self, reading):
+        self._file.write(json.dumps(reading, ensure_ascii=False, default=_json_default))
+        self._file.write("\n")
+
+    def close(self):
+        self._file.close()
+
+
+class CsvWriter:
+    """一行一张牌的 CSV（带 BOM，Excel 可直接识别中文）"""
+
+    def __init__(self, path, multi_user=False):
+        self._file = open(path, 'w', encoding='utf-8-sig', newline='', buffering=BUFFER_BYTES)
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(FLAT_COLUMNS)
+
+    def write(self, reading):
+        self._writer.writerows(flat_rows(reading))
+
+    def close(self):
+        self._file.close()
+
+
+def _one_line(text):
+    return " ".join((text or "").split())
+
+
+class MarkdownWriter:
+    """与 My Tarot Diary.md 相同的格式：
+
+        #### 2025.09.04
+        问题：……
+        牌面：……
+        牌意解读：……
+
+    牌意解读取各张牌的解读（以"；"连接），没有时取备注。导出多个用户时每个用户
+    以二级标题开始一节。
+    """
+
+    def __init__(self, path, multi_user=False):
+        self._file = open(path, 'w', encoding='utf-8', buffering=BUFFER_BYTES)
+        self.multi_user = multi_user
+        self._user_id = None
+
+    def write(self, reading):
+        if self.multi_user and reading['user_id'] != self._user_id:
+            self._user_id = reading['user_id']
+            self._file.write(f"## {reading.get('username') or reading['user_id']}\n\n")
+
+        cards = reading.get('cards') or []
+        interpretation = "；".join(
+            card['interpretation'].strip() for card in cards if (card.get('interpretation') or "").strip()
+        ) or (reading.get('notes') or "").strip()
+        labels = "、".join(
+            tarot_cards.card_label(card['name'], card.get('reversed'), card.get('position')) for card in cards
+        )
+        self._file.write(
+            f"#### {reading['reading_date']:%Y.%m.%d}\n"
+            f"问题：{_one_line(reading.get('question'))}\n"
+            f"牌面：{labels}\n"
+            f"牌意解读：{interpretation}\n\n"
+        )
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """一行一张牌的 Parquet（需要 pyarrow），每 row_group_size 行写出一个行组"""
+
+    def __init__(self, path, multi_user=False, row_group_size=65536):
+        if pyarrow is None:
+            raise RuntimeError("导出 Parquet 需要安装 pyarrow")
+        self.schema = pyarrow.schema([
+            ('reading_id', pyarrow.int64()),
+            ('user_id', pyarrow.int32()),
+            ('username', pyarrow.string()),
+            ('reading_date', pyarrow.timestamp('us')),
+            ('spread_type', pyarrow.string()),
+            ('question', pyarrow.string()),
+            ('notes', pyarrow.string()),
+            ('card_index', pyarrow.int16()),
+            ('card_id', pyarrow.int16()),
+            ('card_name', pyarrow.string()),
+            ('card_name_en', pyarrow.string()),
+            ('position', pyarrow.string()),
+            ('reversed', pyarrow.bool_()),
+            ('interpretation', pyarrow.string()),
+        ])
+        self.row_group_size = row_group_size
+        self._writer = pyarrow.parquet.ParquetWriter(str(path), self.schema, compression='zstd')
+        self._columns = [[] for _ in FLAT_COLUMNS]
+        self._rows = 0
+
+    def write(self, reading):
+        for row in flat_rows(reading):
+            for column, value in zip(self._columns, row):
+                column.append(value)
+            self._rows += 1
+        if self._rows >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        self._writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(column, type=field.type) for column, field in zip(self._columns, self.schema)],
+            schema=self.schema
+        ))
+        self._columns = [[] for _ in FLAT_COLUMNS]
+        self._rows = 0
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+WRITERS = {
+    'jsonl': JsonLinesWriter,
+    'csv': CsvWriter,
+    'md': MarkdownWriter,
+    'parquet': ParquetWriter,
+}
+
+_SUFFIXES = {'.jsonl': 'jsonl', '.json': 'jsonl', '.csv': 'csv', '.md': 'md', '.parquet': 'parquet'}
+
+
+def format_for(path):
+    """按扩展名判断导出格式"""
+    suffix = Path(path).suffix.lower()
+    if suffix not in _SUFFIXES:
+        raise ValueError(f"无法从扩展名判断导出格式: {path}")
+    return _SUFFIXES[suffix]
+
+
+def export_diary(backend, targets, user_id=None):
+    """一次扫描把占卜记录写入一个或多个文件
+
+    targets 为 {路径: 格式} 或路径列表（按扩展名判断格式）；user_id 为 None 时导出
+    全部用户。返回 {'readings': 条数, 'cards': 牌数, 'seconds': 耗时}。
+    """
+    if not isinstance(targets, dict):
+        targets = {path: format_for(path) for path in targets}
+
+    writers = []
+    try:
+        for path, format_name in targets.items():
+            writers.append(WRITERS[format_name](path, multi_user=user_id is None))
+
+        stats = {'readings': 0, 'cards': 0}
+
+        def on_reading(reading):
+            stats['readings'] += 1
+            stats['cards'] += len(reading.get('cards') or [])
+            for writer in writers:
+                writer.write(reading)
+
+        start = time.perf_counter()
+        backend.export_readings(on_reading, user_id)
+        stats['seconds'] = time.perf_counter() - start
+    finally:
+        for writer in writers:
+            writer.close()
+
+    print(f"✅ 导出完成: {stats['readings']} 条记录，{stats['cards']} 张牌，用时 {stats['seconds']:.2f} 秒")
+    return stats
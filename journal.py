@@ -0,0 +1,603 @@
+# journal.py
+"""离线预写日志
+
+PostgreSQL 不可达（或很慢）时，新的占卜记录先追加到本地日志文件并 fsync，写入
+不等待服务器；后台同步线程在数据库可用时按批重放。每条记录带客户端生成的 UUID
+（client_id），数据库按它去重，重试或重复重放都不会产生重复记录。
+
+文件格式：文件头 b"TJRN\\x01"，之后是连续的帧
+
+    负载长度（4 字节，大端） | 负载的 CRC32（4 字节，大端） | JSON 负载（UTF-8）
+
+负载的 "t" 字段为帧类型：add（新记录）、ack（已同步的 client_id）、reject（数据库
+拒绝写入的记录，保留在日志中不再重试）、user（最近一次在线登录的账号，用于离线登录）。
+user 帧含密码哈希，用配置文件的密钥（config_manager 的 encrypt/decrypt）加密后写入；
+没有给出加密器时账号只保存在内存中，不写入日志。
+打开时逐帧校验，遇到长度或校验和不对的帧（写入中途断电留下的残帧）即截断到上一帧
+结尾。打开日志时，以及已同步的记录累积到一定数量后，整体重写文件，只保留仍然
+有效的帧。
+"""
+from collections import OrderedDict
+from datetime import datetime
+from itertools import islice
+import json
+import os
+from pathlib import Path
+import random
+import struct
+import threading
+import uuid
+import zlib
+
+import password_hash
+import sessions
+
+MAGIC = b"TJRN\x01"
+FRAME_HEADER = struct.Struct(">II")
+# 单帧上限，超过即视为损坏（一条占卜记录远小于此）
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+
+
+def _encode_reading(reading):
+    data = dict(reading)
+    if isinstance(data.get('reading_date'), datetime):
+        data['reading_date'] = data['reading_date'].isoformat()
+    return data
+
+
+def _decode_reading(data):
+    reading = dict(data)
+    if reading.get('reading_date'):
+        reading['reading_date'] = datetime.fromisoformat(reading['reading_date'])
+    return reading
+
+
+def _frame(record):
+    payload = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class ReadingJournal:
+    """追加写的本地日志：未同步的新记录和离线登录信息
+
+    线程安全；append/append_many 返回前数据已写入磁盘。cipher 为带 encrypt/decrypt
+    （字符串进、字符串出，解密失败返回 None）的对象，用于加密离线登录的账号。
+    """
+
+    # 失效帧达到此数量时重写文件
+    COMPACT_FRAMES = 1000
+
+    def __init__(self, path, cipher=None):
+        self.path = Path(path)
+        self.cipher = cipher
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()   # client_id -> 记录
+        self._rejected = OrderedDict()  # client_id -> (记录, 原因)
+        self._users = {}                # 用户名 -> 账号信息（含密码哈希）
+        self._dead_frames = 0
+        self._file = None
+        self._open()
+
+    # ---- 文件读写 ----
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        data = self.path.read_bytes() if self.path.exists() else b""
+        valid_length = self._replay(data)
+        if valid_length == 0:
+            with open(self.path, 'wb') as f:
+                f.write(MAGIC)
+                f.flush()
+                os.fsync(f.fileno())
+        elif valid_length < len(data):
+            print(f"⚠️ 日志末尾有 {len(data) - valid_length} 字节不完整的数据，已截断")
+            os.truncate(self.path, valid_length)
+        self._file = open(self.path, 'ab')
+        if self._dead_frames:
+            # 上次运行留下的失效帧在打开时清掉
+            with self._lock:
+                self._compact()
+
+    def _replay(self, data):
+        """按顺序应用日志中的帧，返回有效数据的长度（0 表示需要新建文件）"""
+        if not data.startswith(MAGIC):
+            if MAGIC.startswith(data):
+                return 0
+            raise ValueError(f"无法识别的日志文件: {self.path}")
+
+        offset = len(MAGIC)
+        while offset + FRAME_HEADER.size <= len(data):
+            length, checksum = FRAME_HEADER.unpack_from(data, offset)
+            start = offset + FRAME_HEADER.size
+            payload = data[start:start + length]
+            if length > MAX_FRAME_BYTES or len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            try:
+                record = json.loads(payload)
+            except ValueError:
+                break
+            self._apply(record)
+            offset = start + length
+        return offset
+
+    def _apply(self, record):
+        kind = record['t']
+        if kind == 'add':
+            self._pending[record['id']] = _decode_reading(record['r'])
+        elif kind == 'ack':
+            for client_id in record['ids']:
+                if self._pending.pop(client_id, None) is not None:
+                    self._dead_frames += 1
+            self._dead_frames += 1
+        elif kind == 'reject':
+            reading = self._pending.pop(record['id'], None)
+            if reading is not None:
+                self._rejected[record['id']] = (reading, record['reason'])
+        elif kind == 'user':
+            user = self._decrypt_user(record)
+            if user is None:
+                # 无法解密（密钥已变化或没有加密器）：丢弃，下次重写时移除
+                self._dead_frames += 1
+                return
+            if user['username'] in self._users:
+                self._dead_frames += 1
+            self._users[user['username']] = user
+
+    def _encrypt_user(self, user):
+        """账号 -> user 帧，没有加密器时返回 None（不写入日志）"""
+        if self.cipher is None:
+            return None
+        return {'t': 'user', 'c': self.cipher.encrypt(json.dumps(user, ensure_ascii=False))}
+
+    def _decrypt_user(self, record):
+        if self.cipher is None:
+            return None
+        data = self.cipher.decrypt(record['c'])
+        try:
+            return json.loads(data) if data is not None else None
+        except ValueError:
+            return None
+
+    def _write(self, records):
+        """追加若干帧并刷到磁盘（调用方持有锁）"""
+        self._file.write(b"".join(_frame(record) for record in records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _compact(self):
+        """只保留有效帧重写日志：先写临时文件，再原子替换（调用方持有锁）"""
+        records = [frame for frame in map(self._encrypt_user, self._users.values()) if frame is not None]
+        for client_id, (reading, reason) in self._rejected.items():
+            records.append({'t': 'add', 'id': client_id, 'r': _encode_reading(reading)})
+            records.append({'t': 'reject', 'id': client_id, 'reason': reason})
+        records.extend(
+            {'t': 'add', 'id': client_id, 'r': _encode_reading(reading)}
+            for client_id, reading in self._pending.items()
+        )
+
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, 'wb') as f:
+            f.write(MAGIC + b"".join(_frame(record) for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(temp_path, self.path)
+        if hasattr(os, 'O_DIRECTORY'):
+            # 让目录项的替换也落盘
+            fd = os.open(self.path.parent, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self._file = open(self.path, 'ab')
+        self._dead_frames = 0
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # ---- 占卜记录 ----
+
+    def append(self, reading):
+        """写入一条新记录，返回其 client_id"""
+        return self.append_many([reading])[0]
+
+    def append_many(self, readings):
+        """写入多条新记录（一次 fsync），按输入顺序返回 client_id 列表
+
+        未给出 reading_date 的记录以写入日志的时间为准，而不是之后同步的时间。
+        """
+        entries = []
+        for reading in readings:
+            reading = dict(reading)
+            reading['client_id'] = reading.get('client_id') or str(uuid.uuid4())
+            if reading.get('reading_date') is None:
+                reading['reading_date'] = datetime.now()
+            entries.append(reading)
+
+        with self._lock:
+            self._write([
+                {'t': 'add', 'id': reading['client_id'], 'r': _encode_reading(reading)}
+                for reading in entries
+            ])
+            for reading in entries:
+                self._pending[reading['client_id']] = reading
+        return [reading['client_id'] for reading in entries]
+
+    def pending(self, limit=None):
+        """按写入顺序返回待同步的记录"""
+        with self._lock:
+            return [dict(reading) for reading in islice(self._pending.values(), limit)]
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def pending_reading(self, client_id):
+        """按 client_id 查找待同步的记录，不存在（已同步或未写入过）时返回 None"""
+        with self._lock:
+            reading = self._pending.get(client_id)
+            return dict(reading) if reading is not None else None
+
+    def pending_for_user(self, user_id):
+        """该用户待同步的记录，新的在前"""
+        with self._lock:
+            return [dict(reading) for reading in reversed(self._pending.values())
+                    if reading['user_id'] == user_id]
+
+    def acknowledge(self, client_ids):
+        """标记记录已写入数据库"""
+        with self._lock:
+            acked = [client_id for client_id in client_ids if client_id in self._pending]
+            if not acked:
+                return
+            self._write([{'t': 'ack', 'ids': acked}])
+            for client_id in acked:
+                del self._pending[client_id]
+            self._dead_frames += len(acked) + 1
+            # 每条记录的同步只追加一个 ack 帧，重写文件的代价由许多条记录分摊
+            if self._dead_frames >= self.COMPACT_FRAMES:
+                self._compact()
+
+    def reject(self, client_id, reason):
+        """数据库拒绝写入的记录：不再重试，但保留在日志中（见 rejected）"""
+        with self._lock:
+            reading = self._pending.pop(client_id, None)
+            if reading is None:
+                return
+            self._write([{'t': 'reject', 'id': client_id, 'reason': reason}])
+            self._rejected[client_id] = (reading, reason)
+
+    def rejected(self):
+        """被拒绝的记录，返回 [(记录, 原因)]"""
+        with self._lock:
+            return [(dict(reading), reason) for reading, reason in self._rejected.values()]
+
+    # ---- 离线登录 ----
+
+    def remember_user(self, user, stored_hash):
+        """记录在线登录成功的账号及其密码哈希，供数据库不可达时离线验证"""
+        entry = {
+            'id': user['id'],
+            'username': user['username'],
+            'email': user.get('email'),
+            'password_hash': stored_hash,
+        }
+        with self._lock:
+            if self._users.get(entry['username']) == entry:
+                return
+            frame = self._encrypt_user(entry)
+            if frame is not None:
+                if entry['username'] in self._users:
+                    self._dead_frames += 1
+                self._write([frame])
+            self._users[entry['username']] = entry
+
+    def verify_offline(self, username, password):
+        """用保存的密码哈希验证登录，成功返回用户字典"""
+        with self._lock:
+            entry = self._users.get(username)
+        if entry is None or not password_hash.verify_password(password, entry['password_hash']):
+            return None
+        return {'id': entry['id'], 'username': entry['username'], 'email': entry['email']}
+
+    def offline_user(self, user_id):
+        """按用户ID查找保存的账号"""
+        with self._lock:
+            for entry in self._users.values():
+                if entry['id'] == user_id:
+                    return {'id': entry['id'], 'username': entry['username'], 'email': entry['email']}
+        return None
+
+
+class JournalSyncer:
+    """后台同步线程：把日志中的记录按批写入数据库
+
+    没有待同步记录且在线时休眠，写入新记录后由 wake() 唤醒；数据库不可用时按指数
+    退避（带随机抖动）重试，期间尝试重新连接，没有待同步记录时也一样。整批被拒绝而数据库仍可访问时逐条重试，
+    仍失败的记录移入 rejected，不会阻塞后续记录。
+    """
+
+    def __init__(self, journal, backend, interval=2.0, max_backoff=300.0, batch_size=200):
+        self.journal = journal
+        self.backend = backend
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.batch_size = batch_size
+        # None 表示尚未尝试过
+        self.online = None
+        self.synced = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="tarot-journal-sync", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """有新记录写入时调用"""
+        self._wake.set()
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._stop.clear()
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            if self.journal.pending_count() == 0:
+                if self.online is not False:
+                    self._wake.wait()
+                    self._wake.clear()
+                    continue
+                # 离线且没有待同步记录时同样按退避间隔探测，恢复后退出离线模式
+                succeeded = self.probe()
+            else:
+                succeeded = self.sync_once() is not None
+            if not succeeded:
+                failures += 1
+                delay = min(self.max_backoff, self.interval * 2 ** min(failures, 16))
+                self._wake.wait(delay * random.uniform(0.5, 1.0))
+                self._wake.clear()
+            else:
+                failures = 0
+
+    def _ensure_connected(self):
+        if self.backend.is_connected():
+            return True
+        # 重新连接后先补齐结构迁移（离线期间可能从未初始化过）
+        if self.backend.connect() and self.backend.initialize_database():
+            return True
+        self.online = False
+        return False
+
+    def reachable(self):
+        """数据库是否可以执行查询"""
+        return self.backend.execute_query("SELECT 1", fetch=True) is not None
+
+    def probe(self):
+        """尝试重新连接数据库并更新 online，可用时返回 True"""
+        self.online = self._ensure_connected() and self.reachable()
+        return self.online
+
+    def sync_once(self):
+        """同步一批记录，返回处理的条数；数据库不可用时返回 None"""
+        batch = self.journal.pending(self.batch_size)
+        if not batch:
+            return 0
+        if not self._ensure_connected():
+            return None
+
+        synced = len(batch)
+        if self.backend.add_tarot_readings_bulk(batch) is None:
+            if not self.reachable():
+                self.online = False
+                return None
+            # 数据库可用但整批失败：逐条写入，找出被拒绝的记录
+            for reading in batch:
+                if self.backend.add_tarot_readings_bulk([reading]) is not None:
+                    self.journal.acknowledge([reading['client_id']])
+                elif self.reachable():
+                    synced -= 1
+                    self.journal.reject(reading['client_id'], "数据库拒绝写入")
+                    print(f"❌ 离线记录 {reading['client_id']} 无法写入数据库，已保留在日志中")
+                else:
+                    self.online = False
+                    return None
+        else:
+            self.journal.acknowledge([reading['client_id'] for reading in batch])
+
+        self.online = True
+        self.synced += synced
+        print(f"✅ 已同步 {synced} 条离线占卜记录")
+        return len(batch)
+
+
+class JournaledBackend:
+    """存储后端外层的离线日志
+
+    新记录先写入本地日志，由后台线程同步，写入不等待数据库。数据库不可达时
+    connect() 仍然成功（离线模式）：最近在线登录过的账号可以离线登录，历史记录中
+    带有尚未同步的记录（id 为 None，以 client_id 区分）。其余方法原样转发给后端。
+
+    因此 add_tarot_reading 返回的是 client_id（str）而不是数据库中的记录ID，
+    get_reading_by_id 和 delete_reading 两种都接受；批量写入日志用 enqueue_readings，
+    add_tarot_readings_bulk 仍按后端的约定直接写入数据库并返回记录ID。
+    """
+
+    def __init__(self, backend, journal_path, sync_interval=2.0, batch_size=200, cipher=None):
+        self.backend = backend
+        self.journal = ReadingJournal(journal_path, cipher)
+        self.syncer = JournalSyncer(self.journal, backend, sync_interval, batch_size=batch_size)
+        self._opened = False
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    @property
+    def online(self):
+        """数据库当前是否可用"""
+        return self.backend.is_connected() and self.syncer.online is not False
+
+    def connect(self):
+        """连接数据库；连接失败时进入离线模式，同样返回 True"""
+        if self.backend.connect():
+            self.syncer.online = True
+        else:
+            self.syncer.online = False
+            print("⚠️ 数据库不可达，进入离线模式：新记录先保存在本地，恢复后自动同步")
+        self._opened = True
+        self.syncer.start()
+        self.syncer.wake()
+        return True
+
+    def is_connected(self):
+        return self._opened
+
+    def initialize_database(self):
+        if not self.online:
+            return False
+        return self.backend.initialize_database()
+
+    def close(self):
+        """停止同步线程，尽量写完剩余记录后关闭日志和后端"""
+        self.syncer.stop()
+        while self.online and self.journal.pending_count():
+            if not self.syncer.sync_once():
+                break
+        self.journal.close()
+        self._opened = False
+        return self.backend.close()
+
+    # ---- 登录 ----
+
+    def verify_user(self, username, password):
+        """验证用户登录；数据库不可达时用最近一次在线登录保存的密码哈希验证"""
+        if self.online:
+            user = self.backend.verify_user(username, password)
+            if user is not None:
+                rows = self.backend.run_statement('user_by_name', (username,))
+                if rows:
+                    self.journal.remember_user(user, rows[0]['password_hash'])
+                return user
+            if self.syncer.reachable():
+                return None
+            self.syncer.online = False
+            self.syncer.wake()
+
+        user = self.journal.verify_offline(username, password)
+        if user is not None:
+            print(f"✅ 用户 '{username}' 离线验证成功")
+        return user
+
+    def restore_session(self, token):
+        """离线时无法校验令牌，返回 None（令牌保留，数据库恢复后仍可使用）"""
+        if not self.online:
+            return None
+        return self.backend.restore_session(token)
+
+    # ---- 写入 ----
+
+    def add_tarot_reading(self, user_id, spread_type, question, cards_data, notes=None):
+        """添加塔罗牌占卜记录，返回 client_id（数据库中的记录ID在同步后才分配，
+        可用 get_reading_by_id(client_id) 查到）"""
+        client_id = self.journal.append({
+            'user_id': user_id,
+            'spread_type': spread_type,
+            'question': question,
+            'cards': cards_data,
+            'notes': notes
+        })
+        self.syncer.wake()
+        print(f"✅ 占卜记录已保存，等待同步: {client_id}")
+        return client_id
+
+    def enqueue_readings(self, readings):
+        """批量写入日志，按输入顺序返回 client_id 列表（不等待数据库）"""
+        if not readings:
+            return []
+        client_ids = self.journal.append_many(readings)
+        self.syncer.wake()
+        return client_ids
+
+    def delete_reading(self, reading_id):
+        """删除占卜记录；reading_id 为 client_id 时尚未同步的记录直接从日志中移除"""
+        if not isinstance(reading_id, str):
+            return self.backend.delete_reading(reading_id)
+        if self.journal.pending_reading(reading_id) is not None:
+            # 已在日志中标记为完成，同步线程不会再写入
+            self.journal.acknowledge([reading_id])
+            print(f"✅ 待同步的占卜记录 {reading_id} 已删除")
+            # 标记之前同步线程可能已经写入了这一条
+            synced = self._synced_reading(reading_id)
+            return self.backend.delete_reading(synced['id']) if synced else True
+        synced = self._synced_reading(reading_id)
+        if synced is None:
+            print(f"❌ 占卜记录 {reading_id} 删除失败")
+            return False
+        return self.backend.delete_reading(synced['id'])
+
+    # ---- 读取（合并尚未同步的记录） ----
+
+    def _synced_reading(self, client_id):
+        """按 client_id 从数据库读取已同步的记录，离线或不存在时返回 None"""
+        if not self.online:
+            return None
+        result = self.backend.run_statement('reading_by_client_id', (client_id,))
+        return self.backend._decode_reading(result[0]) if result else None
+
+    def get_reading_by_id(self, reading_id):
+        """根据记录ID或 client_id 获取占卜记录；尚未同步的记录 id 为 None"""
+        if not isinstance(reading_id, str):
+            return self.backend.get_reading_by_id(reading_id)
+        reading = self.journal.pending_reading(reading_id)
+        if reading is not None:
+            return dict(reading, id=None)
+        return self._synced_reading(reading_id)
+
+    @staticmethod
+    def _merge_pending(pending, readings):
+        """把待同步记录按时间合并进查询结果（已同步的以数据库中的为准）
+
+        调用方应先取 pending 再查询数据库：期间同步完成的记录两边都有，按 client_id
+        去重；反过来则可能两边都没有。
+        """
+        if not pending:
+            return readings
+        synced = {reading.get('client_id') for reading in readings}
+        pending = [dict(reading, id=None) for reading in pending if reading['client_id'] not in synced]
+        return sorted(pending + readings, key=lambda reading: reading['reading_date'], reverse=True)
+
+    def get_user_readings(self, user_id, limit=None):
+        """获取用户的占卜记录（含待同步记录）"""
+        pending = self.journal.pending_for_user(user_id)
+        readings = self.backend.get_user_readings(user_id, limit) if self.online else []
+        readings = self._merge_pending(pending, readings)
+        return readings[:limit] if limit else readings
+
+    def get_user_readings_page(self, user_id, after=None, page_size=50):
+        """按键集分页获取占卜记录；待同步记录只出现在第一页"""
+        pending = self.journal.pending_for_user(user_id) if after is None else []
+        readings = self.backend.get_user_readings_page(user_id, after, page_size) if self.online else []
+        return self._merge_pending(pending, readings)
+
+    def load_session(self, user_id, page_size=20):
+        """读取会话数据；离线时只有用户和待同步记录"""
+        pending = self.journal.pending_for_user(user_id)
+        session = self.backend.load_session(user_id, page_size) if self.online else None
+        if session is None:
+            user = self.journal.offline_user(user_id)
+            if user is None:
+                return None
+            return sessions.UserSession(user, None, None, self._merge_pending(pending, []), page_size)
+        # 换成新列表，不修改缓存中的对象
+        session.recent_readings = self._merge_pending(pending, session.recent_readings)
+        return session
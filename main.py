@@ -35,19 +35,19 @@ def main():
         return 1
     
     try:
-        # 创建数据库管理器并连接
-        from Tarot_PostgreSQL import TarotPostgreSQLManager
-        db_manager = TarotPostgreSQLManager(
-            dbname=db_config['dbname'],
-            user=db_config['user'],
-            password=db_config['password'],
-            host=db_config['host'],
-            port=db_config['port']
-        )
+        # 按配置创建存储后端（PostgreSQL 连接池或本地 SQLite 文件）并连接；
+        # 前面加一层读缓存，重复浏览历史和设置不再访问数据库
+        from storage_backend import create_backend
+        from reading_cache import ReadingCache
+        db_manager = ReadingCache(create_backend(db_config))
+        if db_config.get('backend') != 'sqlite':
+            # 服务器不可达时新记录先写入本地日志，恢复后由后台线程同步
+            from journal import JournaledBackend
+            db_manager = JournaledBackend(db_manager, config_manager.journal_file, cipher=config_manager)
         
         if db_manager.connect():
-            # 显示主登录界面
-            checkin_window = CheckIn(db_config)
+            # 显示主登录界面（与主窗口共用同一个存储后端）
+            checkin_window = CheckIn(db_config, db_manager)
             checkin_window.show()
             
             return app.exec()
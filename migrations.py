@@ -0,0 +1,1490 @@
+# migrations.py
+"""数据库结构迁移
+
+所有建表/索引语句只在这里维护一份。每个迁移有一个递增的版本号，
+已执行的版本记录在 schema_version 表中；启动时只需一次版本查询，
+已是最新版本时不会执行任何 DDL。
+
+PostgreSQL 和 SQLite 各有一条迁移序列（MIGRATIONS / SQLITE_MIGRATIONS），
+两边的表和列保持一致，只是类型、检索和统计的实现方式不同。
+"""
+import sqlite3
+
+try:
+    import psycopg2
+    from psycopg2.extras import execute_values
+except ImportError:  # 只使用 SQLite 后端时可以不安装 psycopg2
+    psycopg2 = None
+    execute_values = None
+
+import tarot_cards
+
+
+class Migration:
+    """一个有序的结构迁移
+
+    statements 中的元素可以是 SQL 字符串，也可以是接收游标的函数（用于需要
+    Python 参与的数据迁移）。
+    """
+
+    def __init__(self, version, description, statements):
+        self.version = version
+        self.description = description
+        self.statements = statements
+
+
+def _seed_cards(cursor):
+    """写入标准 78 张牌"""
+    execute_values(
+        cursor,
+        """
+        INSERT INTO cards (id, name_zh, name_en, arcana, suit, number)
+        VALUES %s
+        ON CONFLICT (id) DO NOTHING
+        """,
+        tarot_cards.CARDS
+    )
+
+
+def _backfill_card_ids(cursor):
+    """把已有牌面的文本牌名解析为牌编号，无法识别的保留原文"""
+    cursor.execute("SELECT DISTINCT card_name, orientation FROM reading_cards")
+    mapping = []
+    for name, orientation in cursor.fetchall():
+        card_id, reversed_ = tarot_cards.resolve_card(name)
+        if card_id is not None:
+            mapping.append((name, orientation, card_id, reversed_ or orientation == 'reversed'))
+
+    execute_values(
+        cursor,
+        """
+        UPDATE reading_cards rc
+        SET card_id = m.card_id, reversed = m.reversed, card_name = NULL
+        FROM (VALUES %s) AS m (card_name, orientation, card_id, reversed)
+        WHERE rc.card_name = m.card_name
+          AND rc.orientation IS NOT DISTINCT FROM m.orientation
+        """,
+        mapping,
+        template="(%s::TEXT, %s::TEXT, %s::SMALLINT, %s::BOOLEAN)",
+        page_size=500
+    )
+
+
+MIGRATIONS = [
+    Migration(1, "基础表结构", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            email VARCHAR(100),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tarot_readings (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            spread_type VARCHAR(50) NOT NULL,
+            question TEXT,
+            reading_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            notes TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS reading_cards (
+            id SERIAL PRIMARY KEY,
+            reading_id INTEGER NOT NULL REFERENCES tarot_readings(id) ON DELETE CASCADE,
+            card_name VARCHAR(100) NOT NULL,
+            position VARCHAR(50),
+            orientation VARCHAR(10) DEFAULT 'upright',
+            interpretation TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+            language VARCHAR(10) DEFAULT 'zh_CN',
+            theme VARCHAR(20) DEFAULT 'light',
+            notification_enabled BOOLEAN DEFAULT TRUE
+        )
+        """,
+    ]),
+    Migration(2, "历史记录与牌面查询索引", [
+        # 读取某次占卜的牌面、级联删除都按 reading_id 查找
+        "CREATE INDEX IF NOT EXISTS idx_reading_cards_reading_id ON reading_cards (reading_id)",
+        # 按用户倒序浏览历史；带上 id 以便按 (reading_date, id) 翻页
+        """
+        CREATE INDEX IF NOT EXISTS idx_tarot_readings_user_date
+        ON tarot_readings (user_id, reading_date DESC, id DESC)
+        """,
+    ]),
+    Migration(3, "占卜记录全文检索", [
+        # 中文没有空格分词，统一切成单字+二元组，英文和数字按单词切分；
+        # 写入索引和解析查询都用同一个函数，保证两边切分一致
+        r"""
+        CREATE OR REPLACE FUNCTION tarot_ngram_text(input TEXT) RETURNS TEXT
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT string_agg(token, ' ')
+            FROM (
+                SELECT lower(word[1]) AS token
+                FROM regexp_matches(COALESCE(input, ''), '([A-Za-z0-9]+)', 'g') AS word
+                UNION ALL
+                SELECT substr(run[1], i, n)
+                FROM regexp_matches(COALESCE(input, ''), '([\u3400-\u9fff]+)', 'g') AS run,
+                     generate_series(1, char_length(run[1])) AS i,
+                     (VALUES (1), (2)) AS sizes(n)
+                WHERE i + n - 1 <= char_length(run[1])
+            ) tokens
+        $$
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS reading_search (
+            reading_id INTEGER PRIMARY KEY REFERENCES tarot_readings(id) ON DELETE CASCADE,
+            user_id INTEGER NOT NULL,
+            document TSVECTOR NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_reading_search_document ON reading_search USING GIN (document)",
+        # 问题权重最高，其次是牌名，再次是备注和牌意解读
+        """
+        CREATE OR REPLACE FUNCTION tarot_refresh_search(reading_ids INTEGER[]) RETURNS VOID
+        LANGUAGE sql AS $$
+            INSERT INTO reading_search (reading_id, user_id, document)
+            SELECT
+                tr.id,
+                tr.user_id,
+                setweight(to_tsvector('simple', COALESCE(tarot_ngram_text(tr.question), '')), 'A') ||
+                setweight(to_tsvector('simple', COALESCE(tarot_ngram_text(string_agg(rc.card_name, ' ')), '')), 'B') ||
+                setweight(to_tsvector('simple', COALESCE(tarot_ngram_text(
+                    COALESCE(tr.notes, '') || ' ' || COALESCE(string_agg(rc.interpretation, ' '), '')
+                ), '')), 'C')
+            FROM tarot_readings tr
+            LEFT JOIN reading_cards rc ON rc.reading_id = tr.id
+            WHERE tr.id = ANY(reading_ids)
+            GROUP BY tr.id
+            ON CONFLICT (reading_id) DO UPDATE
+            SET user_id = EXCLUDED.user_id, document = EXCLUDED.document
+        $$
+        """,
+        # 语句级触发器：批量写入时每条语句只按受影响的记录重建一次索引
+        """
+        CREATE OR REPLACE FUNCTION tarot_search_on_readings() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM tarot_refresh_search(ARRAY(SELECT id FROM changed_rows));
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE FUNCTION tarot_search_on_cards() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM tarot_refresh_search(ARRAY(SELECT DISTINCT reading_id FROM changed_rows));
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE TRIGGER trg_search_readings_insert AFTER INSERT ON tarot_readings
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_search_on_readings()
+        """,
+        """
+        CREATE TRIGGER trg_search_readings_update AFTER UPDATE ON tarot_readings
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_search_on_readings()
+        """,
+        """
+        CREATE TRIGGER trg_search_cards_insert AFTER INSERT ON reading_cards
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_search_on_cards()
+        """,
+        """
+        CREATE TRIGGER trg_search_cards_update AFTER UPDATE ON reading_cards
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_search_on_cards()
+        """,
+        """
+        CREATE TRIGGER trg_search_cards_delete AFTER DELETE ON reading_cards
+        REFERENCING OLD TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_search_on_cards()
+        """,
+        # 为已有记录建立索引
+        "SELECT tarot_refresh_search(ARRAY(SELECT id FROM tarot_readings))",
+    ]),
+    Migration(4, "用户统计投影表", [
+        # 每个用户一行，仪表盘和个人资料只需一次主键查询
+        """
+        CREATE TABLE IF NOT EXISTS user_reading_stats (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+            total_readings INTEGER NOT NULL DEFAULT 0,
+            last_reading TIMESTAMP,
+            spread_counts JSONB NOT NULL DEFAULT '{}',
+            card_counts JSONB NOT NULL DEFAULT '{}'
+        )
+        """,
+        # 按键累加计数，计数归零的键直接移除
+        """
+        CREATE OR REPLACE FUNCTION tarot_merge_counts(base JSONB, delta JSONB) RETURNS JSONB
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT COALESCE(jsonb_object_agg(key, total), '{}'::jsonb)
+            FROM (
+                SELECT key, SUM(value::INTEGER) AS total
+                FROM (
+                    SELECT * FROM jsonb_each_text(COALESCE(base, '{}'::jsonb))
+                    UNION ALL
+                    SELECT * FROM jsonb_each_text(COALESCE(delta, '{}'::jsonb))
+                ) entries
+                GROUP BY key
+                HAVING SUM(value::INTEGER) <> 0
+            ) merged
+        $$
+        """,
+        """
+        CREATE OR REPLACE FUNCTION tarot_stats_on_readings() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO user_reading_stats AS s (user_id, total_readings, last_reading, spread_counts)
+                SELECT user_id, SUM(n), MAX(last_date), jsonb_object_agg(spread_type, n)
+                FROM (
+                    SELECT user_id, spread_type, COUNT(*) AS n, MAX(reading_date) AS last_date
+                    FROM new_rows
+                    GROUP BY user_id, spread_type
+                ) grouped
+                GROUP BY user_id
+                ON CONFLICT (user_id) DO UPDATE SET
+                    total_readings = s.total_readings + EXCLUDED.total_readings,
+                    last_reading = GREATEST(s.last_reading, EXCLUDED.last_reading),
+                    spread_counts = tarot_merge_counts(s.spread_counts, EXCLUDED.spread_counts);
+            ELSIF TG_OP = 'DELETE' THEN
+                -- 删除后最近日期只能重新取，走 (user_id, reading_date) 索引只读一行
+                UPDATE user_reading_stats s SET
+                    total_readings = s.total_readings - d.n,
+                    spread_counts = tarot_merge_counts(s.spread_counts, d.delta),
+                    last_reading = (SELECT MAX(tr.reading_date) FROM tarot_readings tr WHERE tr.user_id = s.user_id)
+                FROM (
+                    SELECT user_id, SUM(n) AS n, jsonb_object_agg(spread_type, -n) AS delta
+                    FROM (
+                        SELECT user_id, spread_type, COUNT(*) AS n
+                        FROM old_rows
+                        GROUP BY user_id, spread_type
+                    ) grouped
+                    GROUP BY user_id
+                ) d
+                WHERE s.user_id = d.user_id;
+            ELSE
+                UPDATE user_reading_stats s SET
+                    spread_counts = tarot_merge_counts(s.spread_counts, d.delta),
+                    last_reading = (SELECT MAX(tr.reading_date) FROM tarot_readings tr WHERE tr.user_id = s.user_id)
+                FROM (
+                    SELECT user_id, jsonb_object_agg(spread_type, n) AS delta
+                    FROM (
+                        SELECT user_id, spread_type, SUM(n) AS n
+                        FROM (
+                            SELECT user_id, spread_type, 1 AS n FROM new_rows
+                            UNION ALL
+                            SELECT user_id, spread_type, -1 AS n FROM old_rows
+                        ) changes
+                        GROUP BY user_id, spread_type
+                    ) grouped
+                    GROUP BY user_id
+                ) d
+                WHERE s.user_id = d.user_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        """,
+        # 删除记录时牌面由外键级联删除，级联触发时记录已不存在，
+        # 所以在删除记录之前先扣减它的牌面计数
+        """
+        CREATE OR REPLACE FUNCTION tarot_stats_before_reading_delete() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE user_reading_stats s SET
+                card_counts = tarot_merge_counts(s.card_counts, (
+                    SELECT jsonb_object_agg(card_name, -n)
+                    FROM (
+                        SELECT card_name, COUNT(*) AS n
+                        FROM reading_cards
+                        WHERE reading_id = OLD.id
+                        GROUP BY card_name
+                    ) grouped
+                ))
+            WHERE s.user_id = OLD.user_id;
+            RETURN OLD;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE FUNCTION tarot_stats_on_cards() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO user_reading_stats AS s (user_id, card_counts)
+                SELECT user_id, jsonb_object_agg(card_name, n)
+                FROM (
+                    SELECT tr.user_id, c.card_name, COUNT(*) AS n
+                    FROM new_rows c
+                    JOIN tarot_readings tr ON tr.id = c.reading_id
+                    GROUP BY tr.user_id, c.card_name
+                ) grouped
+                GROUP BY user_id
+                ON CONFLICT (user_id) DO UPDATE SET
+                    card_counts = tarot_merge_counts(s.card_counts, EXCLUDED.card_counts);
+            ELSIF TG_OP = 'DELETE' THEN
+                -- 随记录级联删除的牌面在这里找不到所属记录，已在删除记录前扣减
+                UPDATE user_reading_stats s SET
+                    card_counts = tarot_merge_counts(s.card_counts, d.delta)
+                FROM (
+                    SELECT user_id, jsonb_object_agg(card_name, -n) AS delta
+                    FROM (
+                        SELECT tr.user_id, c.card_name, COUNT(*) AS n
+                        FROM old_rows c
+                        JOIN tarot_readings tr ON tr.id = c.reading_id
+                        GROUP BY tr.user_id, c.card_name
+                    ) grouped
+                    GROUP BY user_id
+                ) d
+                WHERE s.user_id = d.user_id;
+            ELSE
+                UPDATE user_reading_stats s SET
+                    card_counts = tarot_merge_counts(s.card_counts, d.delta)
+                FROM (
+                    SELECT user_id, jsonb_object_agg(card_name, n) AS delta
+                    FROM (
+                        SELECT tr.user_id, c.card_name, SUM(c.n) AS n
+                        FROM (
+                            SELECT reading_id, card_name, -1 AS n FROM old_rows
+                            UNION ALL
+                            SELECT reading_id, card_name, 1 AS n FROM new_rows
+                        ) c
+                        JOIN tarot_readings tr ON tr.id = c.reading_id
+                        GROUP BY tr.user_id, c.card_name
+                    ) grouped
+                    GROUP BY user_id
+                ) d
+                WHERE s.user_id = d.user_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE TRIGGER trg_stats_readings_insert AFTER INSERT ON tarot_readings
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_stats_on_readings()
+        """,
+        """
+        CREATE TRIGGER trg_stats_readings_update AFTER UPDATE ON tarot_readings
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_stats_on_readings()
+        """,
+        """
+        CREATE TRIGGER trg_stats_readings_delete AFTER DELETE ON tarot_readings
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_stats_on_readings()
+        """,
+        """
+        CREATE TRIGGER trg_stats_readings_before_delete BEFORE DELETE ON tarot_readings
+        FOR EACH ROW EXECUTE FUNCTION tarot_stats_before_reading_delete()
+        """,
+        """
+        CREATE TRIGGER trg_stats_cards_insert AFTER INSERT ON reading_cards
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_stats_on_cards()
+        """,
+        """
+        CREATE TRIGGER trg_stats_cards_update AFTER UPDATE ON reading_cards
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_stats_on_cards()
+        """,
+        """
+        CREATE TRIGGER trg_stats_cards_delete AFTER DELETE ON reading_cards
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_stats_on_cards()
+        """,
+        # 用已有数据初始化投影
+        """
+        INSERT INTO user_reading_stats (user_id, total_readings, last_reading, spread_counts, card_counts)
+        SELECT
+            u.id,
+            COALESCE(r.total, 0),
+            r.last_reading,
+            COALESCE(sp.counts, '{}'::jsonb),
+            COALESCE(cc.counts, '{}'::jsonb)
+        FROM users u
+        LEFT JOIN (
+            SELECT user_id, COUNT(*) AS total, MAX(reading_date) AS last_reading
+            FROM tarot_readings GROUP BY user_id
+        ) r ON r.user_id = u.id
+        LEFT JOIN (
+            SELECT user_id, jsonb_object_agg(spread_type, n) AS counts
+            FROM (SELECT user_id, spread_type, COUNT(*) AS n FROM tarot_readings GROUP BY 1, 2) g
+            GROUP BY user_id
+        ) sp ON sp.user_id = u.id
+        LEFT JOIN (
+            SELECT user_id, jsonb_object_agg(card_name, n) AS counts
+            FROM (
+                SELECT tr.user_id, rc.card_name, COUNT(*) AS n
+                FROM reading_cards rc JOIN tarot_readings tr ON tr.id = rc.reading_id
+                GROUP BY 1, 2
+            ) g
+            GROUP BY user_id
+        ) cc ON cc.user_id = u.id
+        ON CONFLICT (user_id) DO NOTHING
+        """,
+    ]),
+    Migration(5, "牌面维度表与整数牌编号", [
+        """
+        CREATE TABLE IF NOT EXISTS cards (
+            id SMALLINT PRIMARY KEY,
+            name_zh VARCHAR(20) NOT NULL UNIQUE,
+            name_en VARCHAR(40) NOT NULL UNIQUE,
+            arcana VARCHAR(5) NOT NULL,
+            suit VARCHAR(10),
+            number SMALLINT NOT NULL
+        )
+        """,
+        _seed_cards,
+        # card_name 只保留给无法识别的自定义牌名，标准牌只存编号
+        """
+        ALTER TABLE reading_cards
+            ADD COLUMN IF NOT EXISTS card_id SMALLINT REFERENCES cards(id),
+            ADD COLUMN IF NOT EXISTS reversed BOOLEAN NOT NULL DEFAULT FALSE,
+            ALTER COLUMN card_name DROP NOT NULL
+        """,
+        # 回填期间关闭检索和统计触发器，回填后统一重建
+        "ALTER TABLE reading_cards DISABLE TRIGGER USER",
+        "UPDATE reading_cards SET reversed = orientation IN ('reversed', '逆位')",
+        _backfill_card_ids,
+        "ALTER TABLE reading_cards DROP COLUMN IF EXISTS orientation",
+        "ALTER TABLE reading_cards ENABLE TRIGGER USER",
+        """
+        CREATE OR REPLACE FUNCTION tarot_refresh_search(reading_ids INTEGER[]) RETURNS VOID
+        LANGUAGE sql AS $$
+            INSERT INTO reading_search (reading_id, user_id, document)
+            SELECT
+                tr.id,
+                tr.user_id,
+                setweight(to_tsvector('simple', COALESCE(tarot_ngram_text(tr.question), '')), 'A') ||
+                setweight(to_tsvector('simple', COALESCE(tarot_ngram_text(
+                    string_agg(COALESCE(c.name_zh || ' ' || c.name_en, rc.card_name), ' ')
+                ), '')), 'B') ||
+                setweight(to_tsvector('simple', COALESCE(tarot_ngram_text(
+                    COALESCE(tr.notes, '') || ' ' || COALESCE(string_agg(rc.interpretation, ' '), '')
+                ), '')), 'C')
+            FROM tarot_readings tr
+            LEFT JOIN reading_cards rc ON rc.reading_id = tr.id
+            LEFT JOIN cards c ON c.id = rc.card_id
+            WHERE tr.id = ANY(reading_ids)
+            GROUP BY tr.id
+            ON CONFLICT (reading_id) DO UPDATE
+            SET user_id = EXCLUDED.user_id, document = EXCLUDED.document
+        $$
+        """,
+        # 牌面计数改为按牌编号统计，自定义牌名不计入
+        """
+        CREATE OR REPLACE FUNCTION tarot_stats_before_reading_delete() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE user_reading_stats s SET
+                card_counts = tarot_merge_counts(s.card_counts, (
+                    SELECT jsonb_object_agg(card_id, -n)
+                    FROM (
+                        SELECT card_id, COUNT(*) AS n
+                        FROM reading_cards
+                        WHERE reading_id = OLD.id AND card_id IS NOT NULL
+                        GROUP BY card_id
+                    ) grouped
+                ))
+            WHERE s.user_id = OLD.user_id;
+            RETURN OLD;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE FUNCTION tarot_stats_on_cards() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO user_reading_stats AS s (user_id, card_counts)
+                SELECT user_id, jsonb_object_agg(card_id, n)
+                FROM (
+                    SELECT tr.user_id, c.card_id, COUNT(*) AS n
+                    FROM new_rows c
+                    JOIN tarot_readings tr ON tr.id = c.reading_id
+                    WHERE c.card_id IS NOT NULL
+                    GROUP BY tr.user_id, c.card_id
+                ) grouped
+                GROUP BY user_id
+                ON CONFLICT (user_id) DO UPDATE SET
+                    card_counts = tarot_merge_counts(s.card_counts, EXCLUDED.card_counts);
+            ELSIF TG_OP = 'DELETE' THEN
+                -- 随记录级联删除的牌面在这里找不到所属记录，已在删除记录前扣减
+                UPDATE user_reading_stats s SET
+                    card_counts = tarot_merge_counts(s.card_counts, d.delta)
+                FROM (
+                    SELECT user_id, jsonb_object_agg(card_id, -n) AS delta
+                    FROM (
+                        SELECT tr.user_id, c.card_id, COUNT(*) AS n
+                        FROM old_rows c
+                        JOIN tarot_readings tr ON tr.id = c.reading_id
+                        WHERE c.card_id IS NOT NULL
+                        GROUP BY tr.user_id, c.card_id
+                    ) grouped
+                    GROUP BY user_id
+                ) d
+                WHERE s.user_id = d.user_id;
+            ELSE
+                UPDATE user_reading_stats s SET
+                    card_counts = tarot_merge_counts(s.card_counts, d.delta)
+                FROM (
+                    SELECT user_id, jsonb_object_agg(card_id, n) AS delta
+                    FROM (
+                        SELECT tr.user_id, c.card_id, SUM(c.n) AS n
+                        FROM (
+                            SELECT reading_id, card_id, -1 AS n FROM old_rows
+                            UNION ALL
+                            SELECT reading_id, card_id, 1 AS n FROM new_rows
+                        ) c
+                        JOIN tarot_readings tr ON tr.id = c.reading_id
+                        WHERE c.card_id IS NOT NULL
+                        GROUP BY tr.user_id, c.card_id
+                    ) grouped
+                    GROUP BY user_id
+                ) d
+                WHERE s.user_id = d.user_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        UPDATE user_reading_stats s
+        SET card_counts = COALESCE((
+            SELECT jsonb_object_agg(card_id, n)
+            FROM (
+                SELECT rc.card_id, COUNT(*) AS n
+                FROM reading_cards rc
+                JOIN tarot_readings tr ON tr.id = rc.reading_id
+                WHERE tr.user_id = s.user_id AND rc.card_id IS NOT NULL
+                GROUP BY rc.card_id
+            ) grouped
+        ), '{}'::jsonb)
+        """,
+        "SELECT tarot_refresh_search(ARRAY(SELECT id FROM tarot_readings))",
+    ]),
+    # “记住我”令牌：selector 为主键，恢复登录只需一次主键查找；
+    # verifier 为令牌另一半的 HMAC，数据库泄露也无法还原令牌
+    Migration(6, "登录会话表", [
+        """
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            selector CHAR(16) PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            verifier CHAR(64) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_user_sessions_expires_at ON user_sessions (expires_at)",
+    ]),
+    # 离线日志中的记录带客户端生成的 UUID，同步重试时按它去重
+    Migration(7, "占卜记录客户端ID", [
+        "ALTER TABLE tarot_readings ADD COLUMN IF NOT EXISTS client_id UUID",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_tarot_readings_client_id ON tarot_readings (client_id)",
+    ]),
+    # 变更通知：每条语句按用户发出 "操作|用户ID|记录ID,..." 形式的 NOTIFY（见 change_feed.py），
+    # 每条最多 500 个ID，保证不超过 NOTIFY 的 8000 字节上限
+    Migration(8, "占卜记录变更通知", [
+        """
+        CREATE OR REPLACE FUNCTION tarot_notify_changes(op TEXT, user_ids INTEGER[], reading_ids INTEGER[])
+        RETURNS VOID
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM pg_notify(
+                'tarot_changes',
+                op || '|' || user_id || '|' || string_agg(reading_id::text, ',' ORDER BY reading_id)
+            )
+            FROM (
+                SELECT
+                    user_id,
+                    reading_id,
+                    (row_number() OVER (PARTITION BY user_id ORDER BY reading_id) - 1) / 500 AS chunk
+                FROM unnest(user_ids, reading_ids) AS changed(user_id, reading_id)
+            ) numbered
+            GROUP BY user_id, chunk;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE FUNCTION tarot_notify_on_readings() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM tarot_notify_changes(
+                    'd',
+                    ARRAY(SELECT user_id FROM old_rows ORDER BY id),
+                    ARRAY(SELECT id FROM old_rows ORDER BY id)
+                );
+            ELSE
+                PERFORM tarot_notify_changes(
+                    CASE TG_OP WHEN 'INSERT' THEN 'i' ELSE 'u' END,
+                    ARRAY(SELECT user_id FROM new_rows ORDER BY id),
+                    ARRAY(SELECT id FROM new_rows ORDER BY id)
+                );
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        """,
+        # 牌面的变化通知为所属记录的更新；随记录级联删除的牌面找不到记录，不再重复通知
+        """
+        CREATE OR REPLACE FUNCTION tarot_notify_on_cards() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            changed INTEGER[];
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                changed := ARRAY(SELECT DISTINCT reading_id FROM new_rows);
+            ELSIF TG_OP = 'DELETE' THEN
+                changed := ARRAY(SELECT DISTINCT reading_id FROM old_rows);
+            ELSE
+                changed := ARRAY(SELECT reading_id FROM new_rows UNION SELECT reading_id FROM old_rows);
+            END IF;
+            PERFORM tarot_notify_changes(
+                'u',
+                ARRAY(SELECT user_id FROM tarot_readings WHERE id = ANY(changed) ORDER BY id),
+                ARRAY(SELECT id FROM tarot_readings WHERE id = ANY(changed) ORDER BY id)
+            );
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE TRIGGER trg_notify_readings_insert AFTER INSERT ON tarot_readings
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_notify_on_readings()
+        """,
+        """
+        CREATE TRIGGER trg_notify_readings_update AFTER UPDATE ON tarot_readings
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_notify_on_readings()
+        """,
+        """
+        CREATE TRIGGER trg_notify_readings_delete AFTER DELETE ON tarot_readings
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_notify_on_readings()
+        """,
+        """
+        CREATE TRIGGER trg_notify_cards_insert AFTER INSERT ON reading_cards
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_notify_on_cards()
+        """,
+        """
+        CREATE TRIGGER trg_notify_cards_update AFTER UPDATE ON reading_cards
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_notify_on_cards()
+        """,
+        """
+        CREATE TRIGGER trg_notify_cards_delete AFTER DELETE ON reading_cards
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_notify_on_cards()
+        """,
+    ]),
+    # 牌面共现：每个用户每对牌（以及每对“牌+牌位”）在同一次占卜中一起出现的次数，
+    # 只存非零的牌对（稀疏矩阵的上三角，按 (牌编号, 牌位) 排序）；
+    # 牌面增删改时只计算变化的牌与同一记录中其他牌组成的牌对，不重新扫描历史记录
+    Migration(9, "牌面共现投影表", [
+        """
+        CREATE TABLE IF NOT EXISTS card_pair_counts (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            card_a SMALLINT NOT NULL,
+            card_b SMALLINT NOT NULL,
+            together INTEGER NOT NULL,
+            PRIMARY KEY (user_id, card_a, card_b)
+        )
+        """,
+        # 没有牌位的牌记为空字符串
+        """
+        CREATE TABLE IF NOT EXISTS card_position_pair_counts (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            card_a SMALLINT NOT NULL,
+            position_a VARCHAR(50) NOT NULL,
+            card_b SMALLINT NOT NULL,
+            position_b VARCHAR(50) NOT NULL,
+            together INTEGER NOT NULL,
+            PRIMARY KEY (user_id, card_a, position_a, card_b, position_b)
+        )
+        """,
+        # added/removed 为同一条语句中新增和删除的牌面行（更新视为删除旧行再新增新行，
+        # 牌、牌位和所属记录都没变的行互相抵消，改解读文字不触碰共现计数）。
+        # 每个牌对只计一次：变化的牌与记录中其余未变化的牌各成一对，同时变化的牌之间按 id 只取一半
+        """
+        CREATE OR REPLACE FUNCTION tarot_apply_card_pairs(added reading_cards[], removed reading_cards[])
+        RETURNS VOID
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            touched INTEGER[];
+        BEGIN
+            WITH changed AS (
+                SELECT id, reading_id, card_id, position, SUM(sign) AS sign
+                FROM (
+                    SELECT c.id, c.reading_id, c.card_id, COALESCE(c.position, '') AS position, 1 AS sign
+                    FROM unnest(added) c
+                    UNION ALL
+                    SELECT c.id, c.reading_id, c.card_id, COALESCE(c.position, ''), -1
+                    FROM unnest(removed) c
+                ) changes
+                GROUP BY id, reading_id, card_id, position
+                HAVING SUM(sign) <> 0
+            ),
+            pairs AS (
+                SELECT c.reading_id, c.card_id AS card_x, c.position AS position_x,
+                       rc.card_id AS card_y, COALESCE(rc.position, '') AS position_y, c.sign
+                FROM changed c
+                JOIN reading_cards rc ON rc.reading_id = c.reading_id
+                WHERE NOT EXISTS (SELECT 1 FROM changed x WHERE x.id = rc.id)
+                UNION ALL
+                SELECT a.reading_id, a.card_id, a.position, b.card_id, b.position, a.sign
+                FROM changed a
+                JOIN changed b ON b.reading_id = a.reading_id AND b.sign = a.sign AND b.id > a.id
+            ),
+            ordered AS (
+                SELECT tr.user_id, o.card_a, o.position_a, o.card_b, o.position_b, p.sign
+                FROM pairs p
+                JOIN tarot_readings tr ON tr.id = p.reading_id
+                CROSS JOIN LATERAL (
+                    SELECT p.card_x, p.position_x, p.card_y, p.position_y
+                    WHERE (p.card_x, p.position_x) <= (p.card_y, p.position_y)
+                    UNION ALL
+                    SELECT p.card_y, p.position_y, p.card_x, p.position_x
+                    WHERE (p.card_x, p.position_x) > (p.card_y, p.position_y)
+                ) o(card_a, position_a, card_b, position_b)
+                WHERE p.card_x IS NOT NULL AND p.card_y IS NOT NULL
+            ),
+            card_pairs AS (
+                INSERT INTO card_pair_counts AS s (user_id, card_a, card_b, together)
+                SELECT user_id, card_a, card_b, SUM(sign)
+                FROM ordered
+                GROUP BY user_id, card_a, card_b
+                HAVING SUM(sign) <> 0
+                ON CONFLICT (user_id, card_a, card_b) DO UPDATE SET together = s.together + EXCLUDED.together
+                RETURNING user_id
+            ),
+            position_pairs AS (
+                INSERT INTO card_position_pair_counts AS s (user_id, card_a, position_a, card_b, position_b, together)
+                SELECT user_id, card_a, position_a, card_b, position_b, SUM(sign)
+                FROM ordered
+                GROUP BY user_id, card_a, position_a, card_b, position_b
+                HAVING SUM(sign) <> 0
+                ON CONFLICT (user_id, card_a, position_a, card_b, position_b)
+                DO UPDATE SET together = s.together + EXCLUDED.together
+                RETURNING user_id
+            )
+            SELECT ARRAY(SELECT user_id FROM card_pairs UNION SELECT user_id FROM position_pairs) INTO touched;
+
+            -- 计数归零的牌对直接移除，保持稀疏
+            IF cardinality(removed) > 0 THEN
+                DELETE FROM card_pair_counts WHERE user_id = ANY(touched) AND together = 0;
+                DELETE FROM card_position_pair_counts WHERE user_id = ANY(touched) AND together = 0;
+            END IF;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE FUNCTION tarot_pairs_on_cards() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM tarot_apply_card_pairs(ARRAY(SELECT n::reading_cards FROM new_rows n), '{}');
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM tarot_apply_card_pairs('{}', ARRAY(SELECT o::reading_cards FROM old_rows o));
+            ELSE
+                PERFORM tarot_apply_card_pairs(
+                    ARRAY(SELECT n::reading_cards FROM new_rows n),
+                    ARRAY(SELECT o::reading_cards FROM old_rows o)
+                );
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        """,
+        # 与统计投影相同：随记录级联删除的牌面找不到所属用户，在删除记录之前扣减；
+        # 删除用户时共现行已随用户级联删除，不需要（也不能再插入负数行）扣减
+        """
+        CREATE OR REPLACE FUNCTION tarot_pairs_before_reading_delete() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM users WHERE id = OLD.user_id) THEN
+                PERFORM tarot_apply_card_pairs('{}', ARRAY(SELECT rc FROM reading_cards rc WHERE rc.reading_id = OLD.id));
+            END IF;
+            RETURN OLD;
+        END
+        $$
+        """,
+        """
+        CREATE TRIGGER trg_pairs_readings_before_delete BEFORE DELETE ON tarot_readings
+        FOR EACH ROW EXECUTE FUNCTION tarot_pairs_before_reading_delete()
+        """,
+        """
+        CREATE TRIGGER trg_pairs_cards_insert AFTER INSERT ON reading_cards
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_pairs_on_cards()
+        """,
+        """
+        CREATE TRIGGER trg_pairs_cards_update AFTER UPDATE ON reading_cards
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_pairs_on_cards()
+        """,
+        """
+        CREATE TRIGGER trg_pairs_cards_delete AFTER DELETE ON reading_cards
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_pairs_on_cards()
+        """,
+        # 用已有数据初始化投影
+        "SELECT tarot_apply_card_pairs(ARRAY(SELECT rc FROM reading_cards rc), '{}')",
+    ]),
+    # 占卜结果：outcome 为 NULL 表示尚未记录，TRUE 表示预测应验，FALSE 表示没有应验。
+    # 命中率投影按 (用户, 牌, 正逆位) 和 (用户, 牌阵) 累计已记录结果的次数和应验次数，
+    # 只在结果、牌面或牌阵变化时更新对应的行
+    Migration(10, "占卜结果与命中率投影表", [
+        "ALTER TABLE tarot_readings ADD COLUMN IF NOT EXISTS outcome BOOLEAN",
+        """
+        CREATE TABLE IF NOT EXISTS card_outcome_counts (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            card_id SMALLINT NOT NULL,
+            reversed BOOLEAN NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, card_id, reversed)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS spread_outcome_counts (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            spread_type VARCHAR(50) NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, spread_type)
+        )
+        """,
+        # 牌面增删改：按所属记录当前的结果计入（更新视为删除旧行再新增新行）
+        """
+        CREATE OR REPLACE FUNCTION tarot_apply_card_outcomes(added reading_cards[], removed reading_cards[])
+        RETURNS VOID
+        LANGUAGE sql AS $$
+            INSERT INTO card_outcome_counts AS s (user_id, card_id, reversed, hits, total)
+            SELECT tr.user_id, c.card_id, c.reversed, SUM(c.sign * tr.outcome::INTEGER), SUM(c.sign)
+            FROM (
+                SELECT a.reading_id, a.card_id, a.reversed, 1 AS sign FROM unnest(added) a
+                UNION ALL
+                SELECT r.reading_id, r.card_id, r.reversed, -1 FROM unnest(removed) r
+            ) c
+            JOIN tarot_readings tr ON tr.id = c.reading_id
+            WHERE c.card_id IS NOT NULL AND tr.outcome IS NOT NULL
+            GROUP BY tr.user_id, c.card_id, c.reversed
+            HAVING SUM(c.sign) <> 0 OR SUM(c.sign * tr.outcome::INTEGER) <> 0
+            ON CONFLICT (user_id, card_id, reversed) DO UPDATE SET
+                hits = s.hits + EXCLUDED.hits,
+                total = s.total + EXCLUDED.total
+        $$
+        """,
+        # 记录增删改：牌阵按记录的结果计入；with_cards 时牌面也按记录当前的牌计入（只用于更新，
+        # 新增记录的牌面由牌面触发器计入，删除记录的牌面由删除前触发器扣减）
+        """
+        CREATE OR REPLACE FUNCTION tarot_apply_reading_outcomes(
+            added tarot_readings[], removed tarot_readings[], with_cards BOOLEAN
+        )
+        RETURNS VOID
+        LANGUAGE sql AS $$
+            INSERT INTO spread_outcome_counts AS s (user_id, spread_type, hits, total)
+            SELECT r.user_id, r.spread_type, SUM(r.sign * r.outcome::INTEGER), SUM(r.sign)
+            FROM (
+                SELECT a.user_id, a.spread_type, a.outcome, 1 AS sign FROM unnest(added) a
+                UNION ALL
+                SELECT o.user_id, o.spread_type, o.outcome, -1 FROM unnest(removed) o
+            ) r
+            WHERE r.outcome IS NOT NULL
+            GROUP BY r.user_id, r.spread_type
+            HAVING SUM(r.sign) <> 0 OR SUM(r.sign * r.outcome::INTEGER) <> 0
+            ON CONFLICT (user_id, spread_type) DO UPDATE SET
+                hits = s.hits + EXCLUDED.hits,
+                total = s.total + EXCLUDED.total;
+
+            INSERT INTO card_outcome_counts AS s (user_id, card_id, reversed, hits, total)
+            SELECT r.user_id, rc.card_id, rc.reversed, SUM(r.sign * r.outcome::INTEGER), SUM(r.sign)
+            FROM (
+                SELECT a.id, a.user_id, a.outcome, 1 AS sign FROM unnest(added) a
+                UNION ALL
+                SELECT o.id, o.user_id, o.outcome, -1 FROM unnest(removed) o
+            ) r
+            JOIN reading_cards rc ON rc.reading_id = r.id
+            WHERE with_cards AND r.outcome IS NOT NULL AND rc.card_id IS NOT NULL
+            GROUP BY r.user_id, rc.card_id, rc.reversed
+            HAVING SUM(r.sign) <> 0 OR SUM(r.sign * r.outcome::INTEGER) <> 0
+            ON CONFLICT (user_id, card_id, reversed) DO UPDATE SET
+                hits = s.hits + EXCLUDED.hits,
+                total = s.total + EXCLUDED.total;
+        $$
+        """,
+        # 删除用户时计数行已随用户级联删除，不再扣减（见共现投影）
+        """
+        CREATE OR REPLACE FUNCTION tarot_outcomes_on_readings() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM tarot_apply_reading_outcomes(
+                    ARRAY(SELECT n::tarot_readings FROM new_rows n WHERE n.outcome IS NOT NULL), '{}', FALSE
+                );
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM tarot_apply_reading_outcomes('{}', ARRAY(
+                    SELECT o::tarot_readings FROM old_rows o
+                    WHERE o.outcome IS NOT NULL AND EXISTS (SELECT 1 FROM users u WHERE u.id = o.user_id)
+                ), FALSE);
+            ELSE
+                PERFORM tarot_apply_reading_outcomes(
+                    ARRAY(SELECT n::tarot_readings FROM new_rows n WHERE n.outcome IS NOT NULL),
+                    ARRAY(SELECT o::tarot_readings FROM old_rows o WHERE o.outcome IS NOT NULL),
+                    TRUE
+                );
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE FUNCTION tarot_outcomes_before_reading_delete() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF OLD.outcome IS NOT NULL AND EXISTS (SELECT 1 FROM users WHERE id = OLD.user_id) THEN
+                PERFORM tarot_apply_card_outcomes('{}', ARRAY(SELECT rc FROM reading_cards rc WHERE rc.reading_id = OLD.id));
+            END IF;
+            RETURN OLD;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE FUNCTION tarot_outcomes_on_cards() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM tarot_apply_card_outcomes(ARRAY(SELECT n::reading_cards FROM new_rows n), '{}');
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM tarot_apply_card_outcomes('{}', ARRAY(SELECT o::reading_cards FROM old_rows o));
+            ELSE
+                PERFORM tarot_apply_card_outcomes(
+                    ARRAY(SELECT n::reading_cards FROM new_rows n),
+                    ARRAY(SELECT o::reading_cards FROM old_rows o)
+                );
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE TRIGGER trg_outcomes_readings_insert AFTER INSERT ON tarot_readings
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_outcomes_on_readings()
+        """,
+        """
+        CREATE TRIGGER trg_outcomes_readings_update AFTER UPDATE ON tarot_readings
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_outcomes_on_readings()
+        """,
+        """
+        CREATE TRIGGER trg_outcomes_readings_delete AFTER DELETE ON tarot_readings
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_outcomes_on_readings()
+        """,
+        """
+        CREATE TRIGGER trg_outcomes_readings_before_delete BEFORE DELETE ON tarot_readings
+        FOR EACH ROW EXECUTE FUNCTION tarot_outcomes_before_reading_delete()
+        """,
+        """
+        CREATE TRIGGER trg_outcomes_cards_insert AFTER INSERT ON reading_cards
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_outcomes_on_cards()
+        """,
+        """
+        CREATE TRIGGER trg_outcomes_cards_update AFTER UPDATE ON reading_cards
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_outcomes_on_cards()
+        """,
+        """
+        CREATE TRIGGER trg_outcomes_cards_delete AFTER DELETE ON reading_cards
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION tarot_outcomes_on_cards()
+        """,
+    ]),
+    # 删除用户时记录随用户级联删除，统计行也在被级联删除；删除前触发器此时再更新
+    # 统计行会违反外键约束。与共现、命中率投影相同，只扣减仍存在的用户
+    Migration(11, "删除用户时跳过统计扣减", [
+        """
+        CREATE OR REPLACE FUNCTION tarot_stats_before_reading_delete() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM users WHERE id = OLD.user_id) THEN
+                UPDATE user_reading_stats s SET
+                    card_counts = tarot_merge_counts(s.card_counts, (
+                        SELECT jsonb_object_agg(card_id, -n)
+                        FROM (
+                            SELECT card_id, COUNT(*) AS n
+                            FROM reading_cards
+                            WHERE reading_id = OLD.id AND card_id IS NOT NULL
+                            GROUP BY card_id
+                        ) grouped
+                    ))
+                WHERE s.user_id = OLD.user_id;
+            END IF;
+            RETURN OLD;
+        END
+        $$
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def _seed_cards_sqlite(cursor):
+    """写入标准 78 张牌（SQLite）"""
+    cursor.executemany(
+        """
+        INSERT OR IGNORE INTO cards (id, name_zh, name_en, arcana, suit, number)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        tarot_cards.CARDS
+    )
+
+
+def _sqlite_pair_delta(pairs, sign, user_id=None):
+    """把 pairs 查询（user_id, card_x, position_x, card_y, position_y）的牌对计入两张共现表
+
+    sign 为 1 或 -1；扣减时给出 user_id 表达式，顺带移除计数归零的牌对。删除用户时
+    共现行先随用户级联删除，之后记录的删除前触发器不能再插入负数行，所以只计入仍存在的用户。
+    """
+    statements = f"""
+        INSERT INTO card_pair_counts (user_id, card_a, card_b, together)
+        SELECT user_id, MIN(card_x, card_y), MAX(card_x, card_y), {sign} * COUNT(*)
+        FROM ({pairs})
+        WHERE user_id IN (SELECT id FROM users)
+        GROUP BY 1, 2, 3
+        ON CONFLICT (user_id, card_a, card_b) DO UPDATE SET together = together + excluded.together;
+        INSERT INTO card_position_pair_counts (user_id, card_a, position_a, card_b, position_b, together)
+        SELECT
+            user_id,
+            CASE WHEN swap THEN card_y ELSE card_x END,
+            CASE WHEN swap THEN position_y ELSE position_x END,
+            CASE WHEN swap THEN card_x ELSE card_y END,
+            CASE WHEN swap THEN position_x ELSE position_y END,
+            {sign} * COUNT(*)
+        FROM (SELECT *, (card_x, position_x) > (card_y, position_y) AS swap FROM ({pairs}))
+        WHERE user_id IN (SELECT id FROM users)
+        GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT (user_id, card_a, position_a, card_b, position_b)
+        DO UPDATE SET together = together + excluded.together;
+    """
+    if user_id is not None:
+        statements += f"""
+        DELETE FROM card_pair_counts WHERE user_id = {user_id} AND together = 0;
+        DELETE FROM card_position_pair_counts WHERE user_id = {user_id} AND together = 0;
+        """
+    return statements
+
+
+def _sqlite_card_pairs(row):
+    """触发器中的一行牌面（NEW/OLD）与同一记录中其余各牌组成的牌对"""
+    return f"""
+        SELECT tr.user_id, {row}.card_id AS card_x, COALESCE({row}.position, '') AS position_x,
+               rc.card_id AS card_y, COALESCE(rc.position, '') AS position_y
+        FROM reading_cards rc
+        JOIN tarot_readings tr ON tr.id = rc.reading_id
+        WHERE rc.reading_id = {row}.reading_id AND rc.id <> {row}.id
+          AND rc.card_id IS NOT NULL AND {row}.card_id IS NOT NULL
+    """
+
+
+# 一条记录中全部牌面两两组成的牌对（where 限定记录）
+_SQLITE_READING_PAIRS = """
+    SELECT tr.user_id, a.card_id AS card_x, COALESCE(a.position, '') AS position_x,
+           b.card_id AS card_y, COALESCE(b.position, '') AS position_y
+    FROM reading_cards a
+    JOIN reading_cards b ON b.reading_id = a.reading_id AND b.id > a.id
+    JOIN tarot_readings tr ON tr.id = a.reading_id
+    WHERE a.card_id IS NOT NULL AND b.card_id IS NOT NULL AND {where}
+"""
+
+
+def _backfill_card_pairs_sqlite(cursor):
+    """用已有数据初始化共现投影（SQLite 的 execute 一次只能执行一条语句）"""
+    for statement in _sqlite_pair_delta(_SQLITE_READING_PAIRS.format(where="true"), 1).split(";"):
+        if statement.strip():
+            cursor.execute(statement)
+
+
+# 命中率投影的增减量（SQLite 行级触发器），{row} 为触发器中的 NEW/OLD，sign 为 1/-1；
+# 与共现投影相同，只计入仍存在的用户
+_SQLITE_OUTCOME_UPSERT = """
+    ON CONFLICT ({key}) DO UPDATE SET hits = hits + excluded.hits, total = total + excluded.total;
+"""
+
+
+def _sqlite_card_outcome(row, sign):
+    """一行牌面按所属记录的结果计入 card_outcome_counts"""
+    return f"""
+        INSERT INTO card_outcome_counts (user_id, card_id, reversed, hits, total)
+        SELECT tr.user_id, {row}.card_id, {row}.reversed, {sign} * tr.outcome, {sign}
+        FROM tarot_readings tr
+        WHERE tr.id = {row}.reading_id AND tr.outcome IS NOT NULL AND {row}.card_id IS NOT NULL
+          AND tr.user_id IN (SELECT id FROM users)
+    """ + _SQLITE_OUTCOME_UPSERT.format(key="user_id, card_id, reversed")
+
+
+def _sqlite_reading_outcome(row, sign, with_cards):
+    """一条记录按其结果计入 spread_outcome_counts；with_cards 时它当前的牌面也计入 card_outcome_counts"""
+    statements = f"""
+        INSERT INTO spread_outcome_counts (user_id, spread_type, hits, total)
+        SELECT {row}.user_id, {row}.spread_type, {sign} * {row}.outcome, {sign}
+        WHERE {row}.outcome IS NOT NULL AND {row}.user_id IN (SELECT id FROM users)
+    """ + _SQLITE_OUTCOME_UPSERT.format(key="user_id, spread_type")
+    if with_cards:
+        statements += f"""
+        INSERT INTO card_outcome_counts (user_id, card_id, reversed, hits, total)
+        SELECT {row}.user_id, rc.card_id, rc.reversed, {sign} * {row}.outcome * COUNT(*), {sign} * COUNT(*)
+        FROM reading_cards rc
+        WHERE rc.reading_id = {row}.id AND rc.card_id IS NOT NULL
+          AND {row}.outcome IS NOT NULL AND {row}.user_id IN (SELECT id FROM users)
+        GROUP BY rc.card_id, rc.reversed
+    """ + _SQLITE_OUTCOME_UPSERT.format(key="user_id, card_id, reversed")
+    return statements
+
+
+# SQLite 没有语句级触发器和 tsvector：检索使用 FTS5（写入时由 Python 切分文本），
+# 统计直接在本地查询，不需要投影表；牌面共现用行级触发器维护（见下面的 _sqlite_pair_delta）
+SQLITE_MIGRATIONS = [
+    Migration(1, "基础表结构（与 PostgreSQL 结构版本 5 对应）", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            email VARCHAR(100),
+            created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            last_login TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tarot_readings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            spread_type VARCHAR(50) NOT NULL,
+            question TEXT,
+            reading_date TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            notes TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS cards (
+            id SMALLINT PRIMARY KEY,
+            name_zh VARCHAR(20) NOT NULL UNIQUE,
+            name_en VARCHAR(40) NOT NULL UNIQUE,
+            arcana VARCHAR(5) NOT NULL,
+            suit VARCHAR(10),
+            number SMALLINT NOT NULL
+        )
+        """,
+        _seed_cards_sqlite,
+        """
+        CREATE TABLE IF NOT EXISTS reading_cards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            reading_id INTEGER NOT NULL REFERENCES tarot_readings(id) ON DELETE CASCADE,
+            card_id SMALLINT REFERENCES cards(id),
+            card_name VARCHAR(100),
+            position VARCHAR(50),
+            reversed BOOLEAN NOT NULL DEFAULT 0,
+            interpretation TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+            language VARCHAR(10) DEFAULT 'zh_CN',
+            theme VARCHAR(20) DEFAULT 'light',
+            notification_enabled BOOLEAN DEFAULT 1
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_reading_cards_reading_id ON reading_cards (reading_id)",
+        """
+        CREATE INDEX IF NOT EXISTS idx_tarot_readings_user_date
+        ON tarot_readings (user_id, reading_date DESC, id DESC)
+        """,
+        # rowid 即记录ID；各列存放已切分好的单字/二元组文本
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS reading_search USING fts5(
+            question, card_names, body, user_id UNINDEXED
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_search_readings_delete
+        AFTER DELETE ON tarot_readings
+        BEGIN
+            DELETE FROM reading_search WHERE rowid = OLD.id;
+        END
+        """,
+    ]),
+    Migration(2, "登录会话表", [
+        """
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            selector CHAR(16) PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            verifier CHAR(64) NOT NULL,
+            created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            expires_at TIMESTAMP NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_user_sessions_expires_at ON user_sessions (expires_at)",
+    ]),
+    Migration(3, "占卜记录客户端ID", [
+        "ALTER TABLE tarot_readings ADD COLUMN client_id TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_tarot_readings_client_id ON tarot_readings (client_id)",
+    ]),
+    # 行级触发器：插入的牌与记录中已有的牌各成一对，删除的牌与剩下的牌各成一对，
+    # 每个牌对恰好在两张牌中较晚写入（较早删除）的那一次计入
+    Migration(4, "牌面共现投影表", [
+        """
+        CREATE TABLE IF NOT EXISTS card_pair_counts (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            card_a SMALLINT NOT NULL,
+            card_b SMALLINT NOT NULL,
+            together INTEGER NOT NULL,
+            PRIMARY KEY (user_id, card_a, card_b)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS card_position_pair_counts (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            card_a SMALLINT NOT NULL,
+            position_a VARCHAR(50) NOT NULL,
+            card_b SMALLINT NOT NULL,
+            position_b VARCHAR(50) NOT NULL,
+            together INTEGER NOT NULL,
+            PRIMARY KEY (user_id, card_a, position_a, card_b, position_b)
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_pairs_cards_insert
+        AFTER INSERT ON reading_cards
+        BEGIN
+            {_sqlite_pair_delta(_sqlite_card_pairs("NEW"), 1)}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_pairs_cards_update
+        AFTER UPDATE OF reading_id, card_id, position ON reading_cards
+        BEGIN
+            {_sqlite_pair_delta(_sqlite_card_pairs("OLD"), -1,
+                                "(SELECT user_id FROM tarot_readings WHERE id = OLD.reading_id)")}
+            {_sqlite_pair_delta(_sqlite_card_pairs("NEW"), 1)}
+        END
+        """,
+        # 随记录级联删除时记录已不存在，下面的 JOIN 为空，由记录的删除前触发器扣减
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_pairs_cards_delete
+        AFTER DELETE ON reading_cards
+        BEGIN
+            {_sqlite_pair_delta(_sqlite_card_pairs("OLD"), -1,
+                                "(SELECT user_id FROM tarot_readings WHERE id = OLD.reading_id)")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_pairs_readings_before_delete
+        BEFORE DELETE ON tarot_readings
+        BEGIN
+            {_sqlite_pair_delta(_SQLITE_READING_PAIRS.format(where="a.reading_id = OLD.id"), -1, "OLD.user_id")}
+        END
+        """,
+        _backfill_card_pairs_sqlite,
+    ]),
+    Migration(5, "占卜结果与命中率投影表", [
+        "ALTER TABLE tarot_readings ADD COLUMN outcome BOOLEAN",
+        """
+        CREATE TABLE IF NOT EXISTS card_outcome_counts (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            card_id SMALLINT NOT NULL,
+            reversed BOOLEAN NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, card_id, reversed)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS spread_outcome_counts (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            spread_type VARCHAR(50) NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, spread_type)
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_outcomes_readings_insert
+        AFTER INSERT ON tarot_readings
+        BEGIN
+            {_sqlite_reading_outcome("NEW", 1, with_cards=False)}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_outcomes_readings_update
+        AFTER UPDATE OF user_id, spread_type, outcome ON tarot_readings
+        BEGIN
+            {_sqlite_reading_outcome("OLD", -1, with_cards=True)}
+            {_sqlite_reading_outcome("NEW", 1, with_cards=True)}
+        END
+        """,
+        # 牌面随记录级联删除时记录已不存在，在删除记录之前连同牌面一起扣减
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_outcomes_readings_before_delete
+        BEFORE DELETE ON tarot_readings
+        BEGIN
+            {_sqlite_reading_outcome("OLD", -1, with_cards=True)}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_outcomes_cards_insert
+        AFTER INSERT ON reading_cards
+        BEGIN
+            {_sqlite_card_outcome("NEW", 1)}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_outcomes_cards_update
+        AFTER UPDATE OF reading_id, card_id, reversed ON reading_cards
+        BEGIN
+            {_sqlite_card_outcome("OLD", -1)}
+            {_sqlite_card_outcome("NEW", 1)}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_outcomes_cards_delete
+        AFTER DELETE ON reading_cards
+        BEGIN
+            {_sqlite_card_outcome("OLD", -1)}
+        END
+        """,
+    ]),
+]
+
+SQLITE_LATEST_VERSION = SQLITE_MIGRATIONS[-1].version
+
+# 防止多个客户端同时迁移的 advisory lock 编号
+MIGRATION_LOCK_ID = 7240601
+
+SCHEMA_VERSION_DDL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description TEXT,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+def get_schema_version(conn):
+    """查询当前结构版本，尚未迁移过的数据库返回 0"""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            version = cursor.fetchone()[0]
+        conn.commit()
+        return version
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        return 0
+
+
+def migrate(conn):
+    """把数据库升级到最新版本，返回升级后的版本号
+
+    所有待执行的迁移在同一个事务中完成，任何一步失败都会整体回滚。
+    """
+    version = get_schema_version(conn)
+    if version >= LATEST_VERSION:
+        return version
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+            cursor.execute(SCHEMA_VERSION_DDL)
+            # 拿到锁之后重新读取版本，其他客户端可能已经完成了迁移
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            version = cursor.fetchone()[0]
+
+            for migration in MIGRATIONS:
+                if migration.version <= version:
+                    continue
+                for statement in migration.statements:
+                    if callable(statement):
+                        statement(cursor)
+                    else:
+                        cursor.execute(statement)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                    (migration.version, migration.description)
+                )
+                version = migration.version
+                print(f"✅ 数据库迁移完成 [{migration.version}] {migration.description}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return version
+
+
+def migrate_sqlite(conn):
+    """把 SQLite 数据库升级到最新版本，返回升级后的版本号
+
+    conn 需以 isolation_level=None 打开，事务由这里显式控制。
+    """
+    try:
+        version = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+    except sqlite3.OperationalError:
+        version = 0
+    if version >= SQLITE_LATEST_VERSION:
+        return version
+
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(SCHEMA_VERSION_DDL)
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        version = cursor.fetchone()[0]
+
+        for migration in SQLITE_MIGRATIONS:
+            if migration.version <= version:
+                continue
+            for statement in migration.statements:
+                if callable(statement):
+                    statement(cursor)
+                else:
+                    cursor.execute(statement)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (migration.version, migration.description)
+            )
+            version = migration.version
+            print(f"✅ 数据库迁移完成 [{migration.version}] {migration.description}")
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    finally:
+        cursor.close()
+
+    return version
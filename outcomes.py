@@ -0,0 +1,200 @@
+# outcomes.py
+"""占卜结果与命中率统计
+
+日记中的问题多是可以事后验证的预测（“明天早上能不能在七点醒”）。记录的 outcome
+为 True 表示预测应验、False 表示没有应验、None 表示尚未记录：
+
+    tracker = OutcomeTracker(db_manager)
+    tracker.record(reading_id, True)
+    tracker.record_many({12: True, 13: False})
+    tracker.summary(user_id)    # 总体、按正逆位、按牌阵、按牌的命中率和 95% 置信区间
+
+已记录结果的次数和应验次数由数据库触发器维护在 card_outcome_counts（用户 x 牌 x 正逆位）
+和 spread_outcome_counts（用户 x 牌阵）两张投影表里（见 migrations.py 的“占卜结果与
+命中率投影表”），读取一个用户的全部计数至多 156 + 牌阵数行，与历史记录条数无关。
+命中率和 Wilson 置信区间对整张 78x2 的计数表一次向量化计算。
+"""
+import threading
+
+try:
+    import numpy
+except ImportError:  # 只在使用命中率统计时需要
+    numpy = None
+
+from analytics import CARD_COUNT, UserCache
+import tarot_cards
+
+# 双侧 95% 置信区间的正态分位数
+Z_95 = 1.959963984540054
+
+ORIENTATIONS = ("upright", "reversed")
+
+
+def wilson_interval(hits, totals, z=Z_95):
+    """逐元素的命中率及其 Wilson 置信区间 -> (rate, low, high)，次数为 0 处均为 NaN
+
+    比正态近似更适合次数少、命中率接近 0 或 1 的情况（单张牌往往只验证过几次）。
+    """
+    hits = numpy.asarray(hits, dtype=numpy.float64)
+    totals = numpy.asarray(totals, dtype=numpy.float64)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        rate = hits / totals
+        z2 = z * z
+        denominator = 1 + z2 / totals
+        center = (rate + z2 / (2 * totals)) / denominator
+        margin = z * numpy.sqrt(rate * (1 - rate) / totals + z2 / (4 * totals * totals)) / denominator
+    return rate, center - margin, center + margin
+
+
+def _entry(hits, total, rate, low, high):
+    """一组计数 -> 可直接转成 JSON 的字典"""
+    return {'hits': int(hits), 'total': int(total),
+            'rate': float(rate), 'low': float(low), 'high': float(high)}
+
+
+class OutcomeStats:
+    """一个用户的命中计数及其派生统计
+
+    card_hits/card_totals 为形状 (78, 2) 的数组，第二维 0 为正位、1 为逆位；
+    spreads 与 spread_hits/spread_totals 一一对应。按牌统计的是抽到该牌的占卜，
+    一次占卜有几张牌就计入几次；总体和按牌阵统计的是占卜次数。计数不再变化
+    （数据有变时整个实例被替换），算出的 summary 保存在实例上。
+    """
+
+    def __init__(self, card_hits, card_totals, spreads, spread_hits, spread_totals):
+        self.card_hits = numpy.asarray(card_hits, dtype=numpy.int64)
+        self.card_totals = numpy.asarray(card_totals, dtype=numpy.int64)
+        self.spreads = tuple(spreads)
+        self.spread_hits = numpy.asarray(spread_hits, dtype=numpy.int64)
+        self.spread_totals = numpy.asarray(spread_totals, dtype=numpy.int64)
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_rows(cls, card_rows, spread_rows):
+        """由 card_outcomes / spread_outcomes 语句的结果行构造"""
+        card_hits = numpy.zeros((CARD_COUNT, 2), dtype=numpy.int64)
+        card_totals = numpy.zeros((CARD_COUNT, 2), dtype=numpy.int64)
+        if card_rows:
+            count = len(card_rows)
+            card_ids = numpy.fromiter((row['card_id'] for row in card_rows), dtype=numpy.int64, count=count)
+            reversed_ = numpy.fromiter((bool(row['reversed']) for row in card_rows), dtype=numpy.int64, count=count)
+            # 每个 (牌, 正逆位) 在投影表中只有一行，直接按下标赋值
+            card_hits[card_ids, reversed_] = [row['hits'] for row in card_rows]
+            card_totals[card_ids, reversed_] = [row['total'] for row in card_rows]
+        return cls(
+            card_hits, card_totals,
+            [row['spread_type'] for row in spread_rows],
+            [row['hits'] for row in spread_rows],
+            [row['total'] for row in spread_rows],
+        )
+
+    def overall(self):
+        """全部已记录结果的占卜 -> (应验次数, 总次数)"""
+        return int(self.spread_hits.sum()), int(self.spread_totals.sum())
+
+    def by_orientation(self):
+        """按正逆位 -> (应验次数, 总次数)，两个长度为 2 的数组"""
+        return self.card_hits.sum(axis=0), self.card_totals.sum(axis=0)
+
+    def by_card(self):
+        """按牌（不分正逆位）-> (应验次数, 总次数)，两个长度为 78 的数组"""
+        return self.card_hits.sum(axis=1), self.card_totals.sum(axis=1)
+
+    def summary(self, min_total=1, z=Z_95):
+        """命中率看板需要的全部统计（可直接转成 JSON 的普通类型）
+
+        按牌的列表只包含至少验证过 min_total 次的牌，按验证次数从多到少排列。
+        """
+        with self._lock:
+            if (min_total, z) not in self._summaries:
+                self._summaries[min_total, z] = self._summary(min_total, z)
+            return self._summaries[min_total, z]
+
+    def _summary(self, min_total, z):
+        hits, total = self.overall()
+        overall = _entry(hits, total, *wilson_interval(hits, total, z))
+
+        orientation_hits, orientation_totals = self.by_orientation()
+        orientation_stats = wilson_interval(orientation_hits, orientation_totals, z)
+
+        spread_stats = wilson_interval(self.spread_hits, self.spread_totals, z)
+
+        card_hits, card_totals = self.by_card()
+        card_stats = wilson_interval(card_hits, card_totals, z)
+        oriented_stats = wilson_interval(self.card_hits, self.card_totals, z)
+        # 稳定排序保证次数相同时按编号
+        order = numpy.argsort(-card_totals, kind='stable')
+        order = order[card_totals[order] >= max(min_total, 1)]
+
+        cards = []
+        for card_id in order:
+            entry = {'card_id': int(card_id), 'name': tarot_cards.card_name(int(card_id))}
+            entry.update(_entry(card_hits[card_id], card_totals[card_id], *(s[card_id] for s in card_stats)))
+            for index, orientation in enumerate(ORIENTATIONS):
+                if self.card_totals[card_id, index]:
+                    entry[orientation] = _entry(self.card_hits[card_id, index], self.card_totals[card_id, index],
+                                                *(s[card_id, index] for s in oriented_stats))
+            cards.append(entry)
+
+        return {
+            'overall': overall,
+            'by_orientation': {
+                orientation: _entry(orientation_hits[index], orientation_totals[index],
+                                    *(s[index] for s in orientation_stats))
+                for index, orientation in enumerate(ORIENTATIONS) if orientation_totals[index]
+            },
+            'by_spread': {
+                spread: _entry(self.spread_hits[index], self.spread_totals[index], *(s[index] for s in spread_stats))
+                for index, spread in enumerate(self.spreads)
+            },
+            'by_card': cards,
+        }
+
+
+class OutcomeTracker:
+    """记录占卜结果并按用户缓存命中率统计
+
+    backend 为任意存储后端；带 generation() 的后端（ReadingCache）由其决定缓存
+    何时过期，否则经 record/record_many 写入时整体失效，其他写入后需调用
+    invalidate_user。最多缓存 max_users 个用户。
+    """
+
+    def __init__(self, backend, max_users=32):
+        if numpy is None:
+            raise RuntimeError("命中率统计需要安装 numpy")
+        self.backend = backend
+        self._cache = UserCache(backend, self._load, max_users)
+
+    def _load(self, user_id):
+        card_rows = self.backend.run_statement('card_outcomes', (user_id,))
+        spread_rows = self.backend.run_statement('spread_outcomes', (user_id,))
+        if card_rows is None or spread_rows is None:
+            return None
+        return OutcomeStats.from_rows(card_rows, spread_rows)
+
+    def invalidate_user(self, user_id):
+        """让该用户的统计在下次访问时重新读取"""
+        self._cache.invalidate_user(user_id)
+
+    def record(self, reading_id, outcome):
+        """记录一条占卜的结果（True 应验 / False 没有应验 / None 清除），记录存在且写入成功时返回 True"""
+        return self.record_many({reading_id: outcome}) == 1
+
+    def record_many(self, outcomes):
+        """批量记录结果（{记录ID: 结果}），返回更新的记录数，失败返回 None"""
+        try:
+            return self.backend.set_outcomes(outcomes)
+        finally:
+            # 后端没有代数时不知道这些记录属于哪个用户，整体失效
+            if getattr(self.backend, 'generation', None) is None:
+                self._cache.clear()
+
+    def stats(self, user_id):
+        """用户的 OutcomeStats（按代数缓存），读取失败时返回 None"""
+        return self._cache.get(user_id)
+
+    def summary(self, user_id, min_total=1):
+        """命中率看板统计，读取失败时返回 None"""
+        stats = self.stats(user_id)
+        return stats.summary(min_total) if stats is not None else None
@@ -0,0 +1,153 @@
+# password_hash.py
+"""带版本的密码哈希格式
+
+存储格式记录算法和代价参数，便于按部署调整登录的 CPU 开销：
+
+    $pbkdf2-sha256$i=600000$<盐>$<哈希>
+    $scrypt$n=16384,r=8,p=1$<盐>$<哈希>
+
+盐和哈希为不带填充的 base64。旧版本的 "salt$hash"（PBKDF2-SHA256，100000 次迭代，
+十六进制）仍可验证，needs_rehash 会要求把它升级为当前参数。
+"""
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+
+PBKDF2 = "pbkdf2-sha256"
+SCRYPT = "scrypt"
+
+LEGACY_ITERATIONS = 100000
+
+# OWASP 对 PBKDF2-SHA256 的推荐迭代次数；部署时可用 calibrate() 按目标延迟重新选择
+DEFAULT_PARAMS = {'algorithm': PBKDF2, 'iterations': 600000}
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def _scrypt(password, salt, n, r, p):
+    # maxmem 需略大于 scrypt 实际使用的 128 * r * (n + p) 字节
+    return hashlib.scrypt(
+        password, salt=salt, n=n, r=r, p=p,
+        maxmem=128 * r * (n + p + 2) + 1024 * 1024, dklen=HASH_BYTES
+    )
+
+
+def encode_params(params):
+    """参数字典 -> 格式头，如 "pbkdf2-sha256$i=600000" """
+    if params['algorithm'] == PBKDF2:
+        return f"{PBKDF2}$i={params['iterations']}"
+    if params['algorithm'] == SCRYPT:
+        return f"{SCRYPT}$n={params['n']},r={params['r']},p={params['p']}"
+    raise ValueError(f"不支持的密码哈希算法: {params['algorithm']}")
+
+
+def parse_params(text):
+    """格式头 -> 参数字典（encode_params 的逆操作）"""
+    algorithm, _, settings = text.strip('$').partition('$')
+    values = dict(item.split('=', 1) for item in settings.split(',') if item)
+    if algorithm == PBKDF2:
+        return {'algorithm': PBKDF2, 'iterations': int(values['i'])}
+    if algorithm == SCRYPT:
+        return {'algorithm': SCRYPT, 'n': int(values['n']), 'r': int(values['r']), 'p': int(values['p'])}
+    raise ValueError(f"不支持的密码哈希算法: {algorithm}")
+
+
+def _derive(password, salt, params):
+    password = password.encode('utf-8')
+    if params['algorithm'] == PBKDF2:
+        return hashlib.pbkdf2_hmac('sha256', password, salt, params['iterations'], HASH_BYTES)
+    if params['algorithm'] == SCRYPT:
+        return _scrypt(password, salt, params['n'], params['r'], params['p'])
+    raise ValueError(f"不支持的密码哈希算法: {params['algorithm']}")
+
+
+def hash_password(password, params=None):
+    """按 params（缺省为 DEFAULT_PARAMS）计算密码哈希"""
+    params = params or DEFAULT_PARAMS
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = _derive(password, salt, params)
+    return f"${encode_params(params)}${_b64encode(salt)}${_b64encode(digest)}"
+
+
+def _split(stored_hash):
+    """拆分存储的哈希 -> (参数, 盐, 哈希)；旧格式的参数为 None"""
+    if not stored_hash.startswith('$'):
+        return None, None, None
+    _, algorithm, settings, salt, digest = stored_hash.split('$')
+    return parse_params(f"{algorithm}${settings}"), _b64decode(salt), _b64decode(digest)
+
+
+def verify_password(password, stored_hash):
+    """验证密码（支持新旧两种格式）"""
+    try:
+        params, salt, digest = _split(stored_hash)
+        if params is None:
+            salt, legacy_hash = stored_hash.split('$')
+            new_hash = hashlib.pbkdf2_hmac(
+                'sha256', password.encode('utf-8'), salt.encode('utf-8'), LEGACY_ITERATIONS
+            ).hex()
+            return hmac.compare_digest(new_hash, legacy_hash)
+        return hmac.compare_digest(_derive(password, salt, params), digest)
+    except ValueError:
+        return False
+
+
+def needs_rehash(stored_hash, params=None):
+    """存储的哈希是否弱于当前参数（旧格式、算法不同或代价更低）"""
+    params = params or DEFAULT_PARAMS
+    try:
+        stored_params, _, _ = _split(stored_hash)
+    except ValueError:
+        return True
+    if stored_params is None or stored_params['algorithm'] != params['algorithm']:
+        return True
+    if params['algorithm'] == PBKDF2:
+        return stored_params['iterations'] < params['iterations']
+    return any(stored_params[key] < params[key] for key in ('n', 'r', 'p'))
+
+
+def _time_derive(params, rounds=3):
+    """多次计算取最短耗时，减少调度抖动的影响"""
+    best = None
+    salt = secrets.token_bytes(SALT_BYTES)
+    for _ in range(rounds):
+        start = time.perf_counter()
+        _derive("calibration", salt, params)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate(target_seconds=0.25, algorithm=PBKDF2):
+    """在本机上选择单次哈希耗时约为 target_seconds 的参数
+
+    PBKDF2 的耗时与迭代次数成正比，按一次试算线性换算；
+    scrypt 的 n 必须是 2 的幂，选不超过目标耗时的最大 n（不低于 2**14）。
+    """
+    if algorithm == PBKDF2:
+        probe = 20000
+        elapsed = _time_derive({'algorithm': PBKDF2, 'iterations': probe})
+        iterations = int(probe * target_seconds / elapsed) // 1000 * 1000
+        return {'algorithm': PBKDF2, 'iterations': max(iterations, LEGACY_ITERATIONS)}
+
+    if algorithm == SCRYPT:
+        params = {'algorithm': SCRYPT, 'n': 2 ** 14, 'r': 8, 'p': 1}
+        while params['n'] < 2 ** 20:
+            candidate = dict(params, n=params['n'] * 2)
+            if _time_derive(candidate, rounds=1) > target_seconds:
+                break
+            params = candidate
+        return params
+
+    raise ValueError(f"不支持的密码哈希算法: {algorithm}")
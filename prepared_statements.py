@@ -0,0 +1,58 @@
+# prepared_statements.py
+"""热点语句的服务端预备语句
+
+登录、历史分页、记录详情、设置等少数语句被反复执行。PostgreSQL 后端在每个连接上
+第一次用到时 PREPARE 一次，之后只发送 EXECUTE 和参数，省去每次的解析和规划；
+是否返回结果行、列名等结果形状也只在第一次执行时确定。
+连接断开重连后是新的连接对象，会在首次使用时重新准备。
+"""
+import threading
+import weakref
+
+
+class PreparedStatement:
+    """一条命名语句：原始 SQL（%s 占位符）及其 PREPARE / EXECUTE 文本"""
+
+    def __init__(self, name, query, returns_rows):
+        self.name = name
+        self.query = query
+        self.returns_rows = returns_rows
+
+        parts = query.split('%s')
+        self.param_count = len(parts) - 1
+        numbered = parts[0] + "".join(f"${index}{part}" for index, part in enumerate(parts[1:], 1))
+        self.prepare_sql = f"PREPARE {name} AS {numbered}"
+        if self.param_count:
+            self.execute_sql = f"EXECUTE {name} ({', '.join(['%s'] * self.param_count)})"
+        else:
+            self.execute_sql = f"EXECUTE {name}"
+        # 结果列名，第一次执行后记录
+        self.columns = None
+
+
+class PreparedStatementCache:
+    """记录每个连接上已经准备好的语句
+
+    以连接对象为弱引用键：连接关闭并被回收后记录随之消失，新连接从空集合开始。
+    """
+
+    def __init__(self):
+        self._prepared = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def is_prepared(self, conn, name):
+        with self._lock:
+            return name in self._prepared.get(conn, ())
+
+    def mark_prepared(self, conn, name):
+        with self._lock:
+            self._prepared.setdefault(conn, set()).add(name)
+
+    def forget(self, conn):
+        """连接上的预备语句已失效（如执行过 DISCARD ALL）"""
+        with self._lock:
+            self._prepared.pop(conn, None)
+
+
+# 同一连接池中的连接会被多个管理器借用，预备状态必须按连接全局记录
+shared_cache = PreparedStatementCache()
@@ -0,0 +1,198 @@
+# query_stats.py
+"""查询统计与慢查询日志
+
+存储后端的每条语句都记录耗时、返回/影响的行数、网络往返次数，并按规范化后的
+语句指纹（去掉字面量和占位符差异）汇总为延迟直方图。超过阈值的语句连同执行计划
+写入 tarot.slow_query 日志；可选地定期把统计写成 Prometheus 文本格式的文件。
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+slow_query_logger = logging.getLogger("tarot.slow_query")
+query_error_logger = logging.getLogger("tarot.query_error")
+
+# 直方图桶上界（秒），最后一个桶为 +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_COMMENT_PATTERN = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRING_PATTERN = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_PATTERN = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_PATTERN = re.compile(r"%s|\$\d+|\?")
+_LIST_PATTERN = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE_PATTERN = re.compile(r"\s+")
+
+
+def fingerprint(query):
+    """规范化语句：去掉注释和字面量，占位符统一为 ?，IN 列表折叠为 (?)，空白压缩"""
+    text = _COMMENT_PATTERN.sub(" ", query)
+    text = _STRING_PATTERN.sub("?", text)
+    text = _NUMBER_PATTERN.sub("?", text)
+    text = _PLACEHOLDER_PATTERN.sub("?", text)
+    text = _LIST_PATTERN.sub("(?)", text)
+    return _SPACE_PATTERN.sub(" ", text).strip()
+
+
+class QueryHistogram:
+    """单个语句指纹的累计统计"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.round_trips = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, elapsed, rows, round_trips, error):
+        self.count += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.rows += rows
+        self.round_trips += round_trips
+        if error:
+            self.errors += 1
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def quantile(self, q):
+        """按桶估算分位数（返回所在桶的上界）"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= target:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else self.max_time
+        return self.max_time
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_time': self.total_time,
+            'avg_time': self.total_time / self.count if self.count else 0.0,
+            'max_time': self.max_time,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'rows': self.rows,
+            'round_trips': self.round_trips,
+            'buckets': dict(zip(LATENCY_BUCKETS + (float('inf'),), self.buckets)),
+        }
+
+
+class QueryStats:
+    """按语句指纹汇总的查询统计（线程安全）
+
+    slow_query_threshold 为慢查询阈值（秒），None 表示不记录慢查询；
+    metrics_path 不为空时，每隔 metrics_interval 秒把统计写入该文件（Prometheus 文本格式）。
+    """
+
+    def __init__(self, slow_query_threshold=0.2, metrics_path=None, metrics_interval=15):
+        self.slow_query_threshold = slow_query_threshold
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._last_dump = time.monotonic()
+        self.last_error = None
+
+    def is_slow(self, elapsed):
+        """是否达到慢查询阈值"""
+        return self.slow_query_threshold is not None and elapsed >= self.slow_query_threshold
+
+    def record(self, query, elapsed, rows=0, round_trips=1, error=None, params=None, plan=None,
+               log_slow=True):
+        """记录一次语句执行；error 为异常对象，plan 为慢查询的执行计划文本
+
+        导出等本就耗时较长的批量语句传 log_slow=False，只计入统计，不写慢查询日志。
+        """
+        key = fingerprint(query)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = QueryHistogram()
+            histogram.add(elapsed, rows, round_trips, error is not None)
+            if error is not None:
+                self.last_error = error
+
+        if error is not None:
+            query_error_logger.error("查询执行失败 (%.1f ms): %s\n参数: %r\n错误: %s",
+                                     elapsed * 1000, key, params, error)
+        elif log_slow and self.is_slow(elapsed):
+            slow_query_logger.warning("慢查询 %.1f ms, %d 行, %d 次往返: %s\n参数: %r\n执行计划:\n%s",
+                                      elapsed * 1000, rows, round_trips, key, params,
+                                      plan or "(无)")
+
+        if self.metrics_path and time.monotonic() - self._last_dump >= self.metrics_interval:
+            self._last_dump = time.monotonic()
+            try:
+                self.write_prometheus(self.metrics_path)
+            except OSError as e:
+                print(f"❌ 写入查询统计失败: {e}")
+
+    def histogram(self, query_or_fingerprint):
+        """某个语句（原文或指纹均可）的统计字典，没有记录时返回 None"""
+        key = fingerprint(query_or_fingerprint)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            return histogram.as_dict() if histogram else None
+
+    def snapshot(self):
+        """全部指纹的统计字典，按总耗时降序"""
+        with self._lock:
+            items = [(key, histogram.as_dict()) for key, histogram in self._histograms.items()]
+        return dict(sorted(items, key=lambda item: item[1]['total_time'], reverse=True))
+
+    def reset(self):
+        """清空统计"""
+        with self._lock:
+            self._histograms.clear()
+            self.last_error = None
+
+    def prometheus_text(self):
+        """Prometheus 文本格式的统计"""
+        def label(key):
+            return key.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+        lines = [
+            "# HELP tarot_query_duration_seconds Statement latency by fingerprint.",
+            "# TYPE tarot_query_duration_seconds histogram",
+        ]
+        snapshot = self.snapshot()
+        for key, stats in snapshot.items():
+            fp = label(key)
+            cumulative = 0
+            for bound, count in stats['buckets'].items():
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f'tarot_query_duration_seconds_bucket{{fingerprint="{fp}",le="{le}"}} {cumulative}')
+            lines.append(f'tarot_query_duration_seconds_sum{{fingerprint="{fp}"}} {stats["total_time"]}')
+            lines.append(f'tarot_query_duration_seconds_count{{fingerprint="{fp}"}} {stats["count"]}')
+
+        for name, field, help_text in (
+            ("tarot_query_rows_total", "rows", "Rows returned or affected by fingerprint."),
+            ("tarot_query_round_trips_total", "round_trips", "Database round trips by fingerprint."),
+            ("tarot_query_errors_total", "errors", "Failed statements by fingerprint."),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for key, stats in snapshot.items():
+                lines.append(f'{name}{{fingerprint="{label(key)}"}} {stats[field]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """把统计写入文件（先写临时文件再替换，读取方不会看到半个文件）"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
@@ -0,0 +1,221 @@
+# reading_cache.py
+"""存储后端前的读穿透缓存
+
+记录详情、历史列表、分页、用户设置和统计在内存中按 LRU 保留有限条数。
+每个用户有一个代数（generation），该用户的任何写入都会让代数加一；
+缓存项记录写入时的代数，代数不一致即视为过期，不需要逐项查找失效。
+"""
+from collections import OrderedDict
+import threading
+
+
+class ReadingCache:
+    """包装任意 TarotStorageBackend 的读穿透 LRU 缓存
+
+    未缓存的方法（登录、检索等）原样转发给后端。命中时返回的是缓存中的同一个
+    对象，调用方不应修改。查询失败或结果为空时不缓存。
+    """
+
+    def __init__(self, backend, max_entries=512):
+        self.backend = backend
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = {}
+        # 无法确定写入涉及哪个用户时整体失效
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    # ---- 缓存基础操作 ----
+
+    def _generation(self, user_id):
+        return (self._epoch, self._generations.get(user_id, 0))
+
+    def _get(self, key):
+        """返回 (是否命中, 值)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                user_id, generation, value = entry
+                if generation == self._generation(user_id):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def _put(self, key, user_id, generation, value):
+        if not value:
+            return
+        with self._lock:
+            self._entries[key] = (user_id, generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _load(self, key, user_id, loader):
+        """按 key 读缓存，未命中时调用 loader 读取并以查询前的代数写入缓存"""
+        hit, value = self._get(key)
+        if hit:
+            return value
+        # 先取代数再查询：查询期间发生的写入会让这次结果立即过期
+        with self._lock:
+            generation = self._generation(user_id)
+        value = loader()
+        self._put(key, user_id, generation, value)
+        return value
+
+    def generation(self, user_id):
+        """该用户数据的当前代数，任何写入或失效后都会变化（供 analytics 等派生缓存使用）"""
+        with self._lock:
+            return self._generation(user_id)
+
+    def invalidate_user(self, user_id):
+        """让该用户的全部缓存项失效"""
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def clear(self):
+        """让全部缓存项失效"""
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+    def stats(self):
+        """缓存命中统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    # ---- 读取 ----
+
+    def get_reading_by_id(self, reading_id):
+        """根据ID获取占卜记录"""
+        key = ('reading', reading_id)
+        hit, reading = self._get(key)
+        if hit:
+            return reading
+        with self._lock:
+            epoch = self._epoch
+        reading = self.backend.get_reading_by_id(reading_id)
+        if reading:
+            # 查询前不知道记录属于哪个用户，只能按查询后的代数记录；
+            # 若查询期间该用户有写入，则下一次访问会重新读取
+            with self._lock:
+                generation = (epoch, self._generations.get(reading['user_id'], 0))
+            self._put(key, reading['user_id'], generation, reading)
+        return reading
+
+    def get_user_readings(self, user_id, limit=None):
+        """获取用户的占卜记录"""
+        return self._load(
+            ('readings', user_id, limit), user_id,
+            lambda: self.backend.get_user_readings(user_id, limit)
+        )
+
+    def get_user_readings_page(self, user_id, after=None, page_size=50):
+        """按键集分页获取占卜记录"""
+        return self._load(
+            ('page', user_id, after, page_size), user_id,
+            lambda: self.backend.get_user_readings_page(user_id, after, page_size)
+        )
+
+    def get_user_settings(self, user_id):
+        """获取用户设置"""
+        return self._load(
+            ('settings', user_id), user_id,
+            lambda: self.backend.get_user_settings(user_id)
+        )
+
+    def get_user_stats(self, user_id):
+        """获取用户统计信息"""
+        return self._load(
+            ('stats', user_id), user_id,
+            lambda: self.backend.get_user_stats(user_id)
+        )
+
+    def load_session(self, user_id, page_size=20):
+        """读取会话数据，并把其中的设置、统计和第一页记录放入缓存"""
+        with self._lock:
+            generation = self._generation(user_id)
+        session = self.backend.load_session(user_id, page_size)
+        if session is not None:
+            self._put(('settings', user_id), user_id, generation, session.settings)
+            self._put(('stats', user_id), user_id, generation, session.stats)
+            self._put(('page', user_id, None, page_size), user_id, generation, session.recent_readings)
+        return session
+
+    # ---- 写入（写后令相关用户的缓存失效） ----
+
+    def add_tarot_reading(self, user_id, spread_type, question, cards_data, notes=None):
+        """添加塔罗牌占卜记录"""
+        try:
+            return self.backend.add_tarot_reading(user_id, spread_type, question, cards_data, notes)
+        finally:
+            self.invalidate_user(user_id)
+
+    def add_tarot_readings_bulk(self, readings, page_size=1000):
+        """批量添加占卜记录"""
+        try:
+            return self.backend.add_tarot_readings_bulk(readings, page_size)
+        finally:
+            for user_id in {reading['user_id'] for reading in readings}:
+                self.invalidate_user(user_id)
+
+    def import_readings(self, readings, page_size=1000):
+        """导入历史记录"""
+        try:
+            return self.backend.import_readings(readings, page_size)
+        finally:
+            for user_id in {reading['user_id'] for reading in readings}:
+                self.invalidate_user(user_id)
+
+    def delete_reading(self, reading_id):
+        """删除占卜记录"""
+        with self._lock:
+            entry = self._entries.pop(('reading', reading_id), None)
+        try:
+            return self.backend.delete_reading(reading_id)
+        finally:
+            if entry is not None:
+                self.invalidate_user(entry[0])
+            else:
+                self.clear()
+
+    def set_outcome(self, reading_id, outcome):
+        """记录占卜结果"""
+        return self.set_outcomes({reading_id: outcome}) == 1
+
+    def set_outcomes(self, outcomes, batch_size=500):
+        """批量记录占卜结果"""
+        with self._lock:
+            entries = [self._entries.pop(('reading', reading_id), None) for reading_id in outcomes]
+        try:
+            return self.backend.set_outcomes(outcomes, batch_size)
+        finally:
+            if all(entry is not None for entry in entries):
+                for user_id in {entry[0] for entry in entries}:
+                    self.invalidate_user(user_id)
+            else:
+                self.clear()
+
+    def update_user_settings(self, user_id, language=None, theme=None, notification_enabled=None):
+        """更新用户设置"""
+        try:
+            return self.backend.update_user_settings(user_id, language, theme, notification_enabled)
+        finally:
+            self.invalidate_user(user_id)
@@ -0,0 +1,136 @@
+# reading_search.py
+"""占卜记录检索的文本工具
+
+索引和查询的切分在数据库函数 tarot_ngram_text 中完成（见 migrations.py），
+这里只负责规范化查询词、把查询词切成同样的片段，并在原文中生成带高亮的摘要。
+"""
+import html
+import re
+
+import tarot_cards
+
+WORD_PATTERN = re.compile(r'[A-Za-z0-9]+')
+CJK_PATTERN = re.compile(r'[㐀-鿿]+')
+
+
+def ngram_text(text):
+    """与数据库函数 tarot_ngram_text 相同的切分，供不支持该函数的后端（SQLite）使用"""
+    if not text:
+        return ""
+    tokens = [m.group(0).lower() for m in WORD_PATTERN.finditer(text)]
+    for m in CJK_PATTERN.finditer(text):
+        run = m.group(0)
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return " ".join(tokens)
+
+
+def normalize_keyword(keyword):
+    """去掉首尾空白，并把本身就是牌名的查询词换成标准中文名
+
+    整个查询词或其中以空白分隔的一段能识别为一张牌时（"星币三"、"17 The Star"、
+    "逆位太阳"），换成 "钱币三"、"星星"、"太阳"（正逆位不参与检索）；夹在其他文字
+    中的别名（"情人节" 中的 "情人"）保持原样，见 keyword_variants。
+    """
+    keyword = " ".join(keyword.split())
+    card_id, _ = tarot_cards.resolve_card(keyword) if keyword else (None, False)
+    if card_id is not None:
+        return tarot_cards.card_name(card_id)
+    tokens = []
+    for token in keyword.split(" "):
+        card_id, _ = tarot_cards.resolve_card(token) if token else (None, False)
+        tokens.append(tarot_cards.card_name(card_id) if card_id is not None else token)
+    return " ".join(tokens).strip()
+
+
+def keyword_variants(keyword):
+    """检索时任一命中即可的查询词 -> [原文, 牌名规范化后, 文中别名换成标准牌名后]
+
+    索引中只有标准的中英文牌名，所以牌名的各种写法要换成标准名检索；原文同样
+    保留，"死亡"、"情人节" 这样碰巧是别名或含有别名的词仍能命中问题和备注。
+    相同的写法只保留一项，查询词为空时返回空列表。
+    """
+    original = " ".join(keyword.split())
+    if not original:
+        return []
+    normalized = normalize_keyword(original)
+    parts = []
+    last = 0
+    for card_id, _, start, end in tarot_cards.find_cards(normalized):
+        parts.append(normalized[last:start])
+        parts.append(f" {tarot_cards.card_name(card_id)} ")
+        last = end
+    parts.append(normalized[last:])
+    canonical = " ".join("".join(parts).split())
+    return list(dict.fromkeys((original, normalized, canonical)))
+
+
+def query_terms(keyword):
+    """把查询词切成用于高亮的片段：英文按单词，中文按连续汉字串"""
+    terms = [m.group(0).lower() for m in WORD_PATTERN.finditer(keyword)]
+    for m in CJK_PATTERN.finditer(keyword):
+        run = m.group(0)
+        terms.append(run)
+        # 索引按二元组匹配，命中的记录不一定包含完整的连续查询词
+        terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    # 先匹配长片段，避免短片段把长片段拆开
+    return sorted(set(terms), key=len, reverse=True)
+
+
+def make_snippet(text, terms, width=40, mark=('<b>', '</b>')):
+    """截取第一个命中片段附近的文本并高亮所有命中，未命中时返回 None"""
+    if not text or not terms:
+        return None
+
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    first = pattern.search(text)
+    if first is None:
+        return None
+
+    start = max(0, first.start() - width // 2)
+    end = min(len(text), start + width)
+    window = text[start:end]
+
+    parts = []
+    last = 0
+    for match in pattern.finditer(window):
+        parts.append(html.escape(window[last:match.start()]))
+        parts.append(f"{mark[0]}{html.escape(match.group(0))}{mark[1]}")
+        last = match.end()
+    parts.append(html.escape(window[last:]))
+
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    return prefix + "".join(parts) + suffix
+
+
+def tsquery_sql(count, placeholder="%s"):
+    """把 count 个查询词（见 keyword_variants）组成任一命中即可的 tsquery 表达式
+
+    placeholder 为参数占位符，asyncpg 的编号占位符写作 "${}"（从 1 开始编号）。
+    """
+    return " || ".join(
+        f"plainto_tsquery('simple', tarot_ngram_text({placeholder.format(index + 1)}))" for index in range(count)
+    )
+
+
+def attach_snippets(readings, variants, fields=('question', 'card_names', 'notes', 'interpretations')):
+    """为每条检索结果加上 snippet：取命中片段最长的查询词，再按字段顺序取第一个命中的摘要
+
+    "情人节" 命中问题时高亮问题里的原文，而不是牌名列里的 "恋人"；"金币五" 只命中
+    牌名列时高亮标准名 "钱币五"。
+    """
+    term_lists = [query_terms(variant) for variant in variants]
+    for reading in readings:
+        best = (0, None)
+        for terms in term_lists:
+            for field in fields:
+                text = (reading[field] or "").lower()
+                # terms 按长度从长到短，第一个出现的就是最长的命中片段
+                longest = next((len(term) for term in terms if term in text), 0)
+                if longest > best[0]:
+                    best = (longest, make_snippet(reading[field], terms))
+                if longest:
+                    break
+        reading['snippet'] = best[1]
+    return readings
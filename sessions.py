@@ -0,0 +1,131 @@
+# sessions.py
+"""登录会话令牌与 last_login 合并写入
+
+“记住我”令牌形如 "<selector>.<validator>"：selector 是 user_sessions 表的主键，
+validator 只以 HMAC(selector, validator) 的形式保存在数据库中。恢复登录只需按主键
+查一行并做一次 HMAC 比较，不需要再做一次完整的密码派生。
+
+last_login 不必实时精确，登录时只记到内存缓冲中，每隔一段时间用一条语句批量写回，
+短时间内的大量登录不会变成大量的行更新。
+"""
+from datetime import datetime
+import hashlib
+import hmac
+import secrets
+import threading
+
+DEFAULT_SESSION_DAYS = 30
+SELECTOR_LENGTH = 16
+
+
+def new_token():
+    """生成新令牌，返回 (selector, validator, 完整令牌)"""
+    selector = secrets.token_hex(SELECTOR_LENGTH // 2)
+    validator = secrets.token_urlsafe(32)
+    return selector, validator, f"{selector}.{validator}"
+
+
+def split_token(token):
+    """拆分令牌，格式不对时返回 (None, None)"""
+    selector, sep, validator = (token or "").strip().partition('.')
+    if not sep or len(selector) != SELECTOR_LENGTH or not validator:
+        return None, None
+    return selector, validator
+
+
+def verifier_for(selector, validator):
+    """数据库中保存的校验值"""
+    return hmac.new(selector.encode('ascii'), validator.encode('ascii'), hashlib.sha256).hexdigest()
+
+
+def check_verifier(selector, validator, stored_verifier):
+    """常数时间比较校验值"""
+    return hmac.compare_digest(verifier_for(selector, validator), stored_verifier.strip())
+
+
+class LastLoginBuffer:
+    """合并 last_login 更新
+
+    touch() 只记录到内存，interval 秒后（或调用 flush() 时）用一条
+    UPDATE ... CASE 语句写回全部待更新用户；同一用户多次登录只写最后一次。
+    """
+
+    # 单条语句最多更新的用户数
+    BATCH_SIZE = 500
+
+    def __init__(self, backend, interval=30.0):
+        self.backend = backend
+        self.interval = interval
+        self._pending = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def touch(self, user_id, when=None):
+        """记录一次登录"""
+        with self._lock:
+            self._pending[user_id] = when or datetime.now()
+            if self._timer is None:
+                self._timer = threading.Timer(self.interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """立即写回全部待更新的 last_login，返回写入的用户数"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+
+        user_ids = list(pending)
+        written = 0
+        for start in range(0, len(user_ids), self.BATCH_SIZE):
+            batch = user_ids[start:start + self.BATCH_SIZE]
+            cases = " ".join("WHEN %s THEN %s" for _ in batch)
+            placeholders = ", ".join("%s" for _ in batch)
+            params = [value for user_id in batch for value in (user_id, pending[user_id])] + batch
+            result = self.backend.execute_query(
+                f"UPDATE users SET last_login = CASE id {cases} END WHERE id IN ({placeholders})",
+                params
+            )
+            if result is None:
+                # 写入失败：放回缓冲，下次再试（期间若有更新的登录时间则以新的为准）
+                with self._lock:
+                    retry = [user_id for user_id in batch if user_id not in self._pending]
+                for user_id in retry:
+                    self.touch(user_id, pending[user_id])
+            else:
+                written += len(batch)
+        return written
+
+
+class UserSession:
+    """登录后的会话数据：用户、设置、统计和第一页最近记录
+
+    由 load_session 一次查询填充，主窗口首屏直接使用这里的数据，不再逐项查询。
+    """
+
+    def __init__(self, user, settings, stats, recent_readings, page_size):
+        self.user = user
+        self.settings = settings
+        self.stats = stats
+        self.recent_readings = recent_readings
+        self.page_size = page_size
+        self.loaded_at = datetime.now()
+
+    @property
+    def user_id(self):
+        return self.user['id']
+
+    def next_page_after(self):
+        """继续翻页时传给 get_user_readings_page 的 after，没有更多记录时返回 None
+
+        尚未同步的离线记录（id 为 None，见 journal.py）不参与翻页。
+        """
+        loaded = [reading for reading in self.recent_readings if reading['id'] is not None]
+        if len(loaded) < self.page_size:
+            return None
+        last = loaded[-1]
+        return (last['reading_date'], last['id'])
@@ -0,0 +1,542 @@
+# storage_backend.py
+"""存储后端接口
+
+TarotPostgreSQLManager（PostgreSQL 服务器）和 TarotSQLiteManager（本地 SQLite 文件）
+都实现这里的接口。与方言无关的逻辑（注册、登录、分页读取等）写在基类中，
+通过子类的 execute_query 执行；SQL 统一使用 %s 占位符，由子类负责转换。
+"""
+from datetime import datetime, timedelta
+from functools import cached_property
+import threading
+
+import password_hash
+import sessions
+import tarot_cards
+
+
+def build_user_stats(row):
+    """把统计查询的一行整理成统计字典，没有记录时返回零值"""
+    if row is None:
+        row = {'total_readings': 0, 'last_reading': None, 'spread_counts': {}, 'card_counts': {}}
+
+    spread_counts = row['spread_counts'] or {}
+    favorite_spread = None
+    if spread_counts:
+        spread_type = max(spread_counts, key=spread_counts.get)
+        favorite_spread = {'spread_type': spread_type, 'count': spread_counts[spread_type]}
+
+    # 计数的键为字符串形式的牌编号（无法识别的自定义牌名为原文）
+    card_counts = row['card_counts'] or {}
+    favorite_card = None
+    if card_counts:
+        key = max(card_counts, key=card_counts.get)
+        card_id = int(key) if key.isdigit() else None
+        favorite_card = {
+            'card_id': card_id,
+            'name': tarot_cards.card_name(card_id) if card_id is not None else key,
+            'count': card_counts[key],
+        }
+
+    return {
+        'total_readings': row['total_readings'],
+        'last_reading': row['last_reading'],
+        'favorite_spread': favorite_spread,
+        'favorite_card': favorite_card,
+        'spread_counts': spread_counts,
+        'card_counts': card_counts,
+    }
+
+
+def create_backend(db_config):
+    """根据配置创建存储后端（未连接）"""
+    backend = _create_backend(db_config)
+    # 部署时校准过的密码哈希参数（见 password_hash.calibrate），缺省使用 DEFAULT_PARAMS
+    if db_config.get('password_hash'):
+        backend.password_params = password_hash.parse_params(db_config['password_hash'])
+    return backend
+
+
+def _create_backend(db_config):
+    # 慢查询阈值（毫秒）和查询统计文件均为可选配置
+    slow_query_ms = db_config.get('slow_query_ms', 200)
+    instrumentation = {
+        'slow_query_threshold': float(slow_query_ms) / 1000 if slow_query_ms is not None else None,
+        'metrics_path': db_config.get('metrics_path'),
+    }
+
+    if db_config.get('backend') == 'sqlite':
+        from Tarot_SQLite import TarotSQLiteManager
+        return TarotSQLiteManager(db_config['path'], **instrumentation)
+
+    from Tarot_PostgreSQL import TarotPostgreSQLManager
+    return TarotPostgreSQLManager(
+        dbname=db_config['dbname'],
+        user=db_config['user'],
+        password=db_config['password'],
+        host=db_config['host'],
+        port=db_config['port'],
+        pooled=True,
+        minconn=int(db_config.get('pool_min', 1)),
+        maxconn=int(db_config.get('pool_max', 10)),
+        **instrumentation
+    )
+
+
+class TarotStorageBackend:
+    """塔罗日记存储后端基类"""
+
+    # 新密码使用的哈希参数，None 表示 password_hash.DEFAULT_PARAMS
+    password_params = None
+
+    # 占卜记录查询（含牌面），{where} 处插入筛选条件；由子类按方言提供
+    READING_QUERY = None
+
+    # reading_date 转为 Unix 秒数（整数）的表达式，供统计分析批量读取；由子类按方言提供
+    EPOCH_EXPRESSION = None
+
+    def __init__(self):
+        # 合并 last_login 写入的缓冲，第一次记录登录时创建；锁只保护本实例的缓冲
+        self._last_login_buffer = None
+        self._last_login_lock = threading.Lock()
+
+    # ---- 子类必须实现 ----
+
+    def connect(self):
+        """连接数据库，成功返回 True"""
+        raise NotImplementedError
+
+    def close(self):
+        """关闭数据库连接"""
+        raise NotImplementedError
+
+    def is_connected(self):
+        """是否已连接"""
+        raise NotImplementedError
+
+    def connection(self):
+        """借出一个连接的上下文管理器"""
+        raise NotImplementedError
+
+    def execute_query(self, query, params=None, fetch=False):
+        """执行查询：fetch=True 返回字典列表，否则返回受影响行数，失败返回 None
+        （transaction() 块中失败时抛出异常）"""
+        raise NotImplementedError
+
+    def transaction(self):
+        """工作单元上下文管理器：块内语句只提交一次，嵌套时使用保存点"""
+        raise NotImplementedError
+
+    def in_transaction(self):
+        """当前线程是否处于 transaction() 块中"""
+        raise NotImplementedError
+
+    def initialize_database(self):
+        """初始化/升级表结构"""
+        raise NotImplementedError
+
+    def add_tarot_readings_bulk(self, readings, page_size=1000):
+        """批量添加占卜记录，按输入顺序返回新记录的ID列表
+
+        已写入过的 client_id 返回已有记录的ID，写入失败时返回 None。离线日志
+        （journal.JournaledBackend）另有不等待数据库的 enqueue_readings，返回 client_id。
+        """
+        raise NotImplementedError
+
+    def iter_user_readings(self, user_id, batch_size=500):
+        """逐条生成用户的全部占卜记录"""
+        raise NotImplementedError
+
+    def export_readings(self, on_reading, user_id=None):
+        """按用户、时间顺序把占卜记录（含牌面）逐条交给 on_reading，返回条数
+
+        user_id 为 None 时导出全部用户。记录为字典：id、user_id、username、spread_type、
+        question、reading_date、notes，以及 cards 列表（card_id、name、name_en、position、
+        reversed、interpretation）。内存占用与记录总数无关（见 export.py）。
+        """
+        raise NotImplementedError
+
+    def get_user_stats(self, user_id):
+        """获取用户统计信息"""
+        raise NotImplementedError
+
+    def search_readings(self, user_id, keyword, limit=20):
+        """检索占卜记录"""
+        raise NotImplementedError
+
+    def _load_session_data(self, user_id, page_size):
+        """读取会话所需的全部数据，返回字典：user、settings、stats（统计行）、readings；
+        用户不存在时返回 None"""
+        raise NotImplementedError
+
+    def _statement_queries(self):
+        """热点语句：名称 -> (SQL, 是否返回结果行)，子类可追加方言相关的语句"""
+        return {
+            'user_by_name': ("SELECT id, username, email, password_hash FROM users WHERE username = %s", True),
+            'user_exists': ("SELECT id FROM users WHERE username = %s", True),
+            'user_settings': ("""
+                SELECT user_id, language, theme, notification_enabled
+                FROM user_settings
+                WHERE user_id = %s
+                """, True),
+            'session_by_selector': ("""
+                SELECT u.id, u.username, u.email, s.verifier
+                FROM user_sessions s
+                JOIN users u ON u.id = s.user_id
+                WHERE s.selector = %s AND s.expires_at > %s
+                """, True),
+            'readings_all': (self.READING_QUERY.format(where="tr.user_id = %s"), True),
+            'readings_first_page': (self.READING_QUERY.format(where="tr.user_id = %s") + " LIMIT %s", True),
+            'readings_after': (self.READING_QUERY.format(
+                where="tr.user_id = %s AND (tr.reading_date, tr.id) < (%s, %s)"
+            ) + " LIMIT %s", True),
+            'reading_by_id': (self.READING_QUERY.format(where="tr.id = %s"), True),
+            # 离线日志中的记录以客户端生成的 client_id 查找（见 journal.py）
+            'reading_by_client_id': (self.READING_QUERY.format(where="tr.client_id = %s"), True),
+            # 统计分析用的扁平牌面（见 analytics.py），按时间顺序
+            'user_draws': ("""
+                SELECT tr.id AS reading_id, {epoch} AS reading_time, rc.card_id, rc.reversed
+                FROM tarot_readings tr
+                JOIN reading_cards rc ON rc.reading_id = tr.id
+                WHERE tr.user_id = %s AND rc.card_id IS NOT NULL
+                ORDER BY tr.reading_date, tr.id, rc.id
+                """.format(epoch=self.EPOCH_EXPRESSION.format(column="tr.reading_date")), True),
+            # 牌面共现投影（见 cooccurrence.py），每个用户最多 78*79/2 行
+            'card_pairs': ("""
+                SELECT card_a, card_b, together FROM card_pair_counts
+                WHERE user_id = %s AND together > 0
+                """, True),
+            'position_pairs': ("""
+                SELECT card_a, position_a, card_b, position_b, together FROM card_position_pair_counts
+                WHERE user_id = %s AND together > 0
+                """, True),
+            # 命中率投影（见 outcomes.py）
+            'card_outcomes': ("""
+                SELECT card_id, reversed, hits, total FROM card_outcome_counts
+                WHERE user_id = %s AND total > 0
+                """, True),
+            'spread_outcomes': ("""
+                SELECT spread_type, hits, total FROM spread_outcome_counts
+                WHERE user_id = %s AND total > 0
+                ORDER BY spread_type
+                """, True),
+        }
+
+    @cached_property
+    def statements(self):
+        """热点语句表（每个实例只构建一次）"""
+        return self._statement_queries()
+
+    def run_statement(self, name, params):
+        """执行登记的热点语句，返回值与 execute_query 相同
+
+        默认直接交给 execute_query；PostgreSQL 后端使用服务端预备语句。
+        """
+        query, returns_rows = self.statements[name]
+        return self.execute_query(query, params, fetch=returns_rows)
+
+    def _decode_reading(self, row):
+        """把查询结果行转换为统一的记录字典，子类按需覆盖"""
+        return row
+
+    # ---- 共用实现 ----
+
+    def hash_password(self, password):
+        """安全的密码哈希函数（带版本的格式，见 password_hash.py）"""
+        return password_hash.hash_password(password, self.password_params)
+
+    def verify_password(self, password, stored_hash):
+        """验证密码"""
+        return password_hash.verify_password(password, stored_hash)
+
+    def create_user(self, username, password, email=None):
+        """创建新用户（用户和默认设置在同一个事务中写入）"""
+        hashed_password = self.hash_password(password)
+
+        query = """
+        INSERT INTO users (username, password_hash, email, last_login)
+        VALUES (%s, %s, %s, %s) RETURNING id
+        """
+
+        try:
+            with self.transaction():
+                result = self.execute_query(
+                    query,
+                    (username, hashed_password, email, datetime.now()),
+                    fetch=True
+                )
+                user_id = result[0]['id']
+                # 创建用户设置
+                settings_query = "INSERT INTO user_settings (user_id) VALUES (%s)"
+                self.execute_query(settings_query, (user_id,))
+        except Exception as e:
+            print(f"❌ 创建用户失败: {e}")
+            return None
+
+        print(f"✅ 用户 '{username}' 创建成功，ID: {user_id}")
+        return user_id
+
+    def verify_user(self, username, password):
+        """验证用户登录"""
+        result = self.run_statement('user_by_name', (username,))
+
+        if result and len(result) > 0:
+            user = result[0]
+            stored_hash = user['password_hash']
+
+            # 验证密码
+            if self.verify_password(password, stored_hash):
+                if password_hash.needs_rehash(stored_hash, self.password_params):
+                    # 哈希参数已过时：按当前参数重新哈希，顺带写入登录时间
+                    self.execute_query(
+                        "UPDATE users SET last_login = %s, password_hash = %s WHERE id = %s",
+                        (datetime.now(), self.hash_password(password), user['id'])
+                    )
+                else:
+                    # 最后登录时间合并后批量写回
+                    self.record_login(user['id'])
+                print(f"✅ 用户 '{username}' 验证成功")
+                return {
+                    'id': user['id'],
+                    'username': user['username'],
+                    'email': user['email']
+                }
+            else:
+                print(f"❌ 密码错误")
+        else:
+            print(f"❌ 用户 '{username}' 不存在")
+
+        return None
+
+    def record_login(self, user_id):
+        """记录登录时间（先进入缓冲，见 sessions.LastLoginBuffer）"""
+        with self._last_login_lock:
+            if self._last_login_buffer is None:
+                self._last_login_buffer = sessions.LastLoginBuffer(self)
+        self._last_login_buffer.touch(user_id)
+
+    def flush_last_login(self):
+        """立即写回缓冲中的登录时间（关闭连接前调用）"""
+        if self._last_login_buffer is not None:
+            self._last_login_buffer.flush()
+
+    def create_session(self, user_id, days=sessions.DEFAULT_SESSION_DAYS):
+        """创建“记住我”会话，返回交给客户端保存的令牌，失败返回 None"""
+        selector, validator, token = sessions.new_token()
+        result = self.execute_query(
+            """
+            INSERT INTO user_sessions (selector, user_id, verifier, expires_at)
+            VALUES (%s, %s, %s, %s)
+            """,
+            (selector, user_id, sessions.verifier_for(selector, validator),
+             datetime.now() + timedelta(days=days))
+        )
+        return token if result else None
+
+    def restore_session(self, token):
+        """用令牌恢复登录（一次主键查找 + HMAC 比较），无效或过期返回 None"""
+        selector, validator = sessions.split_token(token)
+        if selector is None:
+            return None
+
+        result = self.run_statement('session_by_selector', (selector, datetime.now()))
+        if not result or not sessions.check_verifier(selector, validator, result[0]['verifier']):
+            return None
+
+        user = result[0]
+        self.record_login(user['id'])
+        print(f"✅ 用户 '{user['username']}' 会话已恢复")
+        return {
+            'id': user['id'],
+            'username': user['username'],
+            'email': user['email']
+        }
+
+    def load_session(self, user_id, page_size=20):
+        """一次读取用户、设置、统计和第一页最近记录，返回 sessions.UserSession"""
+        data = self._load_session_data(user_id, page_size)
+        if data is None:
+            return None
+        return sessions.UserSession(
+            user=data['user'],
+            settings=data['settings'],
+            stats=build_user_stats(data['stats']),
+            recent_readings=[self._decode_reading(row) for row in data['readings']],
+            page_size=page_size
+        )
+
+    def revoke_session(self, token):
+        """注销令牌对应的会话"""
+        selector, _ = sessions.split_token(token)
+        if selector is None:
+            return False
+        return bool(self.execute_query("DELETE FROM user_sessions WHERE selector = %s", (selector,)))
+
+    def purge_expired_sessions(self):
+        """删除已过期的会话，返回删除的条数"""
+        return self.execute_query("DELETE FROM user_sessions WHERE expires_at <= %s", (datetime.now(),))
+
+    def user_exists(self, username):
+        """检查用户是否存在"""
+        result = self.run_statement('user_exists', (username,))
+        return result is not None and len(result) > 0
+
+    def add_tarot_reading(self, user_id, spread_type, question, cards_data, notes=None):
+        """添加塔罗牌占卜记录，返回新记录的ID，失败时返回 None
+
+        JournaledBackend 的同名方法只写入本地日志，返回 client_id（str），
+        get_reading_by_id / delete_reading 同样接受它。
+        """
+        reading_ids = self.add_tarot_readings_bulk([{
+            'user_id': user_id,
+            'spread_type': spread_type,
+            'question': question,
+            'cards': cards_data,
+            'notes': notes
+        }])
+        if reading_ids:
+            print(f"✅ 占卜记录添加成功，ID: {reading_ids[0]}")
+            return reading_ids[0]
+        return None
+
+    def import_readings(self, readings, page_size=1000):
+        """导入带 client_id 的历史记录，按输入顺序返回新记录ID
+
+        已导入过的 client_id（包括同一批中重复的）对应 None，写入失败时返回 None。
+        """
+        if not readings:
+            return []
+
+        existing = set()
+        client_ids = [reading['client_id'] for reading in readings]
+        for start in range(0, len(client_ids), 500):
+            chunk = client_ids[start:start + 500]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            result = self.execute_query(
+                f"SELECT client_id FROM tarot_readings WHERE client_id IN ({placeholders})", chunk, fetch=True
+            )
+            if result is None:
+                return None
+            existing.update(str(row['client_id']) for row in result)
+
+        fresh = []
+        for reading in readings:
+            if reading['client_id'] not in existing:
+                existing.add(reading['client_id'])
+                fresh.append(reading)
+        new_ids = self.add_tarot_readings_bulk(fresh, page_size) if fresh else []
+        if new_ids is None:
+            return None
+        by_client_id = {reading['client_id']: reading_id for reading, reading_id in zip(fresh, new_ids)}
+        return [by_client_id.pop(client_id, None) for client_id in client_ids]
+
+    def get_user_readings(self, user_id, limit=None):
+        """获取用户的占卜记录"""
+        if limit:
+            result = self.run_statement('readings_first_page', (user_id, limit))
+        else:
+            result = self.run_statement('readings_all', (user_id,))
+
+        return [self._decode_reading(row) for row in result or []]
+
+    def get_user_readings_page(self, user_id, after=None, page_size=50):
+        """按键集分页获取占卜记录
+
+        after 为上一页最后一条记录的 (reading_date, id)，第一页传 None。
+        走 (user_id, reading_date DESC, id DESC) 索引，翻到多深都只读取一页数据。
+        """
+        if after is None:
+            result = self.run_statement('readings_first_page', (user_id, page_size))
+        else:
+            result = self.run_statement('readings_after', (user_id, after[0], after[1], page_size))
+
+        return [self._decode_reading(row) for row in result or []]
+
+    def get_reading_by_id(self, reading_id):
+        """根据ID获取占卜记录"""
+        result = self.run_statement('reading_by_id', (reading_id,))
+        return self._decode_reading(result[0]) if result else None
+
+    def get_readings_by_ids(self, reading_ids, chunk_size=500):
+        """按ID批量获取占卜记录（不存在的ID被忽略），查询失败时返回 None"""
+        readings = []
+        for start in range(0, len(reading_ids), chunk_size):
+            chunk = list(reading_ids[start:start + chunk_size])
+            placeholders = ", ".join(["%s"] * len(chunk))
+            result = self.execute_query(
+                self.READING_QUERY.format(where=f"tr.id IN ({placeholders})"), chunk, fetch=True
+            )
+            if result is None:
+                return None
+            readings.extend(self._decode_reading(row) for row in result)
+        return readings
+
+    def delete_reading(self, reading_id):
+        """删除占卜记录（牌面随外键级联删除）"""
+        result = self.execute_query("DELETE FROM tarot_readings WHERE id = %s", (reading_id,))
+
+        if result:
+            print(f"✅ 占卜记录 {reading_id} 删除成功")
+            return True
+        else:
+            print(f"❌ 占卜记录 {reading_id} 删除失败")
+            return False
+
+    def set_outcome(self, reading_id, outcome):
+        """记录占卜结果：True 为应验，False 为没有应验，None 为清除；记录不存在或失败时返回 False"""
+        return self.set_outcomes({reading_id: outcome}) == 1
+
+    def set_outcomes(self, outcomes, batch_size=500):
+        """批量记录占卜结果（{记录ID: 结果}），返回更新的记录数，失败返回 None
+
+        每批一条 UPDATE ... CASE 语句，全部批次在同一个事务中提交；命中率投影由触发器更新。
+        """
+        reading_ids = list(outcomes)
+        updated = 0
+        try:
+            with self.transaction():
+                for start in range(0, len(reading_ids), batch_size):
+                    batch = reading_ids[start:start + batch_size]
+                    cases = " ".join("WHEN %s THEN %s" for _ in batch)
+                    placeholders = ", ".join("%s" for _ in batch)
+                    params = [value for reading_id in batch for value in (reading_id, outcomes[reading_id])]
+                    # 全部为 None 时 CASE 没有类型，显式转换为布尔
+                    updated += self.execute_query(
+                        f"UPDATE tarot_readings SET outcome = CAST(CASE id {cases} END AS BOOLEAN) "
+                        f"WHERE id IN ({placeholders})",
+                        params + batch
+                    )
+        except Exception as e:
+            print(f"❌ 记录占卜结果失败: {e}")
+            return None
+        print(f"✅ 已记录 {updated} 条占卜结果")
+        return updated
+
+    def get_user_settings(self, user_id):
+        """获取用户设置"""
+        result = self.run_statement('user_settings', (user_id,))
+        return result[0] if result else None
+
+    def update_user_settings(self, user_id, language=None, theme=None, notification_enabled=None):
+        """更新用户设置"""
+        updates = []
+        params = []
+
+        for column, value in (('language', language), ('theme', theme),
+                              ('notification_enabled', notification_enabled)):
+            if value is not None:
+                updates.append(f"{column} = %s")
+                params.append(value)
+
+        if not updates:
+            return False
+
+        params.append(user_id)
+        query = f"UPDATE user_settings SET {', '.join(updates)} WHERE user_id = %s"
+
+        result = self.execute_query(query, params)
+        if result:
+            print("✅ 用户设置更新成功")
+            return True
+        else:
+            print("❌ 用户设置更新失败")
+            return False
@@ -0,0 +1,350 @@
+# tarot_cards.py
+"""标准 78 张塔罗牌目录与牌名解析
+
+牌的编号即数据库 cards 表的主键：0-21 为大阿尔卡那，
+22 起依次为权杖、圣杯、宝剑、钱币四个花色，每个花色 14 张（一至十、侍从、骑士、皇后、国王）。
+
+CARDS 中每张牌是一个不可变的 Card 记录（namedtuple，可直接作为 cards 表的一行写入）。
+日记、导入、检索和界面中出现的牌名都通过 resolve_card 解析为 (牌编号, 是否逆位)：
+全部别名（中英文名、常见异译、带编号的大阿尔卡那、各花色和点数的不同叫法）在导入时
+编译进一棵字典树，解析只需对规范化后的文本走一遍树，逆位/正位标记用另外两棵小树
+识别前缀和后缀。find_cards 用同一棵树在一段自由文本中找出提到的所有牌。
+"""
+from collections import namedtuple
+
+MAJOR_ARCANA = [
+    ("愚者", "The Fool"),
+    ("魔术师", "The Magician"),
+    ("女祭司", "The High Priestess"),
+    ("皇后", "The Empress"),
+    ("皇帝", "The Emperor"),
+    ("教皇", "The Hierophant"),
+    ("恋人", "The Lovers"),
+    ("战车", "The Chariot"),
+    ("力量", "Strength"),
+    ("隐士", "The Hermit"),
+    ("命运之轮", "Wheel of Fortune"),
+    ("正义", "Justice"),
+    ("倒吊人", "The Hanged Man"),
+    ("死神", "Death"),
+    ("节制", "Temperance"),
+    ("恶魔", "The Devil"),
+    ("高塔", "The Tower"),
+    ("星星", "The Star"),
+    ("月亮", "The Moon"),
+    ("太阳", "The Sun"),
+    ("审判", "Judgement"),
+    ("世界", "The World"),
+]
+
+# (花色代码, 中文, 英文)
+SUITS = [
+    ("wands", "权杖", "Wands"),
+    ("cups", "圣杯", "Cups"),
+    ("swords", "宝剑", "Swords"),
+    ("pentacles", "钱币", "Pentacles"),
+]
+
+# (点数, 中文, 英文)
+RANKS = [
+    (1, "一", "Ace"),
+    (2, "二", "Two"),
+    (3, "三", "Three"),
+    (4, "四", "Four"),
+    (5, "五", "Five"),
+    (6, "六", "Six"),
+    (7, "七", "Seven"),
+    (8, "八", "Eight"),
+    (9, "九", "Nine"),
+    (10, "十", "Ten"),
+    (11, "侍从", "Page"),
+    (12, "骑士", "Knight"),
+    (13, "皇后", "Queen"),
+    (14, "国王", "King"),
+]
+
+# 大阿尔卡那的其他写法（编号 -> 别名）
+MAJOR_ALIASES = {
+    1: ("魔法师",),
+    2: ("女教皇", "High Priestess"),
+    5: ("教宗", "祭司长"),
+    6: ("情人", "Lovers"),
+    7: ("Chariot",),
+    8: ("力", "Strength"),
+    9: ("隐者", "Hermit"),
+    10: ("幸运之轮", "命运轮", "Wheel"),
+    12: ("吊人", "倒悬者", "Hanged Man"),
+    13: ("死亡",),
+    15: ("魔鬼", "Devil"),
+    16: ("塔", "Tower"),
+    17: ("星", "Star"),
+    18: ("月", "Moon"),
+    19: ("日", "Sun"),
+    20: ("审判日", "Judgment"),
+    21: ("World",),
+}
+
+# 花色和点数的其他写法
+SUIT_ALIASES = {
+    "wands": (("权杖", "杖", "棍", "权仗"), ("Wands", "Wand", "Rods", "Staves", "Batons")),
+    "cups": (("圣杯", "杯"), ("Cups", "Cup", "Chalices")),
+    "swords": (("宝剑", "剑"), ("Swords", "Sword")),
+    "pentacles": (("钱币", "星币", "金币", "币"), ("Pentacles", "Pentacle", "Coins", "Disks")),
+}
+RANK_ALIASES = {
+    1: (("一", "王牌", "1", "首牌"), ("Ace", "One", "1")),
+    2: (("二", "2"), ("Two", "2")),
+    3: (("三", "3"), ("Three", "3")),
+    4: (("四", "4"), ("Four", "4")),
+    5: (("五", "5"), ("Five", "5")),
+    6: (("六", "6"), ("Six", "6")),
+    7: (("七", "7"), ("Seven", "7")),
+    8: (("八", "8"), ("Eight", "8")),
+    9: (("九", "9"), ("Nine", "9")),
+    10: (("十", "10"), ("Ten", "10")),
+    11: (("侍从", "侍者", "侍卫", "随从", "公主"), ("Page", "Princess")),
+    12: (("骑士",), ("Knight", "Prince")),
+    13: (("皇后", "王后"), ("Queen",)),
+    14: (("国王",), ("King",)),
+}
+
+ROMAN_NUMERALS = [
+    "0", "I", "II", "III", "IV", "V", "VI", "VII", "VIII", "IX", "X",
+    "XI", "XII", "XIII", "XIV", "XV", "XVI", "XVII", "XVIII", "XIX", "XX", "XXI",
+]
+
+# 正逆位标记（规范化后的写法 -> 是否逆位）
+ORIENTATION_PREFIXES = {"逆位": True, "逆": True, "reversed": True, "rev.": True,
+                        "正位": False, "正": False, "upright": False}
+ORIENTATION_SUFFIXES = {"(逆位)": True, "(逆)": True, "逆位": True, "(reversed)": True, "reversed": True,
+                        "(r)": True, "(正位)": False, "(正)": False, "正位": False, "(upright)": False}
+
+# 规范化：去空白、小写、全角括号转半角
+_TRANSLATION = str.maketrans({"（": "(", "）": ")", "　": None, " ": None, "\t": None, "\n": None, "\r": None})
+
+
+class Card(namedtuple('Card', ['id', 'name_zh', 'name_en', 'arcana', 'suit', 'number'])):
+    """一张牌：编号、中文名、英文名、大/小阿尔卡那、花色（大阿尔卡那为 None）、编号或点数"""
+
+    __slots__ = ()
+
+    @property
+    def is_major(self):
+        return self.arcana == "major"
+
+
+def _build_cards():
+    """生成 78 张牌"""
+    cards = []
+    for number, (name_zh, name_en) in enumerate(MAJOR_ARCANA):
+        cards.append(Card(number, name_zh, name_en, "major", None, number))
+    for suit, suit_zh, suit_en in SUITS:
+        for rank, rank_zh, rank_en in RANKS:
+            cards.append(Card(
+                len(cards), f"{suit_zh}{rank_zh}", f"{rank_en} of {suit_en}", "minor", suit, rank
+            ))
+    return tuple(cards)
+
+
+CARDS = _build_cards()
+
+
+def _normalize(text):
+    """去掉空白和大小写差异，统一括号"""
+    return text.translate(_TRANSLATION).lower()
+
+
+class AliasTrie:
+    """规范化别名 -> 值 的字典树
+
+    节点是 {字符: 子节点下标} 的字典，值单独存放；查找只做逐字符的字典访问。
+    """
+
+    __slots__ = ('_children', '_values')
+
+    def __init__(self, entries=()):
+        self._children = [{}]
+        self._values = [None]
+        for key, value in entries:
+            self.add(key, value)
+
+    def add(self, key, value):
+        node = 0
+        for char in key:
+            child = self._children[node].get(char)
+            if child is None:
+                child = len(self._children)
+                self._children[node][char] = child
+                self._children.append({})
+                self._values.append(None)
+            node = child
+        self._values[node] = value
+
+    def __len__(self):
+        return sum(1 for value in self._values if value is not None)
+
+    def get(self, key):
+        """整串匹配，没有时返回 None"""
+        children = self._children
+        node = 0
+        for char in key:
+            node = children[node].get(char)
+            if node is None:
+                return None
+        return self._values[node]
+
+    def longest_prefix(self, text, start=0):
+        """从 start 开始最长的匹配 -> (值, 结束位置)，没有时返回 (None, start)"""
+        children = self._children
+        values = self._values
+        node = 0
+        found = (None, start)
+        for index in range(start, len(text)):
+            node = children[node].get(text[index])
+            if node is None:
+                break
+            if values[node] is not None:
+                found = (values[node], index + 1)
+        return found
+
+
+def _card_aliases():
+    """每张牌的全部别名 -> [(规范化别名, 牌编号)]"""
+    aliases = []
+    for card in CARDS:
+        names = [card.name_zh, card.name_en]
+        if card.is_major:
+            names.extend(MAJOR_ALIASES.get(card.number, ()))
+            english = [name for name in names if name.isascii()]
+            names.extend(name[4:] for name in english if name.startswith("The "))
+            # "17 The Star"、"XVII The Star"、"17 星星"
+            numbered = []
+            for name in names:
+                numbered.append(f"{card.number}{name}")
+                if name.isascii():
+                    numbered.append(f"{ROMAN_NUMERALS[card.number]}{name}")
+            names.extend(numbered)
+        else:
+            suits_zh, suits_en = SUIT_ALIASES[card.suit]
+            ranks_zh, ranks_en = RANK_ALIASES[card.number]
+            names.extend(suit + rank for suit in suits_zh for rank in ranks_zh)
+            names.extend(f"{rank} of {suit}" for rank in ranks_en for suit in suits_en)
+        aliases.extend((_normalize(name), card.id) for name in names)
+    return aliases
+
+
+_CARD_TRIE = AliasTrie()
+for _alias, _card_id in _card_aliases():
+    # 别名冲突时以先写入的为准（标准名先于异译写入）
+    if _CARD_TRIE.get(_alias) is None:
+        _CARD_TRIE.add(_alias, _card_id)
+_BRACKET_SUFFIX_TRIE = AliasTrie(
+    (_normalize(marker), reversed_) for marker, reversed_ in ORIENTATION_SUFFIXES.items() if marker.startswith("(")
+)
+_PREFIX_TRIE = AliasTrie((_normalize(marker), reversed_) for marker, reversed_ in ORIENTATION_PREFIXES.items())
+# 后缀按倒序存放，从文本末尾往前匹配
+_SUFFIX_TRIE = AliasTrie((_normalize(marker)[::-1], reversed_) for marker, reversed_ in ORIENTATION_SUFFIXES.items())
+
+
+def resolve_card(text):
+    """把牌名解析为 (牌编号, 是否逆位)，无法识别时牌编号为 None
+
+    支持 "逆位宝剑一"、"逆 权杖四"、"宝剑一（逆位）"、"正位正义"、"17 The Star"、
+    "Ace of Coins"、"星币三" 等写法。
+    """
+    name = _normalize(text)
+    card_id = _CARD_TRIE.get(name)
+    if card_id is not None:
+        return card_id, False
+
+    prefix, prefix_end = _PREFIX_TRIE.longest_prefix(name)
+    suffix, suffix_length = _SUFFIX_TRIE.longest_prefix(name[::-1])
+    # 依次尝试去掉前缀、后缀、两者（"正义" 中的 "正" 不是正位标记，上面已整串命中）
+    for start, end in ((prefix_end, len(name)), (0, len(name) - suffix_length),
+                       (prefix_end, len(name) - suffix_length)):
+        if (start, end) == (0, len(name)) or start >= end:
+            continue
+        card_id = _CARD_TRIE.get(name[start:end])
+        if card_id is not None:
+            return card_id, bool((start and prefix) or (end < len(name) and suffix))
+    return None, False
+
+
+def _is_mention(text, positions, start, end):
+    """匹配是否是一个完整的牌名：单字别名（"日"、"月"）不算，英文名前后不能紧接字母"""
+    if end - start < 2:
+        return False
+    first, last = positions[start], positions[end - 1]
+    if text[first].isascii() and first > 0 and text[first - 1].isascii() and text[first - 1].isalpha():
+        return False
+    if text[last].isascii() and last + 1 < len(text) and text[last + 1].isascii() and text[last + 1].isalpha():
+        return False
+    return True
+
+
+def find_cards(text):
+    """找出一段文本中提到的牌 -> [(牌编号, 是否逆位, 起始位置, 结束位置)]
+
+    位置为原文中的下标。匹配时忽略空白和大小写，同一位置取最长的牌名。
+    """
+    # 规范化后的字符及其在原文中的位置
+    positions = []
+    chars = []
+    for index, char in enumerate(text):
+        normalized = char.translate(_TRANSLATION).lower()
+        if normalized:
+            chars.append(normalized)
+            positions.append(index)
+    normalized = "".join(chars)
+
+    found = []
+    index = 0
+    while index < len(normalized):
+        reversed_, start = _PREFIX_TRIE.longest_prefix(normalized, index)
+        card_id, end = _CARD_TRIE.longest_prefix(normalized, start)
+        if card_id is None and start != index:
+            reversed_ = None
+            card_id, end = _CARD_TRIE.longest_prefix(normalized, index)
+        if card_id is None or not _is_mention(text, positions, index, end):
+            index += 1
+            continue
+        # 自由文本中只认括号形式的后缀，"太阳逆位宝剑一" 中的 "逆位" 属于后一张牌
+        suffix, suffix_end = _BRACKET_SUFFIX_TRIE.longest_prefix(normalized, end)
+        if reversed_ is None:
+            reversed_ = bool(suffix)
+        found.append((card_id, bool(reversed_), positions[index], positions[suffix_end - 1] + 1))
+        index = suffix_end
+    return found
+
+
+def card(card_id):
+    """编号对应的 Card"""
+    return CARDS[card_id]
+
+
+def card_name(card_id):
+    """牌的中文名"""
+    return CARDS[card_id].name_zh
+
+
+def card_label(name, reversed_=False, position=None):
+    """日记和界面中的牌面写法，如 "逆位宝剑一"、"愚者（过去）" """
+    label = f"逆位{name}" if reversed_ else name
+    if position:
+        label += f"（{position}）"
+    return label
+
+
+def parse_card_data(card):
+    """把写入接口的牌面字典解析为 (牌编号, 自定义牌名, 是否逆位)
+
+    card 可以直接给出 card_id，也可以只给 name；orientation 为 'reversed' 或牌名
+    带逆位标记时记为逆位。无法识别的牌名原样保存在自定义牌名中。
+    """
+    card_id = card.get('card_id')
+    reversed_ = card.get('reversed', False) or card.get('orientation') == 'reversed'
+    if card_id is None:
+        card_id, name_reversed = resolve_card(card['name'])
+        reversed_ = reversed_ or name_reversed
+    custom_name = card['name'] if card_id is None else None
+    return card_id, custom_name, reversed_